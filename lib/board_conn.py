@@ -0,0 +1,168 @@
+import logging
+import os
+import time
+import threading
+import subprocess
+
+def get_remote_cmd(embexp_box_path, board_type):
+	return [os.path.join(embexp_box_path, "interface/remote.py"), board_type]
+
+# long-lived board connections, one per embexp instance index (like running EmbExp-Box/interface/remote.py in a separate terminal)
+# - the connection processes get the index in EMBEXP_INSTANCE_IDX, like the make calls of the progplatform
+# - a supervisor thread restarts connections that terminate, and connections of boards with restart_after failed experiments in a row
+# - connections terminating before they are established are restarted with an exponential backoff (restart_delay, doubled up to max_restart_delay),
+#   the supervisor gives up on a connection after max_restarts such terminations in a row
+# - a (re)started connection is considered established after connect_time, wait_ready blocks until then
+# - the experiments use the established connections (conn_mode "run")
+class BoardConnections:
+	def __init__(self, remote_cmd, indexes, connect_time = 30, restart_after = 3, poll_time = 1, cwd = None, restart_delay = 1, max_restart_delay = 300, max_restarts = 10):
+		self.remote_cmd = remote_cmd
+		self.indexes = list(indexes)
+		self.connect_time = connect_time
+		self.restart_after = restart_after
+		self.poll_time = poll_time
+		self.cwd = cwd
+		self.restart_delay = restart_delay
+		self.max_restart_delay = max_restart_delay
+		self.max_restarts = max_restarts
+		self.show_outputs = logging.getLogger().level <= logging.DEBUG
+
+		self.lock = threading.Lock()
+		self.conns = {}
+		for idx in self.indexes:
+			self.conns[idx] = {"proc": None, "ready_at": None, "restart_at": None, "n_starts": 0, "n_failures": 0, "n_terminations": 0}
+
+		self.stopping = threading.Event()
+		self.supervisor = None
+
+	def _start(self, idx):
+		# with lock
+		conn = self.conns[idx]
+		env = dict(os.environ)
+		if idx != None:
+			env["EMBEXP_INSTANCE_IDX"] = str(idx)
+		output_file = None if self.show_outputs else subprocess.DEVNULL
+		logging.info(f"connecting to board (conn idx={idx})")
+		conn["proc"] = subprocess.Popen(self.remote_cmd, env=env, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=output_file, stderr=output_file)
+		conn["ready_at"] = time.time() + self.connect_time
+		conn["restart_at"] = None
+		conn["n_starts"] += 1
+		conn["n_failures"] = 0
+
+	def _schedule_restart(self, idx, established, reason):
+		# with lock, the supervisor starts the connection again after the backoff
+		conn = self.conns[idx]
+		conn["proc"] = None
+		conn["n_terminations"] = 1 if established else (conn["n_terminations"] + 1)
+		if conn["n_terminations"] > self.max_restarts:
+			conn["restart_at"] = None
+			logging.error(f"board connection failed {conn['n_terminations']} times in a row, giving up (conn idx={idx}): {reason}")
+			return
+		delay = min(self.restart_delay * (2 ** (conn["n_terminations"] - 1)), self.max_restart_delay)
+		conn["restart_at"] = time.time() + delay
+		logging.warning(f"board connection {reason}, restarting in {delay:.1f}s (conn idx={idx})")
+
+	def _take_proc(self, idx):
+		# with lock, the process is then stopped outside of the lock (_stop)
+		conn = self.conns[idx]
+		proc = conn["proc"]
+		conn["proc"] = None
+		conn["restart_at"] = None
+		return proc
+
+	def _stop(proc):
+		if proc == None or proc.poll() != None:
+			return
+		proc.terminate()
+		try:
+			proc.wait(timeout=10)
+		except subprocess.TimeoutExpired:
+			proc.kill()
+			proc.wait()
+
+	def restart(self, idx):
+		with self.lock:
+			proc = self._take_proc(idx)
+		BoardConnections._stop(proc)
+		with self.lock:
+			conn = self.conns[idx]
+			if conn["proc"] != None:
+				return
+			# explicit restarts start over with the backoff
+			conn["n_terminations"] = 0
+			try:
+				self._start(idx)
+			except Exception as e:
+				self._schedule_restart(idx, False, f"could not be started ({e})")
+
+	def start(self):
+		with self.lock:
+			for idx in self.indexes:
+				self._start(idx)
+		self.supervisor = threading.Thread(target=self._supervise, name="board-connections", daemon=True)
+		self.supervisor.start()
+
+	def _supervise(self):
+		while not self.stopping.wait(self.poll_time):
+			try:
+				self._check_conns()
+			except Exception as e:
+				logging.error(f"supervising the board connections failed: {e}")
+
+	def _check_conns(self):
+		with self.lock:
+			for idx in self.indexes:
+				conn = self.conns[idx]
+				proc = conn["proc"]
+				if proc != None and proc.poll() != None:
+					# terminations after the connection was established do not count for the backoff
+					self._schedule_restart(idx, time.time() >= conn["ready_at"], f"terminated with {proc.returncode}")
+				elif proc == None and conn["restart_at"] != None and time.time() >= conn["restart_at"]:
+					try:
+						self._start(idx)
+					except Exception as e:
+						self._schedule_restart(idx, False, f"could not be started ({e})")
+
+	def is_alive(self, idx):
+		with self.lock:
+			proc = self.conns[idx]["proc"]
+			return proc != None and proc.poll() == None
+
+	def wait_ready(self, idx):
+		while True:
+			with self.lock:
+				wait_time = self.conns[idx]["ready_at"] - time.time()
+			if wait_time <= 0:
+				return
+			logging.info(f"waiting {wait_time:.1f}s for the board connection (conn idx={idx})")
+			time.sleep(wait_time)
+
+	def report(self, idx, success):
+		# outcome of an experiment on the connection
+		with self.lock:
+			conn = self.conns[idx]
+			conn["n_failures"] = 0 if success else (conn["n_failures"] + 1)
+			if conn["n_failures"] < self.restart_after:
+				return
+			logging.warning(f"{conn['n_failures']} failed experiments in a row, reconnecting (conn idx={idx})")
+		self.restart(idx)
+
+	def close(self):
+		self.stopping.set()
+		if self.supervisor != None:
+			self.supervisor.join()
+		with self.lock:
+			procs = list(map(self._take_proc, self.indexes))
+		for proc in procs:
+			BoardConnections._stop(proc)
+
+	def get_stats_str(self, idx):
+		n_starts = self.conns[idx]["n_starts"]
+		return f"{n_starts} connects ({max(0, n_starts - 1)} restarts)"
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
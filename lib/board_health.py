@@ -0,0 +1,151 @@
+import logging
+import time
+import json
+import random
+import collections
+
+import logsdb as ldb
+
+# health of board indexes (EmbExp-Box instances)
+# - per index: success and timeout rates and latency over the last runs (rolling window), plus the totals
+# - quarantine: after quarantine_after consecutive failures an index gets no work for quarantine_time,
+#   then it gets a single probe run, a successful probe ends the quarantine, a failed probe extends it
+# - dispatch: weighted random choice among the free indexes, the weight is the expected number of successful runs per second
+# - the stats are stored as metadata of an exp run (kind "board_health", name "idx.<index>", json value),
+#   the latest stored stats of each index are the starting point for the next batch
+_meta_kind = "board_health"
+
+def _meta_name(idx):
+	return f"idx.{idx}"
+
+class BoardHealth:
+	def __init__(self, window = 20, quarantine_after = 3, quarantine_time = 300):
+		assert(window > 0 and quarantine_after > 0)
+		self.window = window
+		self.quarantine_after = quarantine_after
+		self.quarantine_time = quarantine_time
+		self.boards = {}
+
+	def _get(self, idx):
+		if not idx in self.boards:
+			self.boards[idx] = {
+			  "n_runs" : 0,
+			  "n_success" : 0,
+			  "n_timeouts" : 0,
+			  # recent runs as pairs (outcome, latency), outcome is "success", "timeout" or "failure"
+			  "recent" : collections.deque(maxlen=self.window),
+			  "consecutive_failures" : 0,
+			  "quarantined_until" : None}
+		return self.boards[idx]
+
+	# recording and statistics
+	# =========================================
+	def record(self, idx, success, latency, timed_out = False):
+		b = self._get(idx)
+		outcome = "success" if success else ("timeout" if timed_out else "failure")
+		b["n_runs"] += 1
+		b["n_success"] += 1 if success else 0
+		b["n_timeouts"] += 1 if outcome == "timeout" else 0
+		b["recent"].append((outcome, latency))
+		if success:
+			b["consecutive_failures"] = 0
+			if b["quarantined_until"] != None:
+				logging.warning(f"board idx={idx} is healthy again")
+			b["quarantined_until"] = None
+		else:
+			b["consecutive_failures"] += 1
+			# also after a failed probe
+			if b["consecutive_failures"] >= self.quarantine_after:
+				logging.warning(f"board idx={idx} is quarantined for {self.quarantine_time}s after {b['consecutive_failures']} failures in a row")
+				b["quarantined_until"] = time.time() + self.quarantine_time
+
+	def success_rate(self, idx):
+		# smoothed, indexes without runs start at 0.5
+		recent = self._get(idx)["recent"]
+		n_success = len(list(filter(lambda x: x[0] == "success", recent)))
+		return (n_success + 1) / (len(recent) + 2)
+
+	def timeout_rate(self, idx):
+		recent = self._get(idx)["recent"]
+		if len(recent) == 0:
+			return 0.0
+		return len(list(filter(lambda x: x[0] == "timeout", recent))) / len(recent)
+
+	def latency(self, idx):
+		# mean over the recent runs, None if unknown
+		recent = self._get(idx)["recent"]
+		if len(recent) == 0:
+			return None
+		return sum(map(lambda x: x[1], recent)) / len(recent)
+
+	def weight(self, idx):
+		latencies = list(filter(lambda x: x != None, map(self.latency, self.boards.keys())))
+		default_latency = 1.0 if len(latencies) == 0 else sum(latencies) / len(latencies)
+		latency = self.latency(idx)
+		latency = default_latency if latency == None else latency
+		return self.success_rate(idx) / max(latency, 1e-3)
+
+	# quarantine and dispatch
+	# =========================================
+	def is_available(self, idx, now = None):
+		# not quarantined, or the quarantine time is over and a probe run is due
+		until = self._get(idx)["quarantined_until"]
+		now = time.time() if now == None else now
+		return until == None or until <= now
+
+	def time_to_available(self, indexes):
+		# seconds until one of the indexes is available again
+		now = time.time()
+		return max(0.0, min(map(lambda idx: 0.0 if self.is_available(idx, now) else self._get(idx)["quarantined_until"] - now, indexes)))
+
+	def choose(self, free_indexes, rng = random):
+		candidates = list(filter(self.is_available, free_indexes))
+		if len(candidates) == 0:
+			return None
+		return rng.choices(candidates, weights=list(map(self.weight, candidates)))[0]
+
+	def to_string(self, idx):
+		b = self._get(idx)
+		latency = self.latency(idx)
+		latency_str = "-" if latency == None else f"{latency:.2f}s"
+		quarantine_str = "" if b["quarantined_until"] == None else ", quarantined"
+		return f"{b['n_runs']} runs, {b['n_success']} successful, {b['n_timeouts']} timeouts, recent success rate {self.success_rate(idx):.2f}, timeout rate {self.timeout_rate(idx):.2f}, latency {latency_str}{quarantine_str}"
+
+	# persistence in exp_runs_meta
+	# =========================================
+	def to_json(self, idx):
+		b = self._get(idx)
+		return json.dumps({
+		  "n_runs" : b["n_runs"],
+		  "n_success" : b["n_success"],
+		  "n_timeouts" : b["n_timeouts"],
+		  "recent" : list(b["recent"]),
+		  "consecutive_failures" : b["consecutive_failures"]})
+
+	# quarantine deadlines are absolute times and are not carried over to another batch
+	def from_json(self, idx, value):
+		d = json.loads(value)
+		b = self._get(idx)
+		for k in ["n_runs", "n_success", "n_timeouts", "consecutive_failures"]:
+			b[k] = d[k]
+		b["recent"].clear()
+		b["recent"].extend(map(tuple, d["recent"]))
+
+	def save(self, db, exprun_id):
+		trs = []
+		for idx in self.boards.keys():
+			trs.append(ldb.TR_exp_runs_meta(exp_runs_id=exprun_id, kind=_meta_kind, name=_meta_name(idx), value=self.to_json(idx)))
+		db.add_tablerecords(trs)
+
+	def load(self, db, indexes):
+		# the latest stored stats for each index, returns the indexes that were found
+		found = []
+		for idx in indexes:
+			tr = ldb.get_empty_TableRecord("exp_runs_meta")._replace(kind=_meta_kind, name=_meta_name(idx))
+			metas = db.get_tablerecord_matches(tr)
+			if len(metas) == 0:
+				continue
+			latest = max(metas, key=lambda x: x.exp_runs_id)
+			self.from_json(idx, latest.value)
+			found.append(idx)
+		return found
@@ -0,0 +1,169 @@
+import logging
+import time
+import math
+import json
+import random
+import threading
+
+import experiment
+
+# failure of a run on the board: errors of the backend (timeouts, connections, make targets for running) and unexpected uart output
+# (in contrast to errors of the experiment itself, its configuration or its build, which are not the fault of a board)
+class BoardRunError(Exception):
+	pass
+
+# execution backends, they produce the uart output of an experiment run
+# - uses_progplat: whether the experiment is configured and built in a progplatform before running
+class BoardBackend:
+	name = "board"
+	uses_progplat = True
+
+	def get_run_spec(self, progplat, board_type):
+		return progplat.get_configured_run_spec()
+
+	def run(self, exp, progplat, board_type, exp_type, conn_mode = None, embexp_inst_idx = None):
+		return progplat.run_experiment(conn_mode, embexp_inst_idx)
+
+	def get_stats_str(self):
+		return "runs on boards"
+
+# simulated boards, without progplatform and hardware (offline testing and benchmarking of scheduling, database and parsers)
+# - latency: distribution of the run time in seconds, {"dist": "fixed", "value": v}, {"dist": "uniform", "min": a, "max": b},
+#   {"dist": "normal", "mean": m, "sd": s} (cut off at 0), or {"dist": "lognormal", "mean": m, "sd": s} (of the run time itself)
+# - rates: probabilities of the outcomes other than a complete and equal run,
+#   "failure" (the run fails), "timeout" (the run fails after timeout seconds), "exception" (board exception),
+#   "inconclusive", "unequal" (only exps2, exps1 dumps differing cache lines instead) and "incomplete" (the output ends early)
+# - exps1 runs print a full cache dump of num_sets sets with num_lines lines, the same for each run of an experiment
+# - the run_spec is "sim.<board_type>", simulated runs are never mixed up with runs on boards
+class SimBackend:
+	name = "sim"
+	uses_progplat = False
+
+	outcomes = ["failure", "timeout", "exception", "inconclusive", "unequal", "incomplete"]
+
+	def __init__(self, latency = None, rates = None, timeout = 60, num_sets = 128, num_lines = 4, seed = None):
+		self.latency = {"dist": "fixed", "value": 0} if latency == None else latency
+		self.rates = {} if rates == None else rates
+		for outcome in self.rates.keys():
+			if not outcome in SimBackend.outcomes:
+				raise Exception(f"unknown outcome for simulation: {outcome}")
+			if not self.rates[outcome] >= 0:
+				raise Exception(f"negative rate for simulated outcome: {outcome}")
+		if sum(self.rates.values()) > 1:
+			raise Exception("the rates of the simulated outcomes add up to more than 1")
+		SimBackend._check_latency(self.latency)
+		self.timeout = timeout
+		self.num_sets = num_sets
+		self.num_lines = num_lines
+
+		self.rng = random.Random(seed)
+		self.lock = threading.Lock()
+		self.counts = {}
+
+	# fails for unknown distributions and invalid parameters, checked when the configuration is parsed instead of when sampling
+	latency_params = {"fixed": ["value"], "uniform": ["min", "max"], "normal": ["mean", "sd"], "lognormal": ["mean", "sd"]}
+	def _check_latency(latency):
+		dist = latency.get("dist", None)
+		if not dist in SimBackend.latency_params:
+			raise Exception(f"unknown latency distribution: {dist}")
+		for k in SimBackend.latency_params[dist]:
+			if not isinstance(latency.get(k, None), (int, float)):
+				raise Exception(f"latency distribution {dist} needs a number for {k}")
+		if dist == "fixed" and latency["value"] < 0:
+			raise Exception("the fixed latency must not be negative")
+		elif dist == "uniform" and not (0 <= latency["min"] <= latency["max"]):
+			raise Exception("the uniform latency needs 0 <= min <= max")
+		elif dist in ["normal", "lognormal"] and not (latency["mean"] > 0 and latency["sd"] >= 0):
+			raise Exception(f"the {dist} latency needs mean > 0 and sd >= 0")
+
+	def sample_latency(self, rng = random):
+		dist = self.latency["dist"]
+		if dist == "fixed":
+			return self.latency["value"]
+		elif dist == "uniform":
+			return rng.uniform(self.latency["min"], self.latency["max"])
+		elif dist == "normal":
+			return max(0.0, rng.gauss(self.latency["mean"], self.latency["sd"]))
+		elif dist == "lognormal":
+			# parameters of the underlying normal distribution for the given mean and standard deviation
+			(m, s) = (self.latency["mean"], self.latency["sd"])
+			sigma2 = math.log(1 + (s * s) / (m * m))
+			return rng.lognormvariate(math.log(m) - sigma2 / 2, math.sqrt(sigma2))
+		else:
+			raise Exception(f"unknown latency distribution: {dist}")
+
+	def get_run_spec(self, progplat, board_type):
+		return experiment._mk_run_spec(SimBackend.name, board_type)
+
+	def _choose_outcome(self):
+		with self.lock:
+			x = self.rng.random()
+			latency = self.sample_latency(self.rng)
+		outcome = "ok"
+		for o in SimBackend.outcomes:
+			p = self.rates.get(o, 0)
+			if x < p:
+				outcome = o
+				break
+			x -= p
+		with self.lock:
+			self.counts[outcome] = self.counts.get(outcome, 0) + 1
+		return (outcome, latency)
+
+	def _gen_cache_dump(self, exp_id, differ):
+		lines = ["----", "print_cache_full", "----"]
+		for s in range(self.num_sets):
+			lines.append(f"set={s}")
+			for l in range(self.num_lines):
+				# a few valid lines depending on the experiment, one more if the run should differ
+				valid = (s + l + exp_id) % 7 == 0 or (differ and s == exp_id % self.num_sets and l == 0)
+				lines.append(f"line={l}")
+				lines.append(f"valid: {1 if valid else 0}")
+				lines.append(f"tag: {0x80100 + s + l * self.num_sets:08x}")
+		lines.append("----")
+		return lines
+
+	def run(self, exp, progplat, board_type, exp_type, conn_mode = None, embexp_inst_idx = None):
+		(outcome, latency) = self._choose_outcome()
+		logging.debug(f"simulated run of {exp}: {outcome} after {latency:.3f}s")
+		if outcome == "timeout":
+			time.sleep(self.timeout)
+			raise Exception("experiment didn't run successful (simulated timeout)")
+		time.sleep(latency)
+		if outcome == "failure":
+			raise Exception("experiment didn't run successful (simulated failure)")
+
+		lines = ["Init complete."]
+		if outcome == "exception":
+			lines.append("EXCEPTION: simulated")
+			return "\n".join(lines) + "\n"
+		if exp_type == "exps2":
+			if outcome == "inconclusive":
+				lines.append("INCONCLUSIVE: 77")
+			else:
+				lines.append("RESULT: UNEQUAL" if outcome == "unequal" else "RESULT: EQUAL")
+		else:
+			lines += self._gen_cache_dump(exp.get_exp_id(), outcome == "unequal")
+			if outcome == "inconclusive":
+				lines.append("INCONCLUSIVE: 77")
+		if outcome != "incomplete":
+			lines.append("Experiment complete.")
+		return "\n".join(lines) + "\n"
+
+	def get_stats_str(self):
+		with self.lock:
+			n = sum(self.counts.values())
+			return f"{n} simulated runs, " + ", ".join(map(lambda o: f"{self.counts.get(o, 0)} {o}", ["ok"] + SimBackend.outcomes))
+
+backends = ["board", "sim"]
+
+# sim_config: json object with the arguments of SimBackend
+def get_backend(name = None, sim_config = None):
+	if name == None or name == "board":
+		if sim_config != None:
+			raise Exception("the simulation configuration is only for the sim backend")
+		return BoardBackend()
+	elif name == "sim":
+		return SimBackend(**({} if sim_config == None else json.loads(sim_config)))
+	else:
+		raise Exception(f"unknown backend: {name}")
@@ -1,6 +1,10 @@
 
 import logging
 import time
+import threading
+
+import logsdb as ldb
+import experiment
 
 
 class NonPollingListIterator:
@@ -24,7 +28,11 @@ class NonPollingListIterator:
 
 
 class PollingIterator:
-	def __init__(self, genfun, genargs, poll_max_rounds = 5, poll_round_time = 60):
+	# incremental: high-water-mark mode, genfun takes min_key and returns a pair (hwm, exps), where hwm is the greatest key it has seen
+	# - only keys greater than the last hwm are asked for, min_key None asks for everything (full rescan)
+	# - empty polls back off from poll_min_time, doubling up to poll_round_time; a full rescan is done when the backoff reaches poll_round_time
+	# - the iteration stops when nothing was found for about poll_max_rounds * poll_round_time
+	def __init__(self, genfun, genargs, poll_max_rounds = 5, poll_round_time = 60, incremental = False, poll_min_time = 1):
 		self.genfun = genfun
 		self.genargs = genargs
 
@@ -32,6 +40,9 @@ class PollingIterator:
 		self.poll_max_rounds = poll_max_rounds
 		if self.poll_max_rounds < 1:
 			self.poll_max_rounds = 1
+		self.incremental = incremental
+		self.poll_min_time = min(poll_min_time, poll_round_time)
+		self.hwm = None
 		self._exp_list_iter = iter([])
 		self.iter_round = 0
 		self.iter_idx   = 0
@@ -40,7 +51,7 @@ class PollingIterator:
 	def get_iterinfo(self):
 		return (self.iter_round, self.iter_idx, self.iter_size)
 
-	def update_exps_list(self):
+	def _generate_full(self):
 		for i in range(self.poll_max_rounds):
 			if i > 0:
 				logging.warning(f"sleeping for {self.poll_round_time}s")
@@ -50,6 +61,33 @@ class PollingIterator:
 			logging.warning(f"generated {len(exp_list)} items")
 			if len(exp_list) > 0:
 				break
+		return exp_list
+
+	def _generate_incremental(self):
+		budget = self.poll_max_rounds * self.poll_round_time
+		waited = 0
+		sleep_time = 0
+		while True:
+			rescan = self.hwm == None or sleep_time >= self.poll_round_time
+			min_key = None if rescan else self.hwm
+			logging.info(f"generating new exp_list (min_key = {min_key})")
+			(hwm, exp_list) = self.genfun(min_key=min_key, **self.genargs)
+			if hwm != None:
+				self.hwm = hwm if self.hwm == None else max(self.hwm, hwm)
+			if len(exp_list) > 0 or waited >= budget:
+				break
+			sleep_time = self.poll_min_time if sleep_time == 0 else min(2 * sleep_time, self.poll_round_time)
+			logging.info(f"sleeping for {sleep_time}s")
+			time.sleep(sleep_time)
+			waited += sleep_time
+		logging.warning(f"generated {len(exp_list)} items" + (" (full rescan)" if rescan else ""))
+		return exp_list
+
+	def update_exps_list(self):
+		if self.incremental:
+			exp_list = self._generate_incremental()
+		else:
+			exp_list = self._generate_full()
 		self.iter_round += 1
 		self.iter_idx   = 0
 		self.iter_size  = len(exp_list)
@@ -67,3 +105,96 @@ class PollingIterator:
 		self.iter_idx += 1
 		return next_exp
 
+
+class QueueIterator:
+	# claims experiments from the work queue in the database (see LogsDB.queue_claim)
+	# - the leases of claimed experiments are renewed in the background until they are reported with report()
+	# - stops when all entries for run_spec are completed or have reached max_attempts, waits for leases of other workers otherwise
+	def __init__(self, db, run_spec, owner, lease_time = 600, max_attempts = 3, poll_time = 30):
+		assert(lease_time > 0)
+		self.db = db
+		# own connection for the queue, it is used from several threads (claims, renewals, reports after the results are written)
+		# and does not wait for the read locks of the other users of db
+		self.qdb = ldb.LogsDB(db.database_file, profile=db.profile, shared_threads=True)
+		self.qdb.connect()
+		self.run_spec = run_spec
+		self.owner = owner
+		self.lease_time = lease_time
+		self.max_attempts = max_attempts
+		self.poll_time = poll_time
+
+		self.claimed = {}
+		self.lock = threading.Lock()
+		self.reported = threading.Event()
+		self.stop_renew = threading.Event()
+		self.renewer = threading.Thread(target=self._renew_loop, daemon=True)
+		self.renewer.start()
+
+		self.iter_round = 0
+		self.iter_idx   = 0
+		self.iter_size  = self._count_open()
+
+	def get_iterinfo(self):
+		return (self.iter_round, self.iter_idx, max(self.iter_size, self.iter_idx))
+
+	def _count_open(self):
+		tr = ldb.get_empty_TableRecord("exp_exps_queue")._replace(run_spec=self.run_spec, completed=0)
+		with self.lock:
+			return self.qdb.get_tablerecord_matches(tr, count_only=True)
+
+	def _count_runnable(self):
+		# open entries that may still be claimed, now or when the lease of another worker ends
+		with self.lock:
+			open_entries = list(self.qdb.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_queue")._replace(run_spec=self.run_spec, completed=0), fields=["attempts"]))
+		return len(list(filter(lambda e: self.max_attempts == None or e.attempts < self.max_attempts, open_entries)))
+
+	def _renew_loop(self):
+		while not self.stop_renew.wait(self.lease_time / 3):
+			with self.lock:
+				entries = list(self.claimed.values())
+				if len(entries) == 0:
+					continue
+				renewed = self.qdb.queue_renew(entries, self.owner, self.lease_time)
+			if len(renewed) != len(entries):
+				logging.warning(f"lost {len(entries) - len(renewed)} leases")
+
+	def report(self, exp, success):
+		# completes the entry if the run was successful, releases it for another attempt otherwise
+		with self.lock:
+			entry = self.claimed.pop(exp.get_exp_id())
+			if success:
+				owned = self.qdb.queue_complete([entry], self.owner)
+			else:
+				owned = self.qdb.queue_release([entry], self.owner)
+		self.reported.set()
+		if len(owned) != 1:
+			logging.warning(f"lease of experiment {exp.get_exp_id()} was lost before reporting")
+
+	def close(self):
+		# release what is not reported yet
+		self.stop_renew.set()
+		self.renewer.join()
+		with self.lock:
+			self.qdb.queue_release(list(self.claimed.values()), self.owner)
+			self.claimed = {}
+			self.qdb.close()
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		while True:
+			self.reported.clear()
+			with self.lock:
+				entries = self.qdb.queue_claim(self.run_spec, self.owner, self.lease_time, max_attempts=self.max_attempts)
+				if len(entries) == 1:
+					entry = entries[0]
+					self.claimed[entry.exp_exps_id] = entry
+					break
+			if self._count_runnable() == 0:
+				raise StopIteration()
+			logging.warning(f"queue has no free entries, waiting up to {self.poll_time}s")
+			# the reports of own experiments may finish the queue earlier
+			self.reported.wait(self.poll_time)
+		self.iter_idx += 1
+		return experiment.Experiment(self.db, entry.exp_exps_id)
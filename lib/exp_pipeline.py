@@ -0,0 +1,131 @@
+import logging
+import threading
+import queue
+import concurrent.futures
+
+import logsdb as ldb
+import progplatform
+import exp_runner
+
+class BuildPipeline:
+	# builds upcoming experiments of an experiment iterator while the boards run the current ones
+	# - a feeder thread takes experiments from exp_iter and hands them to a pool of build workers,
+	#   at most lookahead experiments are waiting to be taken by the board workers (bounded look-ahead)
+	# - each build worker has its own copy of the progplatform (temp/build_<k>), the binaries are passed on through the build cache
+	# - the board workers call wait_build before running an experiment, the run stage then only restores the binaries
+	#   (if a build failed, the run stage builds again and reports the error as usual)
+	# - the feeder iterates with its own database connection: exp_iter_fun creates the experiment iterator for a connection,
+	#   the programs and inputs are loaded in the feeder, the build workers do not access the database
+	def __init__(self, exp_iter_fun, db_file, progplat, board_type, build_cache, branchname = None, n_workers = 1, lookahead = 4, db_profile = None, join_time = 10):
+		assert(n_workers > 0 and lookahead > 0)
+		self.board_type = board_type
+		self.build_cache = build_cache
+		self.branchname = branchname
+		self.join_time = join_time
+
+		self.n_built = 0
+		self.n_cached = 0
+		self.n_failed = 0
+		self.lock = threading.Lock()
+
+		# handed over to the feeder thread, only used there after the start
+		self.db = ldb.LogsDB(db_file, profile=db_profile, shared_threads=True)
+		self.db.connect()
+		self.exp_iter = exp_iter_fun(self.db)
+		# progress of the experiments taken from the pipeline, not of the feeder
+		self.iterinfo = self.exp_iter.get_iterinfo()
+
+		self.progplats = queue.Queue()
+		for k in range(n_workers):
+			self.progplats.put(progplatform.copy_to_temp_dir(progplat, f"build_{k}"))
+		self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="build")
+		self.builds = {}
+
+		self.q = queue.Queue(maxsize=lookahead)
+		self.stop = threading.Event()
+		self.feeder = threading.Thread(target=self._feed, name="build-feeder", daemon=True)
+		self.feeder.start()
+
+	def get_iterinfo(self):
+		return self.iterinfo
+
+	def _build(self, exp):
+		progplat = self.progplats.get()
+		try:
+			built = exp_runner.build_experiment(exp, progplat, self.board_type, self.build_cache, self.branchname)
+		except Exception:
+			with self.lock:
+				self.n_failed += 1
+			raise
+		finally:
+			self.progplats.put(progplat)
+		with self.lock:
+			if built:
+				self.n_built += 1
+			else:
+				self.n_cached += 1
+		return built
+
+	def _put(self, item):
+		# gives up when the pipeline is closed
+		while not self.stop.is_set():
+			try:
+				self.q.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _feed(self):
+		try:
+			for exp in self.exp_iter:
+				# the experiment is complete for the build, without database access
+				exp.get_inputs()
+				exp.get_prog()
+				item = (exp, self.exp_iter.get_iterinfo(), self.pool.submit(self._build, exp))
+				if not self._put(item):
+					return
+		except Exception as e:
+			# raised in the thread that iterates
+			self._put(e)
+		self._put(None)
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		item = self.q.get()
+		if item == None:
+			# for further calls
+			self.q.put(None)
+			raise StopIteration()
+		if isinstance(item, Exception):
+			raise item
+		(exp, iterinfo, future) = item
+		with self.lock:
+			self.builds[exp.get_exp_id()] = future
+			self.iterinfo = iterinfo
+		return exp
+
+	def wait_build(self, exp):
+		with self.lock:
+			future = self.builds.pop(exp.get_exp_id(), None)
+		if future == None:
+			return
+		try:
+			future.result()
+		except Exception as e:
+			logging.warning(f"building {exp} ahead failed: {e}")
+
+	def close(self):
+		self.stop.set()
+		self.pool.shutdown(wait=True, cancel_futures=True)
+		# the feeder may be waiting in the experiment iterator (polling), then its connection stays open
+		self.feeder.join(self.join_time)
+		if self.feeder.is_alive():
+			logging.warning(f"the build feeder did not stop within {self.join_time}s")
+			return
+		self.db.close()
+
+	def get_stats_str(self):
+		return f"{self.n_built} built ahead, {self.n_cached} already in the build cache, {self.n_failed} failed"
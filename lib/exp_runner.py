@@ -2,21 +2,101 @@
 import logging
 import json
 import threading
+import concurrent.futures
 
 import experiment
 import progplatform
+import exp_backend
 from helpers import *
 
-def run_experiment(exp, progplat = None, board_type = None, branchname = None, conn_mode = None, pre_cleanup = None, no_post_cleanup = False, printeval = False, ignoremismatch = False, exprun = None, run_input_state = None, embexp_inst_idx = None, copy_to_temp = False):
-	logging.info(f"{(exp, progplat, board_type, branchname, conn_mode, pre_cleanup, no_post_cleanup, printeval, ignoremismatch, exprun, run_input_state, embexp_inst_idx, copy_to_temp)}")
-	if progplat == None:
+# prepare stage: generate the experiment code and build it (or take the binaries from the build cache), returns the run_spec
+# (without build cache, the binaries are built by the run stage)
+def prepare_experiment(exp, progplat, board_type, run_input_state = None, build_cache = None):
+	logging.info(f"generating experiment code")
+	progplat.configure_experiment(board_type, exp, run_input_state=run_input_state)
+	run_spec = progplat.get_configured_run_spec()
+
+	if build_cache != None:
+		build_key = build_cache.get_key(progplat)
+		if not build_cache.restore(progplat, build_key):
+			logging.info(f"building experiment")
+			progplat.build()
+			build_cache.store(progplat, build_key)
+		else:
+			logging.info(f"using cached build {build_key}")
+	return run_spec
+
+# run stage: run the prepared experiment with the backend (on the board by default) and interpret the uart output, returns the pair (uartlogdata, result)
+def run_prepared_experiment(exp, progplat, board_type, exp_type, conn_mode = None, embexp_inst_idx = None, backend = None):
+	if backend == None:
+		backend = exp_backend.BoardBackend()
+
+	# run the experiment
+	# ======================================
+	logging.info(f"running experiment")
+	if not exp_type in ["exps2", "exps1"]:
+		raise Exception(f"unknown experiment type: {exp_type}")
+	# errors from here on are failures of the board run
+	try:
+		uartlogdata = backend.run(exp, progplat, board_type, exp_type, conn_mode, embexp_inst_idx)
+		# interpret the experiment result
+		uartlogdata_lines = uartlogdata.split("\n")
+		if exp_type == "exps2":
+			result = eval_uart_pair_cache_experiment(uartlogdata_lines)
+		else:
+			result = parse_uart_single_cache_experiment(uartlogdata_lines, board_type)
+	except Exception as e:
+		raise exp_backend.BoardRunError(str(e)) from e
+
+	# if the result is no board exception
+	if exp_type == "exps1" and not isinstance(result, str):
+		# filter sets where at least one line is valid
+		sets_valid = list(filter(lambda x: any(l_val["valid"] for l_val in x["lines"]), result))
+		# filter valid lines
+		sets_clean = list(map(lambda x: {"set": x["set"],"lines": list(filter(lambda l_val: l_val["valid"], x["lines"]))}, sets_valid))
+		# remove regs field
+		for s_val in sets_clean:
+			for l_val in s_val["lines"]:
+				for k in list(l_val.keys()):
+					if not k in ["line", "valid", "tag"]:
+						l_val.pop(k)
+		result = sets_clean
+	return (uartlogdata, result)
+
+# build stage for pipelining: builds the experiment into the build cache, returns whether it had to be built
+# (the progplatform is cleaned before and after, it can be a separate copy for each build worker)
+def build_experiment(exp, progplat, board_type, build_cache, branchname = None):
+	progplat.check_clean("all")
+	progplat.change_branch(progplatform.decide_branchname(branchname, board_type))
+	try:
+		progplat.configure_experiment(board_type, exp)
+		build_key = build_cache.get_key(progplat)
+		if build_cache.contains(build_key):
+			return False
+		logging.info(f"building experiment {exp} ahead")
+		progplat.build()
+		build_cache.store(progplat, build_key, prebuilt=True)
+		return True
+	finally:
+		progplat.check_clean("all")
+
+def run_experiment(exp, progplat = None, board_type = None, branchname = None, conn_mode = None, pre_cleanup = None, no_post_cleanup = False, printeval = False, ignoremismatch = False, exprun = None, run_input_state = None, embexp_inst_idx = None, copy_to_temp = False, result_writer = None, on_written = None, build_cache = None, workspaces = None, backend = None):
+	logging.info(f"{(exp, progplat, board_type, branchname, conn_mode, pre_cleanup, no_post_cleanup, printeval, ignoremismatch, exprun, run_input_state, embexp_inst_idx, copy_to_temp, result_writer, on_written, build_cache, workspaces, backend)}")
+	if backend == None:
+		backend = exp_backend.BoardBackend()
+	# the simulation does not need a progplatform
+	use_progplat = backend.uses_progplat
+	if progplat == None and use_progplat:
 		progplat = progplatform.get_embexp_ProgPlatform(None)
 
 	# when working on copies, we expect that the instance indexes are controlled to be different
 	assert (not copy_to_temp) or (embexp_inst_idx != None)
 	# work on a copy if needed
-	if copy_to_temp:
-		progplat = progplatform.copy_to_temp_widx(progplat, embexp_inst_idx)
+	if copy_to_temp and use_progplat:
+		if workspaces != None:
+			progplat = workspaces.get(embexp_inst_idx)
+		else:
+			progplat = progplatform.copy_to_temp_widx(progplat, embexp_inst_idx)
 
 	exp_arch = exp.get_prog().get_arch()
 
@@ -36,71 +116,22 @@ def run_experiment(exp, progplat = None, board_type = None, branchname = None, c
 	exp_type = exp_type if run_input_state == None else "exps1"
 	assert exp_type == "exps2" or exp_type == "exps1"
 
-	# make sure that progplatform is clean
-	# ======================================
-	progplat.check_clean(pre_cleanup)
-
-	# change to corresponding branch
-	# ======================================
-	branchname = progplatform.decide_branchname(branchname, board_type)
-	progplat.change_branch(branchname)
-
-	try:
-		# generate the experiment code
+	if use_progplat:
+		# make sure that progplatform is clean
 		# ======================================
-		logging.info(f"generating experiment code")
-		progplat.configure_experiment(board_type, exp, run_input_state=run_input_state)
-		run_spec = progplat.get_configured_run_spec()
-
+		progplat.check_clean(pre_cleanup)
 
-		# simulation mode
-		# ======================================
-		simulation_mode = False
-		uartlogdata_equal = "Init complete.\nRESULT: EQUAL\nExperiment complete.\n"
-		uartlogdata_unequal = "Init complete.\nRESULT: UNEQUAL\nExperiment complete.\n"
-		uartlogdata_inconclusive = "Init complete.\nINCONCLUSIVE: 77\nExperiment complete.\n"
-		uartlogdata_notfinished = "Init complete.\nRESULT: EQUAL\n"
-		uartlogdata_exception = "Init complete.\nException..."
-		uartlogdata_noinit = ""
-		uartlogdata_options = [uartlogdata_equal, uartlogdata_unequal,
-                                       uartlogdata_inconclusive, uartlogdata_notfinished,
-                                       uartlogdata_exception, uartlogdata_noinit]
-		import random
-		uartlogdata_rnd = random.choice(uartlogdata_options)
-		uartlogdata_sim = uartlogdata_equal
-
-		# run the experiment
+		# change to corresponding branch
 		# ======================================
-		logging.info(f"running experiment")
-		if simulation_mode:
-			logging.error(f"!!! SIMULATION MODE ON !!!!")
-			import time
-			time.sleep(1)
-			uartlogdata = uartlogdata_sim
-			print(uartlogdata)
-		else:
-			uartlogdata = progplat.run_experiment(conn_mode, embexp_inst_idx)
-		# interpret the experiment result
-		uartlogdata_lines = uartlogdata.split("\n")
-		if exp_type == "exps2":
-			result = eval_uart_pair_cache_experiment(uartlogdata_lines)
-		elif exp_type == "exps1":
-			result = parse_uart_single_cache_experiment(uartlogdata_lines, board_type)
-			# if the result is no board exception
-			if not isinstance(result, str):
-				# filter sets where at least one line is valid
-				sets_valid = list(filter(lambda x: any(l_val["valid"] for l_val in x["lines"]), result))
-				# filter valid lines
-				sets_clean = list(map(lambda x: {"set": x["set"],"lines": list(filter(lambda l_val: l_val["valid"], x["lines"]))}, sets_valid))
-				# remove regs field
-				for s_val in sets_clean:
-					for l_val in s_val["lines"]:
-						for k in list(l_val.keys()):
-							if not k in ["line", "valid", "tag"]:
-								l_val.pop(k)
-				result = sets_clean
+		branchname = progplatform.decide_branchname(branchname, board_type)
+		progplat.change_branch(branchname)
+
+	try:
+		if use_progplat:
+			run_spec = prepare_experiment(exp, progplat, board_type, run_input_state=run_input_state, build_cache=build_cache)
 		else:
-			raise Exception(f"unknown experiment type: {exp_type}")
+			run_spec = backend.get_run_spec(progplat, board_type)
+		(uartlogdata, result) = run_prepared_experiment(exp, progplat, board_type, exp_type, conn_mode, embexp_inst_idx, backend)
 
 		# save the outputs and test metadata
 		# ======================================
@@ -109,16 +140,29 @@ def run_experiment(exp, progplat = None, board_type = None, branchname = None, c
 			logging.info(f"saving experiment data")
 			run_data = {"output_uart": uartlogdata,
                                     "result":      result}
-			with run_experiment.dblock:
-				nomismatches = exp.write_new_run(exprun, run_spec, run_data)
+			if result_writer != None:
+				# written asynchronously, mismatches are reported by the result writer
+				future = result_writer.submit(exp, exprun, run_spec, run_data)
+			else:
+				with run_experiment.dblock:
+					nomismatches = exp.write_new_run(exprun, run_spec, run_data)
+				future = concurrent.futures.Future()
+				future.set_result(nomismatches)
+			# on_written: gets the future of the stored run (done after the commit)
+			if on_written != None:
+				on_written(future)
 
 	finally:
-		if not no_post_cleanup:
+		if use_progplat and not no_post_cleanup:
 			# finalize embexp-progplatform
 			# ======================================
 			logging.info(f"cleaning embexp-progplatform")
 			# make progplatform clean to prepare the next round
-			progplat.check_clean("ignored" if pre_cleanup == "ignored" else "all")
+			post_cleanup = "ignored" if pre_cleanup == "ignored" else "all"
+			if copy_to_temp and workspaces != None:
+				workspaces.cleanup(progplat, post_cleanup)
+			else:
+				progplat.check_clean(post_cleanup)
 
 	if printeval:
 		# the last line is a simple result line, that can be interpreted by another program, if exps2
@@ -131,7 +175,7 @@ def run_experiment(exp, progplat = None, board_type = None, branchname = None, c
 				print(f"board_exception = {result}")
 			else:
 				print("=" * 40)
-				for s_val in sets_clean:
+				for s_val in result:
 					print(f"set {s_val['set']}")
 					for l_val in s_val["lines"]:
 						print(f"\tline {l_val['line']}, tag: {l_val['tag']}")
@@ -11,11 +11,28 @@ import helpers
 _run_id_meta_prefix = "run."
 def _mk_run_spec(progplat_hash, board_type):
 	return f"{progplat_hash}.{board_type}"
+# name prefix of the metadata of the runs with run_spec (for preload_metadata)
+def _mk_run_meta_prefix(run_spec):
+	return f"{_run_id_meta_prefix}{run_spec}."
 def _dest_run_id(run_id):
 	parts = run_id.split(".")
 	assert(len(parts) == 3)
 	return (".".join(parts[0:2]), parts[2])
 
+# class of a run result as stored in exp_exps_latest (the migration classifies the stored json values the same way)
+result_classes = ["example", "counterexample", "inconclusive", "exception", "other"]
+def _get_result_class(result):
+	if result == True:
+		return "example"
+	elif result == False:
+		return "counterexample"
+	elif isinstance(result, str) and result.startswith("special :::: INCONCLUSIVE: "):
+		return "inconclusive"
+	elif isinstance(result, str) and result.startswith("embexp.board.exception :::: "):
+		return "exception"
+	else:
+		return "other"
+
 class Experiment:
 	def __init__(self, db, exp):
 		self.db = db
@@ -30,22 +47,34 @@ class Experiment:
 		self.inputs = None
 		self.prog = None
 		self.metadata = None
+		# preloaded subset of the metadata, pair of name prefix and records (see preload_metadata)
+		self.run_metadata = None
+
+	# records from projected queries lack some fields, load the full record when needed
+	def _get_field(self, field):
+		v = getattr(self.exp, field)
+		if v == None:
+			exps = self.db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps")._replace(id=self.get_exp_id()))
+			assert(len(exps) == 1)
+			self.exp = exps[0]
+			v = getattr(self.exp, field)
+		return v
 
 	def get_exp_id(self):
 		return self.exp.id
 
 	def get_prog_id(self):
-		return self.exp.exp_progs_id
+		return self._get_field("exp_progs_id")
 
 	def get_exp_type(self):
-		return self.exp.type
+		return self._get_field("type")
 
 	def get_exp_params(self):
-		return self.exp.params
+		return self._get_field("params")
 
 	def get_inputs(self):
 		if self.inputs == None:
-			self.inputs = json.loads(self.exp.input_data)
+			self.inputs = json.loads(self._get_field("input_data"))
 		return self.inputs
 
 	def _proc_input_state(inp, statename):
@@ -83,8 +112,78 @@ class Experiment:
 	# get all from db
 	# =========================================
 	def _get_all(db):
-		records = db.get_tablerecord_matches(ldb.get_empty_TableRecord(f"exp_exps"))
-		return list(map(lambda x: Experiment(db, x), records))
+		return list(Experiment._iter_all(db))
+
+	# lazy variant, fields projects the loaded experiment records (missing fields are loaded on demand)
+	# (min_id: only experiments with a greater id, in the order of their ids)
+	def _iter_all(db, fields = None, arraysize = 1000, min_id = None):
+		if min_id == None:
+			records = db.iter_tablerecord_matches(ldb.get_empty_TableRecord(f"exp_exps"), fields=fields, arraysize=arraysize)
+		else:
+			exp_gt = ldb.QE_Bin(op=ldb.QE_Bop.GT, arg1=ldb.QE_Ref(index=0, field="id"), arg2=ldb.QE_Const(value=min_id))
+			records = db.iter_tablerecords("exp_exps", [], exp_gt, order_by=[(0, "id", True)], fields=fields, arraysize=arraysize)
+		return map(lambda x: Experiment(db, x), records)
+
+	# bulk loading for many experiments, one query per chunk of experiments instead of one per experiment
+	# =========================================
+	# metadata with names starting with name_prefix (all metadata if None), e.g., "run." or "run.{run_spec}." for checking runs
+	def preload_metadata(db, exps, name_prefix = None, chunk_size = 500):
+		exps = list(exps)
+		for i in range(0, len(exps), chunk_size):
+			chunk = exps[i:i+chunk_size]
+			exp_ids = list(set(map(lambda x: x.get_exp_id(), chunk)))
+			query_exp = ldb.QE_Bin(op=ldb.QE_Bop.IN, arg1=ldb.QE_Ref(index=0, field="exp_exps_id"), arg2=ldb.QE_Const(value=exp_ids))
+			if name_prefix != None:
+				# like is not exact for "_" and "%" and ignores the case, checked below
+				exp_name = ldb.QE_Bin(op=ldb.QE_Bop.LIKE, arg1=ldb.QE_Ref(index=0, field="name"), arg2=ldb.QE_Const(value=name_prefix + "%"))
+				query_exp = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=query_exp, arg2=exp_name)
+			metadata = {}
+			for exp_id in exp_ids:
+				metadata[exp_id] = []
+			for r in db.get_tablerecords("exp_exps_meta", [], query_exp):
+				if name_prefix == None or r.name.startswith(name_prefix):
+					metadata[r.exp_exps_id].append(r)
+			for exp in chunk:
+				if name_prefix == None:
+					exp.metadata = list(metadata[exp.get_exp_id()])
+				else:
+					exp.run_metadata = (name_prefix, list(metadata[exp.get_exp_id()]))
+		return exps
+
+	def preload_progs(db, exps, chunk_size = 500):
+		exps = list(exps)
+		for i in range(0, len(exps), chunk_size):
+			chunk = exps[i:i+chunk_size]
+			prog_ids = list(set(map(lambda x: x.get_prog_id(), chunk)))
+			query_exp = ldb.QE_Bin(op=ldb.QE_Bop.IN, arg1=ldb.QE_Ref(index=0, field="id"), arg2=ldb.QE_Const(value=prog_ids))
+			progs = dict(map(lambda x: (x.id, program.Program(db, x)), db.get_tablerecords("exp_progs", [], query_exp)))
+			for exp in chunk:
+				exp.prog = progs[exp.get_prog_id()]
+		return exps
+
+	# lazy, preloads the programs and metadata for chunks of the experiments
+	def iter_preloaded(db, exps, name_prefix = None, chunk_size = 500):
+		chunk = []
+		for exp in exps:
+			chunk.append(exp)
+			if len(chunk) >= chunk_size:
+				yield from Experiment.preload_metadata(db, Experiment.preload_progs(db, chunk, chunk_size), name_prefix, chunk_size)
+				chunk = []
+		yield from Experiment.preload_metadata(db, Experiment.preload_progs(db, chunk, chunk_size), name_prefix, chunk_size)
+
+	# latest runs from exp_exps_latest, dictionary from experiment id to record (experiments without run are missing)
+	# (exp_ids: only these experiments, one query per chunk, all experiments with a run otherwise)
+	def get_latest_runs(db, run_spec, exp_ids = None, chunk_size = 500):
+		exp_spec = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="run_spec"), arg2=ldb.QE_Const(value=run_spec))
+		if exp_ids == None:
+			return dict(map(lambda x: (x.exp_exps_id, x), db.iter_tablerecords("exp_exps_latest", [], exp_spec)))
+		exp_ids = list(exp_ids)
+		latest = {}
+		for i in range(0, len(exp_ids), chunk_size):
+			exp_in = ldb.QE_Bin(op=ldb.QE_Bop.IN, arg1=ldb.QE_Ref(index=0, field="exp_exps_id"), arg2=ldb.QE_Const(value=exp_ids[i:i+chunk_size]))
+			for r in db.get_tablerecords("exp_exps_latest", [], ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=exp_spec, arg2=exp_in)):
+				latest[r.exp_exps_id] = r
+		return latest
 
 	# experiment run management (run)
 	# =========================================
@@ -93,11 +192,20 @@ class Experiment:
 			self.metadata = self.db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_meta")._replace(exp_exps_id=self.get_exp_id()))
 		return self.metadata
 
+	# metadata with names starting with name_prefix, from the preloaded metadata if it covers the prefix
+	def _get_metadata_with_prefix(self, name_prefix):
+		if self.metadata == None and self.run_metadata != None and name_prefix.startswith(self.run_metadata[0]):
+			metadata = self.run_metadata[1]
+		else:
+			metadata = self.get_metadata()
+		return list(filter(lambda x: x.name.startswith(name_prefix), metadata))
+
+	def _get_run_ids_with_prefix(self, name_prefix):
+		metadata_names = set(map(lambda x: x.name, self._get_metadata_with_prefix(name_prefix)))
+		return list(map(lambda x: x[len(_run_id_meta_prefix):], metadata_names))
+
 	def get_all_run_ids(self):
-		metadata_names = map(lambda x: x.name, self.get_metadata())
-		run_ids_ = set(filter(lambda x: x.startswith(_run_id_meta_prefix), metadata_names))
-		run_ids  = list(set(map(lambda x: x[len(_run_id_meta_prefix):],run_ids_)))
-		return run_ids
+		return self._get_run_ids_with_prefix(_run_id_meta_prefix)
 
 	def get_run_specs(self):
 		run_ids   = self.get_all_run_ids()
@@ -105,7 +213,7 @@ class Experiment:
 		return run_specs
 
 	def get_run_ids(self, run_spec):
-		run_ids  = self.get_all_run_ids()
+		run_ids  = self._get_run_ids_with_prefix(_mk_run_meta_prefix(run_spec))
 		run_ids_ = list(filter(lambda x: _dest_run_id(x)[0] == run_spec, run_ids))
 		return run_ids_
 
@@ -120,7 +228,7 @@ class Experiment:
 	# read previous run data
 	# =========================================
 	def get_run_data(self, run_id):
-		run_metadata = filter(lambda x: x.name == (_run_id_meta_prefix + run_id), self.get_metadata())
+		run_metadata = filter(lambda x: x.name == (_run_id_meta_prefix + run_id), self._get_metadata_with_prefix(_run_id_meta_prefix + run_id))
 		run_data = dict(map(lambda x: (x.kind, json.loads(x.value) if x.kind == "result" else x.value), run_metadata))
 		if len(run_data) == 0:
 			raise Exception("there is no such run")
@@ -140,6 +248,11 @@ class Experiment:
 		run_id = run_spec + "." + exprun.get_name()
 		meta_name = _run_id_meta_prefix + run_id
 
+		# the metadata and the latest run (exp_exps_latest) are written together
+		with self.db.transaction():
+			return self._write_new_run(run_id, meta_name, run_spec, run_data)
+
+	def _write_new_run(self, run_id, meta_name, run_spec, run_data):
 		last_run_id = self.get_latest_run_id(run_spec)
 		nomismatches = True
 		if last_run_id == None:
@@ -160,10 +273,12 @@ class Experiment:
 
 		if (not nomismatches) or (not last_run_exists):
 			tr_b = ldb.get_empty_TableRecord("exp_exps_meta")._replace(exp_exps_id=self.get_exp_id(), name=meta_name)
+			trs = []
 			for k in run_data.keys():
 				v = json.dumps(run_data[k], separators=(',', ':')) if k == "result" else run_data[k]
-				tr = tr_b._replace(kind=k, value=v)
-				self.db.add_tablerecord(tr)
+				trs.append(tr_b._replace(kind=k, value=v))
+			self.db.add_tablerecords(trs)
+			self.db.set_latest_run(self.get_exp_id(), run_spec, run_id, True, _get_result_class(run_data["result"]))
 
 		return nomismatches
 
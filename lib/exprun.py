@@ -31,7 +31,8 @@ class ExpRun:
 		name = _gen_dotfree_time_str()
 		name += ("_" + suffix) if suffix != None else ""
 		tr = ldb.TR_exp_runs(id=None, name=name)
-		db.add_tablerecord(tr)
+		# read back for the id
+		tr = db.add_tablerecord(tr)
 		return ExpRun(db, tr)
 
 	# find exp runs
@@ -4,14 +4,22 @@ import os
 
 import logging
 import datetime
+import time
 import collections
+import functools
+import contextlib
+import threading
 from enum import Enum
 
-# data types for slightly generalized query with indexed query expressions ("NOT") ("AND", "OR") (=, LIKE, IN)
+import migrations
+
+# data types for slightly generalized query with indexed query expressions ("NOT") ("AND", "OR") (=, LIKE, IN, >, <)
 class QE_Bop(Enum):
 	EQ   = "="
 	LIKE = "LIKE"
 	IN   = "IN"
+	GT   = ">"
+	LT   = "<"
 	AND  = "AND"
 	OR   = "OR"
 
@@ -74,6 +82,14 @@ TR_exp_exps_lists_entries = (
   collections.namedtuple("TR_exp_exps_lists_entries",
   ["exp_exps_lists_id", "exp_exps_id", "list_index"]))
 
+TR_exp_exps_queue = (
+  collections.namedtuple("TR_exp_exps_queue",
+  ["id", "exp_exps_id", "run_spec", "lease_owner", "lease_expiry", "attempts", "completed"]))
+
+TR_exp_exps_latest = (
+  collections.namedtuple("TR_exp_exps_latest",
+  ["exp_exps_id", "run_spec", "run_id", "is_complete", "result_class"]))
+
 TR_db_meta = (
   collections.namedtuple("TR_db_meta",
   ["id", "kind", "name", "value"]))
@@ -107,6 +123,10 @@ TR_by_table = {
     TR_exp_exps_lists,
   "exp_exps_lists_entries" :
     TR_exp_exps_lists_entries,
+  "exp_exps_queue" :
+    TR_exp_exps_queue,
+  "exp_exps_latest" :
+    TR_exp_exps_latest,
   "db_meta" :
     TR_db_meta
   }
@@ -116,6 +136,20 @@ tables_all    = TR_by_table.keys()
 def row_factory_simple(mfun):
 	return (lambda _,b: mfun(b))
 
+# for projections: records of the full table record type, fields that are not selected are None
+def row_factory_projected(data_type, fields):
+	for f in fields:
+		if not f in data_type._fields:
+			raise Exception(f"field '{f}' is not in '{data_type.__name__}'")
+	idxs = list(map(lambda f: data_type._fields.index(f), fields))
+	n = len(data_type._fields)
+	def mk(row):
+		vals = [None] * n
+		for (i, v) in zip(idxs, row):
+			vals[i] = v
+		return data_type._make(vals)
+	return row_factory_simple(mk)
+
 def get_empty_TableRecord(t):
 	if type(t) == str:
 		t = TR_by_table[t]
@@ -136,7 +170,12 @@ TableLinks = {
   ("exp_exps_lists_entries" , "exp_exps_lists"):  ("exp_exps_lists_id" , "id"),
   ("exp_exps_lists_entries" , "exp_exps"):        ("exp_exps_id"       , "id"),
   ("exp_exps"               , "exp_exps_meta"):   ("id"                , "exp_exps_id"),
-  ("exp_exps"               , "exp_progs"):       ("exp_progs_id"      , "id")
+  ("exp_exps"               , "exp_progs"):       ("exp_progs_id"      , "id"),
+
+  ("exp_exps_queue"         , "exp_exps"):        ("exp_exps_id"       , "id"),
+
+  ("exp_exps_latest"        , "exp_exps"):        ("exp_exps_id"       , "id"),
+  ("exp_exps_lists_entries" , "exp_exps_latest"): ("exp_exps_id"       , "exp_exps_id")
 }
 
 def get_TableLink(a,b):
@@ -149,11 +188,50 @@ def get_TableLink(a,b):
 		except KeyError:
 			raise Exception(f"there is no link between '{a}' and '{b}'")
 
+# current version of the database layout (see schema.sql and migrations.py)
+db_version = migrations.current_version
+
+# connection profiles, pragma settings that are applied when connecting
+# - journal_mode is persistent in the database file and can only be changed by writing connections
+# - WAL lets readers proceed while one writer is active, but needs shared memory between the processes (no network filesystems)
+# - shared-writer is for several processes on different hosts writing to the same database (run_batch.py --worker)
+connection_profiles = {
+  "default" : {},
+  "shared-writer" : {
+    "journal_mode" : "DELETE",
+    "synchronous"  : "FULL",
+    "cache_size"   : -64 * 1024,
+    "temp_store"   : "MEMORY",
+    "busy_timeout" : 60000},
+  "batch-writer" : {
+    "journal_mode" : "WAL",
+    "synchronous"  : "NORMAL",
+    "cache_size"   : -64 * 1024,
+    "mmap_size"    : 256 * 1024 * 1024,
+    "temp_store"   : "MEMORY",
+    "busy_timeout" : 60000},
+  "reader" : {
+    "cache_size"   : -128 * 1024,
+    "mmap_size"    : 1024 * 1024 * 1024,
+    "temp_store"   : "MEMORY",
+    "busy_timeout" : 60000},
+  "bulk-import" : {
+    "journal_mode" : "WAL",
+    "synchronous"  : "OFF",
+    "cache_size"   : -512 * 1024,
+    "mmap_size"    : 1024 * 1024 * 1024,
+    "temp_store"   : "MEMORY",
+    "busy_timeout" : 60000}
+  }
+pragmas_reported = ["journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout", "foreign_keys"]
+
 def _get_repo_rel_path(p):
 	return os.path.join(os.path.join(os.path.dirname(__file__), ".."), p)
 
 # from https://ricardoanderegg.com/posts/python-sqlite-thread-safety/
 # check the used sqlite3 compile option for threadsafety
+# (cached, the compile options do not change while running)
+@functools.lru_cache(maxsize=None)
 def get_sqlite3_thread_safety():
     # Mape value from SQLite's THREADSAFE to Python's DBAPI 2.0
     # threadsafety attribute.
@@ -173,8 +251,22 @@ where compile_options like 'THREADSAFE=%'
 
 
 class LogsDB:
-	def __init__(self, db_file = None, read_only = False):
+	def __init__(self, db_file = None, read_only = False, auto_migrate = True, profile = None, shared_threads = False):
 		self.read_only = read_only
+		# profile: name of the pragma settings in connection_profiles
+		if profile == None:
+			profile = "default"
+		if not profile in connection_profiles.keys():
+			raise Exception(f"unknown connection profile: {profile}")
+		self.profile = profile
+		# auto_migrate: upgrade outdated databases when connecting, otherwise only warn
+		self.auto_migrate = auto_migrate
+		# shared_threads: the connection is handed over between threads, the user serializes the access (e.g., connection pools)
+		self.shared_threads = shared_threads
+		self.version = None
+		# nesting depth of transaction(), the lock keeps the transactions of threads sharing the connection apart
+		self.tr_depth = 0
+		self.tr_lock = threading.RLock()
 
 		if db_file == None:
 			db_file = os.path.join("data", "logs.db")
@@ -198,19 +290,35 @@ class LogsDB:
 
 		if get_sqlite3_thread_safety() == 3:
 			check_same_thread = False
+		elif self.shared_threads:
+			# serialized access from different threads needs at least threadsafety level 1 (no shared module state)
+			if get_sqlite3_thread_safety() < 1:
+				raise Exception("sqlite3 is not thread-safe, cannot share connections between threads")
+			check_same_thread = False
 		else:
 			check_same_thread = True
 
 		db_con_str = f"file:{self.database_file}" + ("?mode=ro" if self.read_only else "")
 		self.con = sl.connect(db_con_str, uri=True, check_same_thread=check_same_thread)
 		self.con.row_factory = sl.Row
+		# the implicit transactions before writing statements take the write lock right away
+		# (with a rollback journal, a deferred transaction keeps its read lock while waiting for the write lock and blocks the commit of the other writer)
+		if not self.read_only:
+			self.con.isolation_level = "IMMEDIATE"
+
+		try:
+			self.apply_profile()
+		except Exception:
+			self.con.close()
+			raise
 
 		if not database_exists:
 			logging.info(f"no database. creating tables and version information")
 			# create tables and finally version information
 			with open(_get_repo_rel_path("lib/schema.sql"), "r") as f:
-				with self.con:
+				with self.transaction():
 					self.con.executescript(f.read())
+			self.version = db_version
 		else:
 			logging.info(f"found database. checking version information")
 			# check version information to ensure tables are as expected
@@ -222,15 +330,54 @@ class LogsDB:
 			versionrows = cur.fetchall()
 			try:
 				assert(len(versionrows) == 1)
-				assert(versionrows[0] == TR_db_meta(id=0, kind="logsdb", name="version", value="1"))
+				assert(versionrows[0]._replace(value=None) == TR_db_meta(id=0, kind="logsdb", name="version", value=None))
+				version = versionrows[0].value
+				assert(migrations.is_known_version(version))
 				logging.info(versionrows[0])
 			except AssertionError:
 				raise Exception("db version could not be determined or is incorrect")
+			self.version = version
+			# migrate older databases
+			if version != db_version:
+				if not self.auto_migrate:
+					logging.warning(f"db version {version} is outdated (current is {db_version})")
+				elif self.read_only:
+					if not migrations.is_compatible(version):
+						raise Exception(f"db version {version} is outdated, migrate it with ./scripts/db-backup.py --migrate")
+					logging.warning(f"db version {version} is outdated, open the database once in write mode to upgrade it to {db_version}")
+				else:
+					self.migrate()
 		# consistency check to see if the table names are as expected
 		#self.to_string()
 
 		self.enable_fk_constraints()
 
+	def migrate(self, dry_run = False):
+		# see migrations.py, takes a backup before applying
+		self.version = migrations.migrate(self, self.version, dry_run)
+
+	def apply_profile(self):
+		cur = self.con.cursor()
+		for (k, v) in connection_profiles[self.profile].items():
+			if k == "journal_mode" and self.read_only:
+				continue
+			sql_str = f"PRAGMA {k} = {v};"
+			logging.info(sql_str)
+			cur.execute(sql_str)
+			res = cur.fetchall()
+			# the journal mode is not changed while other connections are open
+			if k == "journal_mode" and res[0][0].upper() != v:
+				raise Exception(f"cannot change journal_mode to {v} (currently {res[0][0]}), other connections to the database are open")
+
+	def get_pragmas(self):
+		cur = self.con.cursor()
+		cur.row_factory = None
+		res = {}
+		for k in pragmas_reported:
+			cur.execute(f"PRAGMA {k};")
+			res[k] = cur.fetchone()[0]
+		return res
+
 	def enable_fk_constraints(self):
 		# check foreign key support
 		cur = self.con.cursor()
@@ -248,6 +395,48 @@ class LogsDB:
 		# close databse
 		self.con.close()
 
+	# transaction context, can be nested, only the outermost one commits (or rolls back on an exception)
+	# (like this, a sequence of operations can be made all-or-nothing)
+	# other threads wait until the outermost transaction is finished
+	@contextlib.contextmanager
+	def transaction(self):
+		with self.tr_lock:
+			if self.tr_depth > 0:
+				self.tr_depth += 1
+				try:
+					yield self.con
+				finally:
+					self.tr_depth -= 1
+				return
+
+			self.tr_depth = 1
+			try:
+				with self.con:
+					yield self.con
+			finally:
+				self.tr_depth = 0
+
+	# one transaction for a group of operations (functions without arguments), each operation in its own savepoint
+	# (a failing operation is rolled back without affecting the others, the group commits once)
+	# returns a list of (result, exception) pairs
+	def transaction_group(self, operations):
+		results = []
+		with self.transaction():
+			# explicit, the savepoints must not start their own transactions
+			if not self.con.in_transaction:
+				self.con.execute("BEGIN IMMEDIATE")
+			for (i, op) in enumerate(operations):
+				self.con.execute(f"SAVEPOINT group_op_{i}")
+				try:
+					res = op()
+					self.con.execute(f"RELEASE group_op_{i}")
+					results.append((res, None))
+				except Exception as e:
+					self.con.execute(f"ROLLBACK TO group_op_{i}")
+					self.con.execute(f"RELEASE group_op_{i}")
+					results.append((None, e))
+		return results
+
 	def __enter__(self):
 		self.connect()
 		return self
@@ -320,7 +509,7 @@ class LogsDB:
 
 		try:
 			rowid = None
-			with self.con:
+			with self.transaction():
 				cur = self.con.cursor()
 				# if there is an existing entry, take this one
 				if match_existing:
@@ -352,6 +541,83 @@ class LogsDB:
 		except:
 			raise Exception("adding data failed")
 
+	# append many new datasets at once, same restrictions as add_tablerecord
+	# (records are grouped by table and set fields, the groups are inserted in order of their first appearance)
+	# (each batch of batch_size records is inserted in one transaction, using executemany per group)
+	# (read_back selects the inserted rows again and returns them in the order of the input, otherwise returns the number of inserted rows)
+	# (progress is called after each batch with (n_done, n_total, batch_time))
+	def add_tablerecords(self, records, allow_id = False, read_back = False, batch_size = 10000, progress = None):
+		records = list(records)
+		assert(batch_size > 0)
+
+		def prep_group_key(data):
+			(data_type, table) = LogsDB._get_tablerecord_info(data)
+			fields = list(data._fields)
+			# tables with a generic id field need special treatment
+			if (not allow_id) and ("id" in fields):
+				if data.id != None:
+					raise Exception(f"the id cannot be forced on entries for table '{table}', must be None here")
+				fields.remove("id")
+			fields = tuple(filter(lambda n: getattr(data, n) != None, fields))
+			return (data_type, table, fields)
+
+		res = [None] * len(records)
+		n_total = len(records)
+		n_done = 0
+		for b_start in range(0, n_total, batch_size):
+			start_time = time.time()
+			batch = records[b_start:b_start+batch_size]
+
+			# group the batch, keep the order of first appearance
+			groups = {}
+			for (i, data) in enumerate(batch):
+				groups.setdefault(prep_group_key(data), []).append(b_start + i)
+
+			try:
+				with self.transaction():
+					cur = self.con.cursor()
+					for ((data_type, table, fields), idxs) in groups.items():
+						sql_fields_str = f"({', '.join(fields)})"
+						sql_values_str = f"({', '.join(['?'] * len(fields))})"
+						if len(fields) == 0:
+							sql_str = f"INSERT INTO {table} DEFAULT VALUES"
+						else:
+							sql_str = f"INSERT INTO {table} {sql_fields_str} VALUES {sql_values_str}"
+						logging.info(sql_str)
+						sql_values_l = list(map(lambda i: list(map(lambda n: getattr(records[i], n), fields)), idxs))
+						if len(fields) == 0:
+							for _ in idxs:
+								cur.execute(sql_str)
+						else:
+							cur.executemany(sql_str, sql_values_l)
+
+						if not read_back:
+							continue
+						# the rowids are consecutive within one transaction, unless the ids are forced
+						cur.row_factory = None
+						if "id" in fields:
+							rowids = list(map(lambda i: records[i].id, idxs))
+						else:
+							cur.execute("SELECT last_insert_rowid()")
+							last_rowid = cur.fetchone()[0]
+							rowids = list(range(last_rowid - len(idxs) + 1, last_rowid + 1))
+						cur.row_factory = row_factory_simple(data_type._make)
+						for (i, rowid) in zip(idxs, rowids):
+							cur.execute(f"SELECT * FROM {table} WHERE rowid = ?", [rowid])
+							res[i] = cur.fetchone()
+			except:
+				raise Exception("adding data failed")
+
+			n_done += len(batch)
+			batch_time = time.time() - start_time
+			logging.info(f"added {len(batch)} records in {batch_time:.2f}s ({len(batch)/max(batch_time, 1e-6):.0f} records/s, {n_done} of {n_total})")
+			if progress != None:
+				progress(n_done, n_total, batch_time)
+
+		if not read_back:
+			return n_total
+		return res
+
 	# appending to existing metadata
 	# (for metadata tables, kind must be different from None/NULL)
 	# (if entry doesn't exist yet, we fail)
@@ -389,7 +655,7 @@ class LogsDB:
 
 		# all in one transaction
 		try:
-			with self.con:
+			with self.transaction():
 				cur = self.con.cursor()
 				cur.execute(sql_str, sql_values)
 				cur.row_factory = row_factory_simple(data_type._make)
@@ -416,12 +682,107 @@ class LogsDB:
 		except:
 			raise Exception("appending metadata failed")
 
-	def _prep_sql_match(table, fields, id_only = False):
-		# for id_only
-		if not id_only:
-			sql_fields = "*"
-		else:
+	# work queue of experiment runs (table exp_exps_queue)
+	# - an entry is claimed by a worker (owner) with a lease until lease_expiry (unix time), expired leases can be claimed again
+	# - claiming is one atomic update, concurrent workers never hold the same entry at the same time
+	# - the owner should be unique per worker process, e.g., hostname and process id
+
+	# adds the experiments to the queue, entries that exist already are kept, returns the number of new entries
+	def queue_add(self, exp_ids, run_spec):
+		sql_str = "INSERT OR IGNORE INTO exp_exps_queue (exp_exps_id, run_spec) VALUES (?, ?)"
+		try:
+			with self.transaction():
+				n_changes = self.con.total_changes
+				self.con.executemany(sql_str, map(lambda x: (x, run_spec), exp_ids))
+				return self.con.total_changes - n_changes
+		except:
+			raise Exception("adding to queue failed")
+
+	# claims up to n entries that are not completed and not leased, entries with fewer attempts first
+	# returns the claimed entries (attempts are counted when claiming)
+	def queue_claim(self, run_spec, owner, lease_time, n = 1, max_attempts = None):
+		assert(n > 0 and lease_time > 0)
+		now = time.time()
+		lease_expiry = now + lease_time
+		sql_attempts_str = "" if max_attempts == None else " AND attempts < ?"
+		sql_attempts_vl  = [] if max_attempts == None else [max_attempts]
+		sql_str  = "UPDATE exp_exps_queue SET lease_owner = ?, lease_expiry = ?, attempts = attempts + 1\n"
+		sql_str += "WHERE id IN (\n"
+		sql_str += "  SELECT id FROM exp_exps_queue\n"
+		sql_str += f"  WHERE run_spec = ? AND completed = 0 AND (lease_expiry IS NULL OR lease_expiry < ?){sql_attempts_str}\n"
+		sql_str += "  ORDER BY attempts, id LIMIT ?)"
+		sql_values = [owner, lease_expiry, run_spec, now] + sql_attempts_vl + [n]
+		try:
+			with self.transaction():
+				cur = self.con.cursor()
+				cur.execute(sql_str, sql_values)
+				# owner and expiry identify the entries of this claim
+				cur.execute("SELECT * FROM exp_exps_queue WHERE lease_owner = ? AND lease_expiry = ? ORDER BY attempts, id", [owner, lease_expiry])
+				cur.row_factory = row_factory_simple(TR_exp_exps_queue._make)
+				return list(cur.fetchall())
+		except:
+			raise Exception("claiming from queue failed")
+
+	def _queue_update_owned(self, entries, owner, sql_set_str, sql_set_vl):
+		# returns the entries where the lease is still owned (only these are updated)
+		sql_str = f"UPDATE exp_exps_queue SET {sql_set_str} WHERE id = ? AND lease_owner = ? AND completed = 0"
+		res = []
+		try:
+			with self.transaction():
+				cur = self.con.cursor()
+				for e in entries:
+					cur.execute(sql_str, sql_set_vl + [e.id, owner])
+					if cur.rowcount == 1:
+						res.append(e)
+		except:
+			raise Exception("updating queue failed")
+		return res
+
+	# extends the leases, returns the entries where the lease is still owned
+	def queue_renew(self, entries, owner, lease_time):
+		return self._queue_update_owned(entries, owner, "lease_expiry = ?", [time.time() + lease_time])
+
+	# marks the entries as completed, returns the entries where the lease was still owned
+	def queue_complete(self, entries, owner):
+		return self._queue_update_owned(entries, owner, "completed = 1, lease_owner = NULL, lease_expiry = NULL", [])
+
+	# gives up the leases without completing (e.g., after a failed run), returns the entries where the lease was still owned
+	def queue_release(self, entries, owner):
+		return self._queue_update_owned(entries, owner, "lease_owner = NULL, lease_expiry = NULL", [])
+
+	# latest run per experiment and run_spec (table exp_exps_latest, derived from the run metadata)
+
+	# sets the run as latest run, unless there is a later one already (greater run_id)
+	def set_latest_run(self, exp_id, run_spec, run_id, is_complete, result_class):
+		sql_str  = "INSERT INTO exp_exps_latest (exp_exps_id, run_spec, run_id, is_complete, result_class) VALUES (?, ?, ?, ?, ?)\n"
+		sql_str += "ON CONFLICT (exp_exps_id, run_spec) DO UPDATE SET run_id = excluded.run_id, is_complete = excluded.is_complete, result_class = excluded.result_class\n"
+		sql_str += "WHERE excluded.run_id >= exp_exps_latest.run_id"
+		try:
+			with self.transaction():
+				self.con.execute(sql_str, [exp_id, run_spec, run_id, 1 if is_complete else 0, result_class])
+		except:
+			raise Exception("setting latest run failed")
+
+	# recomputes the whole table from the run metadata, returns the number of entries
+	def rebuild_latest(self):
+		try:
+			with self.transaction():
+				self.con.execute("DELETE FROM exp_exps_latest")
+				self.con.execute(migrations.sql_fill_latest)
+				return self.con.execute("SELECT COUNT(*) FROM exp_exps_latest").fetchone()[0]
+		except:
+			raise Exception("rebuilding the latest runs failed")
+
+	def _prep_sql_match(table, fields, id_only = False, sel_fields = None, count_only = False):
+		# for count_only, id_only and projection to sel_fields
+		if count_only:
+			sql_fields = "COUNT(*)"
+		elif id_only:
 			sql_fields = "id"
+		elif sel_fields != None:
+			sql_fields = ", ".join(sel_fields)
+		else:
+			sql_fields = "*"
 
 		sql_cond_strs = []
 		for f in fields:
@@ -432,33 +793,71 @@ class LogsDB:
 		logging.info(sql_str)
 		return sql_str
 
+	def _get_row_factory(data_type, id_only, sel_fields):
+		if id_only:
+			return row_factory_simple(TR_id_only._make)
+		elif sel_fields != None:
+			return row_factory_projected(data_type, sel_fields)
+		else:
+			return row_factory_simple(data_type._make)
+
+	# generator over the resulting rows, fetches arraysize rows at a time
+	# (stopping the iteration early, e.g., with break, closes the cursor)
+	def _iter_sql(self, sql_str, sql_values, row_factory, arraysize):
+		cur = self.con.cursor()
+		cur.arraysize = arraysize
+		try:
+			try:
+				cur.execute(sql_str, sql_values)
+			except:
+				raise Exception("retrieving data failed")
+			cur.row_factory = row_factory
+			while True:
+				try:
+					rows = cur.fetchmany()
+				except:
+					raise Exception("retrieving data failed")
+				if len(rows) == 0:
+					break
+				for r in rows:
+					yield r
+		finally:
+			cur.close()
+
+	# for very simple matching queries, as generator
+	# (fields: projection, the other fields of the returned records are None)
+	def iter_tablerecord_matches(self, data, id_only = False, fields = None, arraysize = 1000):
+		(data_type, table) = LogsDB._get_tablerecord_info(data)
+
+		m_fields = list(filter(lambda n: getattr(data, n) != None, data._fields))
+		sql_values = list(map(lambda n: getattr(data, n), m_fields))
+
+		row_factory = LogsDB._get_row_factory(data_type, id_only, fields)
+		sql_str = LogsDB._prep_sql_match(table, m_fields, id_only, fields)
+
+		return self._iter_sql(sql_str, sql_values, row_factory, arraysize)
+
 	# for very simple matching queries
-	def get_tablerecord_matches(self, data, count_only = False, id_only = False):
+	def get_tablerecord_matches(self, data, count_only = False, id_only = False, fields = None):
+		if not count_only:
+			return list(self.iter_tablerecord_matches(data, id_only, fields))
+
 		(data_type, table) = LogsDB._get_tablerecord_info(data)
 
 		fields = list(filter(lambda n: getattr(data, n) != None, data._fields))
 		sql_values = list(map(lambda n: getattr(data, n), fields))
 
-		sql_str = LogsDB._prep_sql_match(table, fields, id_only)
+		# counting is done by the database
+		sql_str = LogsDB._prep_sql_match(table, fields, count_only=True)
 
 		try:
-			with self.con:
+			with self.transaction():
 				cur = self.con.cursor()
 				if len(fields) == 0:
 					cur.execute(sql_str)
 				else:
 					cur.execute(sql_str, sql_values)
-				if count_only:
-					n = 0
-					for _ in cur:
-						n += 1
-					return n
-				else:
-					if not id_only:
-						cur.row_factory = row_factory_simple(data_type._make)
-					else:
-						cur.row_factory = row_factory_simple(TR_id_only._make)
-					return list(cur.fetchall())
+				return cur.fetchone()[0]
 		except:
 			raise Exception("retrieving data failed")
 
@@ -467,7 +866,7 @@ class LogsDB:
 			(arg1, vl1) = LogsDB._get_sql_from_exp(ids, tables, exp.arg)
 			return (f"NOT ({arg1})", vl1)
 		elif type(exp) is QE_Bin:
-			if   exp.op in [QE_Bop.AND, QE_Bop.OR, QE_Bop.EQ, QE_Bop.LIKE, QE_Bop.IN]:
+			if   exp.op in [QE_Bop.AND, QE_Bop.OR, QE_Bop.EQ, QE_Bop.LIKE, QE_Bop.IN, QE_Bop.GT, QE_Bop.LT]:
 				(arg1, vl1) = LogsDB._get_sql_from_exp(ids, tables, exp.arg1)
 				(arg2, vl2) = LogsDB._get_sql_from_exp(ids, tables, exp.arg2)
 				return (f"(({arg1}) {exp.op.value} ({arg2}))", vl1+vl2)
@@ -495,8 +894,7 @@ class LogsDB:
 		else:
 			raise Exception(f"unknown expression: {exp}")
 
-	# for more complex queries
-	def get_tablerecords(self, table, joins, query_exp, order_by = [], count_only = False, id_only = False):
+	def _prep_sql_query(table, joins, query_exp, order_by = [], id_only = False, sel_fields = None, limit = None, offset = None):
 		# more advanced queries - combinations on related tables:
 		#          - inner joins given as list where first one is the queried type, all together are used for the query
 		# fixed to inner join for now, probably don't need more at first
@@ -542,12 +940,24 @@ class LogsDB:
 		sql_order_by_str = ""
 		if len(order_by_l) > 0:
 			sql_order_by_str = f"ORDER BY {', '.join(order_by_l)}"
-
-		# for id_only
-		if not id_only:
-			sql_fields = f"DISTINCT {_tables_ids[0]}.*"
-		else:
+		# paging with limit and offset (sqlite needs a limit for an offset, -1 is unlimited)
+		sql_limit_str = ""
+		sql_limit_vl  = []
+		if limit != None or offset != None:
+			if not all(map(lambda x: x == None or (type(x) is int and x >= 0), [limit, offset])):
+				raise Exception("limit and offset must be non-negative integers")
+			sql_limit_str = "LIMIT ? OFFSET ?"
+			sql_limit_vl  = [-1 if limit == None else limit, 0 if offset == None else offset]
+
+		# for id_only and projection to sel_fields
+		if id_only:
 			sql_fields = f"{_tables_ids[0]}.id"
+		elif sel_fields != None:
+			if len(sel_fields) == 0 or not all(map(lambda f: f in TR_by_table[table]._fields, sel_fields)):
+				raise Exception(f"invalid field selection for table '{table}': {sel_fields}")
+			sql_fields = f"DISTINCT {', '.join(map(lambda f: f'{_tables_ids[0]}.{f}', sel_fields))}"
+		else:
+			sql_fields = f"DISTINCT {_tables_ids[0]}.*"
 
 		# generate whole query
 		sql_str  = f"SELECT {sql_fields} FROM (\n"
@@ -556,37 +966,60 @@ class LogsDB:
 		sql_str += "WHERE (\n"
 		sql_str += sql_w_str + "\n"
 		sql_str += ")\n"
-		sql_str += sql_order_by_str
+		sql_str += sql_order_by_str + "\n"
+		sql_str += sql_limit_str
 		#print(60 * "=")
 		#print(sql_str)
 		#print(sql_w_vl)
+		return (sql_str, sql_w_vl + sql_limit_vl)
+
+	# for more complex queries, as generator
+	# (fields: projection, the other fields of the returned records are None)
+	# (limit and offset: paging, applied after ordering)
+	def iter_tablerecords(self, table, joins, query_exp, order_by = [], id_only = False, fields = None, limit = None, offset = None, arraysize = 1000):
+		(sql_str, sql_w_vl) = LogsDB._prep_sql_query(table, joins, query_exp, order_by, id_only, fields, limit, offset)
+		row_factory = LogsDB._get_row_factory(TR_by_table[table], id_only, fields)
+		return self._iter_sql(sql_str, sql_w_vl, row_factory, arraysize)
+
+	# for more complex queries
+	# (fields: projection, distinct and transfer only operate on these columns, count_only counts the distinct projected rows)
+	def get_tablerecords(self, table, joins, query_exp, order_by = [], count_only = False, id_only = False, fields = None, limit = None, offset = None):
+		if not count_only:
+			return list(self.iter_tablerecords(table, joins, query_exp, order_by, id_only, fields, limit, offset))
+
+		(sql_str, sql_w_vl) = LogsDB._prep_sql_query(table, joins, query_exp, order_by, id_only, fields, limit, offset)
 
 		# for count_only
 		count_column_id = "_COUNT"
 		if count_only:
 			sql_str = f"SELECT COUNT(*) AS {count_column_id} FROM ({sql_str})"
 
-		data_type = TR_by_table[table]
 		try:
-			with self.con:
+			with self.transaction():
 				cur = self.con.cursor()
 				if len(sql_w_vl) == 0:
 					cur.execute(sql_str)
 				else:
 					cur.execute(sql_str, sql_w_vl)
-				if not count_only:
-					if not id_only:
-						cur.row_factory = row_factory_simple(data_type._make)
-					else:
-						cur.row_factory = row_factory_simple(TR_id_only._make)
-					return list(cur.fetchall())
-				else:
-					c_l = list(cur.fetchall())
-					assert(len(c_l) == 1)
-					return c_l[0][count_column_id]
+				c_l = list(cur.fetchall())
+				assert(len(c_l) == 1)
+				return c_l[0][count_column_id]
 		except:
 			raise Exception("retrieving data failed")
 
+	# raw sql query, as generator (same restrictions as get_tablerecords_sql)
+	# if table name is provided, table record values are created from resulting rows, otherwise rows as simple lists
+	def iter_tablerecords_sql(self, sql, table = None, arraysize = 1000):
+		if not self.read_only:
+			raise Exception("only allowed in read-only mode")
+		assert(type(sql) == str)
+
+		if table == None:
+			row_factory = row_factory_simple(list)
+		else:
+			row_factory = row_factory_simple(TR_by_table[table]._make)
+		return self._iter_sql(sql, [], row_factory, arraysize)
+
 	# raw sql query
 	def get_tablerecords_sql(self, sql, table = None):
 		# - for most complex queries
@@ -604,7 +1037,7 @@ class LogsDB:
 		assert(type(sql_str) == str)
 
 		try:
-			with self.con:
+			with self.transaction():
 				cur = self.con.cursor()
 				cur.execute(sql_str)
 				if data_type != None:
@@ -621,6 +1054,8 @@ class LogsDB:
 
 	def to_string(self, with_entries = False):
 		res = []
+		pragmas_str = ", ".join(map(lambda x: f"{x[0]}={x[1]}", self.get_pragmas().items()))
+		res.append(f"Pragmas (profile: {self.profile}): {pragmas_str}")
 		res.append(f"Tables (file: {self.database_file}, changes: {self.con.total_changes}):")
 		cur = self.con.cursor()
 		cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
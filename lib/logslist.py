@@ -20,6 +20,7 @@ class LogsList:
 
 		self.entry_ids = None
 		self.entries = None
+		self.num_entries = None
 
 	def get_listtype(self):
 		return self.listtype
@@ -35,6 +36,16 @@ class LogsList:
 
 	# link to entries
 	# =========================================
+	def count(self):
+		if self.num_entries == None:
+			if self.entry_ids != None:
+				self.num_entries = len(self.entry_ids)
+			else:
+				tr = ldb.get_empty_TableRecord(f"exp_{self.listtype}s_lists_entries")
+				tr_ = tr._replace(**{f"exp_{self.listtype}s_lists_id": self.get_logslist_id()})
+				self.num_entries = self.db.get_tablerecord_matches(tr_, count_only=True)
+		return self.num_entries
+
 	def get_entry_ids(self):
 		if self.entry_ids == None:
 			tr = ldb.get_empty_TableRecord(f"exp_{self.listtype}s_lists_entries")
@@ -43,19 +54,60 @@ class LogsList:
 			self.entry_ids = list(map(lambda x: (x.list_index, getattr(x, f"exp_{self.listtype}s_id")), entries))
 		return self.entry_ids
 
-	def get_entries(self):
+	# query expression for the entries of this list (table at index idx), optionally only with a list index greater than min_index
+	def _get_entries_exp(self, idx, min_index = None):
+		exp_list = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=idx, field=f"exp_{self.listtype}s_lists_id"), arg2=ldb.QE_Const(value=self.get_logslist_id()))
+		if min_index == None:
+			return exp_list
+		exp_gt   = ldb.QE_Bin(op=ldb.QE_Bop.GT, arg1=ldb.QE_Ref(index=idx, field="list_index"), arg2=ldb.QE_Const(value=min_index))
+		return ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=exp_list, arg2=exp_gt)
+
+	# objects for the pairs (list_index, id) of entries, the records are loaded by joining with the entries (a constant number of queries)
+	def _hydrate(self, entry_ids, min_index = None):
+		entries_table = f"exp_{self.listtype}s_lists_entries"
+		if   self.listtype == "prog":
+			progs = self.db.get_tablerecords("exp_progs", [(entries_table, 0)], self._get_entries_exp(1, min_index))
+			progs = dict(map(lambda x: (x.id, x), progs))
+			return list(map(lambda x: (x[0], program.Program(self.db, progs[x[1]])), entry_ids))
+		elif self.listtype == "exp":
+			exps  = self.db.get_tablerecords("exp_exps", [(entries_table, 0)], self._get_entries_exp(1, min_index))
+			exps  = dict(map(lambda x: (x.id, x), exps))
+			progs = self.db.get_tablerecords("exp_progs", [("exp_exps", 0), (entries_table, 1)], self._get_entries_exp(2, min_index))
+			progs = dict(map(lambda x: (x.id, program.Program(self.db, x)), progs))
+			entries = []
+			for (list_index, exp_id) in entry_ids:
+				exp = experiment.Experiment(self.db, exps[exp_id])
+				exp.prog = progs[exp.get_prog_id()]
+				entries.append((list_index, exp))
+			return entries
+		else:
+			assert(False)
+
+	# name_prefix: preload the metadata of the experiments with this name prefix (see Experiment.preload_metadata)
+	def get_entries(self, name_prefix = None):
 		if self.entries == None:
-			entry_ids = self.get_entry_ids()
-			genfun = None
-			if   self.listtype == "prog":
-				genfun = program.Program
-			elif self.listtype == "exp":
-				genfun = experiment.Experiment
-			else:
-				assert(False)
-			self.entries = list(map(lambda x: (x[0], genfun(self.db, x[1])), entry_ids))
+			self.entries = self._hydrate(self.get_entry_ids())
+		if name_prefix != None and self.listtype == "exp":
+			experiment.Experiment.preload_metadata(self.db, map(lambda x: x[1], self.entries), name_prefix)
 		return self.entries
 
+	# entries with a list index greater than min_index, in the order of the list (not cached, e.g., for polling growing lists)
+	def get_entries_after(self, min_index, name_prefix = None):
+		entries_table = f"exp_{self.listtype}s_lists_entries"
+		entries = self.db.get_tablerecords(entries_table, [], self._get_entries_exp(0, min_index), order_by=[(0, "list_index", True)])
+		entries = self._hydrate(list(map(lambda x: (x.list_index, getattr(x, f"exp_{self.listtype}s_id")), entries)), min_index)
+		if name_prefix != None and self.listtype == "exp":
+			experiment.Experiment.preload_metadata(self.db, map(lambda x: x[1], entries), name_prefix)
+		return entries
+
+	# latest runs of the experiments in this list with one query (see Experiment.get_latest_runs)
+	def get_latest_runs(self, run_spec, min_index = None):
+		assert(self.listtype == "exp")
+		exp_spec = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="run_spec"), arg2=ldb.QE_Const(value=run_spec))
+		query_exp = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=exp_spec, arg2=self._get_entries_exp(1, min_index))
+		latest = self.db.get_tablerecords("exp_exps_latest", [("exp_exps_lists_entries", 0)], query_exp)
+		return dict(map(lambda x: (x.exp_exps_id, x), latest))
+
 	# find logslists
 	# =========================================
 	def _get_all(db, listtype):
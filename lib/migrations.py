@@ -0,0 +1,182 @@
+import logging
+import time
+import collections
+
+# schema migrations of the logs database
+# - the registry is ordered, each step upgrades to its version from the version of the previous step
+# - all sql statements of a step must be idempotent (e.g., "IF NOT EXISTS"), they run in one transaction together with the version update
+# - compatible: the library can still read a database where this step is not applied yet (e.g., plain indexes)
+# - estimate: function from sqlite connection to a pair of number of rows to process and approximate number of bytes added
+Migration = (
+  collections.namedtuple("Migration",
+  ["version", "description", "sql", "estimate", "compatible"]))
+
+# rough throughput assumptions for the dry run
+_est_rows_per_s  = 200000
+_est_bytes_per_s = 100 * 1024 * 1024
+
+def _estimate_indexes(indexes):
+	def estimate(con):
+		n_rows  = 0
+		n_bytes = 0
+		for (table, cols) in indexes:
+			sql_len = " + ".join(map(lambda c: f"IFNULL(LENGTH({c}), 0)", cols))
+			(n, s) = con.execute(f"SELECT COUNT(*), IFNULL(SUM({sql_len}), 0) FROM {table}").fetchone()
+			n_rows  += n
+			# key columns plus rowid and record overhead per index entry
+			n_bytes += s + n * (8 + 2 * len(cols))
+		return (n_rows, n_bytes)
+	return estimate
+
+# table of the latest run per experiment and run_spec (exp_exps_latest)
+# - the latest run is the one with the greatest run id (lexicographic, like Experiment.get_latest_run_id)
+# - a run is complete with output_uart and result, the result class is derived from the json value of the result
+#   (keep in sync with experiment._get_result_class)
+# - the same statement fills the table in the migration and rebuilds it later (LogsDB.rebuild_latest)
+sql_fill_latest = """INSERT OR REPLACE INTO exp_exps_latest (exp_exps_id, run_spec, run_id, is_complete, result_class)
+SELECT exp_exps_id, run_spec, MAX(run_id), is_complete, result_class FROM (
+  SELECT exp_exps_id, run_id,
+    SUBSTR(run_id, 1, INSTR(run_id, '.') + INSTR(SUBSTR(run_id, INSTR(run_id, '.') + 1), '.') - 1) AS run_spec,
+    has_output AND result IS NOT NULL AS is_complete,
+    CASE
+      WHEN result IS NULL THEN NULL
+      WHEN result = 'true' THEN 'example'
+      WHEN result = 'false' THEN 'counterexample'
+      WHEN result GLOB '"special :::: INCONCLUSIVE: *' THEN 'inconclusive'
+      WHEN result GLOB '"embexp.board.exception :::: *' THEN 'exception'
+      ELSE 'other'
+    END AS result_class
+  FROM (
+    SELECT exp_exps_id, SUBSTR(name, 5) AS run_id,
+      MAX(kind = 'output_uart') AS has_output,
+      MAX(CASE WHEN kind = 'result' THEN value END) AS result
+    FROM exp_exps_meta
+    WHERE name GLOB 'run.*'
+    GROUP BY exp_exps_id, name))
+-- sqlite takes the other columns from the row with the greatest run id
+GROUP BY exp_exps_id, run_spec"""
+
+def _estimate_latest(con):
+	(n_rows, n_runs, n_bytes) = con.execute("SELECT COUNT(*), COUNT(DISTINCT exp_exps_id || name), IFNULL(SUM(LENGTH(name)), 0) FROM exp_exps_meta WHERE name GLOB 'run.*'").fetchone()
+	# at most one entry per run, with an index entry
+	return (n_rows, 2 * (n_bytes // max(n_rows, 1) + 40) * n_runs)
+
+registry = [
+  Migration(
+    version = "1",
+    description = "initial layout",
+    sql = [],
+    estimate = lambda con: (0, 0),
+    compatible = True),
+  Migration(
+    version = "2",
+    description = "secondary indexes for lookups of runs and list memberships",
+    sql = [
+      "CREATE INDEX IF NOT EXISTS IX_exp_exps_meta_kind_name ON exp_exps_meta (kind, name)",
+      "CREATE INDEX IF NOT EXISTS IX_exp_exps_meta_name ON exp_exps_meta (name)",
+      "CREATE INDEX IF NOT EXISTS IX_exp_exps_lists_entries_exp_exps ON exp_exps_lists_entries (exp_exps_id)",
+      "CREATE INDEX IF NOT EXISTS IX_exp_progs_lists_entries_exp_progs ON exp_progs_lists_entries (exp_progs_id)"
+      ],
+    estimate = _estimate_indexes([
+      ("exp_exps_meta", ["kind", "name"]),
+      ("exp_exps_meta", ["name"]),
+      ("exp_exps_lists_entries", ["exp_exps_id"]),
+      ("exp_progs_lists_entries", ["exp_progs_id"])
+      ]),
+    compatible = True),
+  Migration(
+    version = "3",
+    description = "work queue of experiment runs with leases",
+    sql = [
+      """CREATE TABLE IF NOT EXISTS exp_exps_queue (
+  id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+  exp_exps_id INTEGER NOT NULL,
+  run_spec TEXT NOT NULL,
+  lease_owner TEXT,
+  lease_expiry REAL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  completed INTEGER NOT NULL DEFAULT 0,
+  CONSTRAINT UC_exp_exps_queue UNIQUE (exp_exps_id, run_spec),
+  CONSTRAINT FK_exp_exps FOREIGN KEY (exp_exps_id) REFERENCES exp_exps(id)
+)""",
+      "CREATE INDEX IF NOT EXISTS IX_exp_exps_queue_claim ON exp_exps_queue (run_spec, completed, lease_expiry)"
+      ],
+    estimate = lambda con: (0, 0),
+    compatible = True),
+  Migration(
+    version = "4",
+    description = "table of the latest run per experiment and run_spec",
+    sql = [
+      """CREATE TABLE IF NOT EXISTS exp_exps_latest (
+  exp_exps_id INTEGER NOT NULL,
+  run_spec TEXT NOT NULL,
+  run_id TEXT NOT NULL,
+  is_complete INTEGER NOT NULL,
+  result_class TEXT,
+  CONSTRAINT PK_exp_exps_latest PRIMARY KEY (exp_exps_id, run_spec),
+  CONSTRAINT FK_exp_exps FOREIGN KEY (exp_exps_id) REFERENCES exp_exps(id)
+)""",
+      "CREATE INDEX IF NOT EXISTS IX_exp_exps_latest_run_spec ON exp_exps_latest (run_spec, is_complete, result_class)",
+      sql_fill_latest
+      ],
+    estimate = _estimate_latest,
+    # the scripts read the results from the new table
+    compatible = False)
+  ]
+
+current_version = registry[-1].version
+
+def is_known_version(version):
+	return version in map(lambda x: x.version, registry)
+
+def get_pending(version):
+	if not is_known_version(version):
+		raise Exception(f"unknown db version: {version}")
+	return list(filter(lambda x: int(x.version) > int(version), registry))
+
+def is_compatible(version):
+	return all(map(lambda x: x.compatible, get_pending(version)))
+
+def estimate(db, version):
+	# returns the estimation for each pending step and for the backup as list of triples (description, seconds, bytes)
+	res = []
+	(page_count,) = db.con.execute("PRAGMA page_count").fetchone()
+	(page_size,)  = db.con.execute("PRAGMA page_size").fetchone()
+	db_size = page_count * page_size
+	res.append(("backup", db_size / _est_bytes_per_s, 0))
+	for m in get_pending(version):
+		(n_rows, n_bytes) = m.estimate(db.con)
+		res.append((f"version {m.version}: {m.description}", n_rows / _est_rows_per_s, n_bytes))
+	return res
+
+def migrate(db, version, dry_run = False, backup = True):
+	pending = get_pending(version)
+	if len(pending) == 0:
+		logging.info(f"db version {version} is up to date")
+		return version
+
+	if dry_run:
+		for (desc, est_s, est_b) in estimate(db, version):
+			print(f"- {desc}: ~{est_s:.1f}s, ~{est_b / (1024 * 1024):+.1f}MB")
+		return version
+
+	if db.read_only:
+		raise Exception("cannot migrate a database in read-only mode")
+
+	if backup:
+		logging.warning(f"taking a backup before migrating")
+		db.backup()
+
+	for m in pending:
+		logging.warning(f"migrating db from version {version} to {m.version} ({m.description})")
+		start_time = time.time()
+		with db.con:
+			# explicit transaction, sqlite3 does not open one implicitly for schema statements
+			db.con.execute("BEGIN")
+			for sql_str in m.sql:
+				logging.info(sql_str)
+				db.con.execute(sql_str)
+			db.con.execute("UPDATE db_meta SET value = ? WHERE id = 0", [m.version])
+		version = m.version
+		logging.warning(f"migration to version {version} took {time.time() - start_time:.2f}s")
+	return version
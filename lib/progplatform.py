@@ -1,6 +1,11 @@
 
 import logging
 import os
+import glob
+import shutil
+import hashlib
+import threading
+import time
 
 import experiment
 from helpers import *
@@ -24,6 +29,16 @@ def get_embexp_ProgPlatform(embexp_arg):
 	assert os.path.isdir(progplat_path)
 	return ProgPlatform(progplat_path)
 
+def get_embexp_box_path(embexp_arg):
+	const_envnamebox = "EMBEXP_BOX"
+	if const_envnamebox in os.environ:
+		box_path = os.environ[const_envnamebox]
+	else:
+		embexp_path = _autodetect_embexp_path(embexp_arg)
+		box_path = os.path.join(embexp_path, "EmbExp-Box")
+	assert os.path.isdir(box_path)
+	return box_path
+
 def get_default_branch(board_type):
 	assert board_type != None
 	assert board_type == "rpi3" or board_type == "rpi4"
@@ -35,9 +50,12 @@ def decide_branchname(branchname, board_type):
 	return branchname
 
 def copy_to_temp_widx(progplat, idx):
+	return copy_to_temp_dir(progplat, "inst_" + str(idx))
+
+def copy_to_temp_dir(progplat, name):
 	#construct the directory name under temp
 	sourcedir = progplat.progplat_path
-	dirname = sourcedir + "/temp/inst_" + str(idx)
+	dirname = sourcedir + "/temp/" + name
 	#delete the directory if it is there
 	logging.debug(f"preparing {dirname}")
 	call_cmd(["rm", "-rf", dirname], f"couldn't remove target directory {dirname}", False, False)
@@ -47,7 +65,197 @@ def copy_to_temp_widx(progplat, idx):
 	call_cmd(["rsync", "--ignore-existing", "--exclude", "temp/", "-r", sourcedir + "/", dirname + ""], f"couldn't copy source directory {sourcedir} to target directory {dirname}", False, False)
 	return ProgPlatform(dirname)
 
+def clone_to_temp_dir(progplat, name):
+	# local git clone (objects are hardlinked), an independent repository for checkouts and cleanups
+	sourcedir = progplat.progplat_path
+	dirname = sourcedir + "/temp/" + name
+	logging.debug(f"cloning {sourcedir} to {dirname}")
+	call_cmd(["rm", "-rf", dirname], f"couldn't remove target directory {dirname}", False, False)
+	call_cmd(["git", "clone", "--quiet", "--local", sourcedir, dirname], f"couldn't clone source directory {sourcedir} to target directory {dirname}", False, False)
+	return ProgPlatform(dirname)
+
+# progplatform directories for the embexp remote indexes
+# - "copy": a fresh copy for each experiment (copy_to_temp_widx)
+# - "persistent": one local clone per index (temp/ws_<idx>), created on first use in a batch and then reused,
+#   the cleanup after each experiment resets it incrementally (ProgPlatform.reset_experiment, only the files written for the experiment
+#   and the directories of the build), with a full cleanup every session_verify_every cleanups
+# - the time spent for preparing and cleaning up the directories is recorded for comparing the modes
+# - with session_branch, the persistent workspaces run in session mode (see ProgPlatform.start_session)
+class Workspaces:
+	def __init__(self, progplat, mode = "copy", session_branch = None, session_verify_every = 50):
+		if not mode in ["copy", "persistent"]:
+			raise Exception(f"unknown workspace mode: {mode}")
+		self.progplat = progplat
+		self.mode = mode
+		self.session_branch = session_branch
+		self.session_verify_every = session_verify_every
+		self.workspaces = {}
+		# number of cleanups per persistent workspace (progplatform path)
+		self.n_cleanups = {}
+		self.lock = threading.Lock()
+		# [count, time]
+		self.stats = {"create": [0, 0.0], "reuse": [0, 0.0], "cleanup": [0, 0.0]}
+
+	def _add_stat(self, kind, start_time):
+		with self.lock:
+			self.stats[kind][0] += 1
+			self.stats[kind][1] += time.time() - start_time
+
+	# one user per index at a time
+	def get(self, idx):
+		start_time = time.time()
+		if self.mode == "copy":
+			progplat = copy_to_temp_widx(self.progplat, idx)
+			self._add_stat("create", start_time)
+			return progplat
+		if idx in self.workspaces:
+			self._add_stat("reuse", start_time)
+			return self.workspaces[idx]
+		progplat = clone_to_temp_dir(self.progplat, f"ws_{idx}")
+		if self.session_branch != None:
+			progplat.start_session(self.session_branch, self.session_verify_every)
+		self.workspaces[idx] = progplat
+		self._add_stat("create", start_time)
+		return progplat
+
+	def cleanup(self, progplat, force_cleanup):
+		start_time = time.time()
+		if self.mode == "persistent" and progplat.session == None and force_cleanup == "all":
+			with self.lock:
+				n = self.n_cleanups.get(progplat.progplat_path, 0) + 1
+				self.n_cleanups[progplat.progplat_path] = n
+			if n % self.session_verify_every == 0:
+				progplat.check_clean(force_cleanup)
+			else:
+				progplat.reset_experiment()
+		else:
+			progplat.check_clean(force_cleanup)
+		self._add_stat("cleanup", start_time)
+
+	def get_stats_str(self):
+		def stat_str(kind):
+			(n, t) = self.stats[kind]
+			return f"{n} {kind} {t:.2f}s ({0 if n == 0 else t / n:.3f}s each)"
+		return f"{self.mode} mode, " + ", ".join(map(stat_str, ["create", "reuse", "cleanup"]))
+
+# cache of build outputs, content-addressed by the inputs of the build
+# - key: commit hash, board type, Makefile.config and the generated asm*.h experiment files
+# - the output directory of a build is stored under the key and copied back instead of building again
+# - restored files get fresh timestamps (no shutil.copy2), so that make sees them as newer than the freshly written inputs
+class BuildCache:
+	# build outputs (the output directory of the progplatform) by a hash of the build inputs
+	# - at most max_entries entries are kept, the least recently used ones are evicted
+	# - hits count only builds that are skipped, restoring an output that was built ahead (prebuilt) is no hit
+	def __init__(self, cache_dir = None, max_entries = 1000):
+		assert(max_entries > 0)
+		if cache_dir == None:
+			cache_dir = os.path.join(os.path.dirname(__file__), "../data/build_cache")
+		self.cache_dir = os.path.abspath(cache_dir)
+		self.max_entries = max_entries
+		os.makedirs(self.cache_dir, exist_ok=True)
+		self.lock = threading.Lock()
+		self.prebuilt = set()
+		self.n_hits = 0
+		self.n_misses = 0
+		self.n_prebuilt = 0
+		self.n_evicted = 0
+
+	def get_key(self, progplat):
+		assert progplat.board_type != None
+		h = hashlib.sha256()
+		def add(name, data):
+			h.update(f"{name}:{len(data)}:".encode("utf-8"))
+			h.update(data)
+		add("commit", progplat.get_commit_hash().encode("ascii"))
+		add("board_type", progplat.board_type.encode("ascii"))
+		with open(os.path.join(progplat.progplat_path, "Makefile.config"), "rb") as f:
+			add("Makefile.config", f.read())
+		for filename in sorted(glob.glob(os.path.join(progplat.progplat_path, "all/inc/experiment/asm*.h"))):
+			with open(filename, "rb") as f:
+				add(os.path.basename(filename), f.read())
+		return h.hexdigest()
+
+	def _get_entry_dir(self, key):
+		return os.path.join(self.cache_dir, key[:2], key)
+
+	def contains(self, key):
+		return os.path.isdir(self._get_entry_dir(key))
+
+	def restore(self, progplat, key):
+		entry_dir = self._get_entry_dir(key)
+		output_dir = os.path.join(progplat.progplat_path, ProgPlatform.output_dirname)
+		hit = os.path.isdir(entry_dir)
+		if hit:
+			logging.debug(f"restoring build output from {entry_dir}")
+			shutil.rmtree(output_dir, ignore_errors=True)
+			try:
+				shutil.copytree(entry_dir, output_dir, copy_function=shutil.copy)
+				# recently used
+				os.utime(entry_dir)
+			except FileNotFoundError:
+				# evicted in the meantime
+				shutil.rmtree(output_dir, ignore_errors=True)
+				hit = False
+		with self.lock:
+			if not hit:
+				self.n_misses += 1
+			elif key in self.prebuilt:
+				self.prebuilt.remove(key)
+				self.n_prebuilt += 1
+			else:
+				self.n_hits += 1
+		return hit
+
+	# prebuilt: built ahead of the run (see exp_pipeline.py), the following restore is not counted as hit
+	def store(self, progplat, key, prebuilt = False):
+		entry_dir = self._get_entry_dir(key)
+		if os.path.isdir(entry_dir):
+			return
+		output_dir = os.path.join(progplat.progplat_path, ProgPlatform.output_dirname)
+		if not os.path.isdir(output_dir):
+			raise Exception(f"build output directory does not exist: {output_dir} (ProgPlatform.output_dirname does not match the build of the progplatform)")
+		# copy to a temporary directory first, the rename makes the entry visible atomically (parallel builds of the same key)
+		tmp_dir = f"{entry_dir}.tmp_{os.getpid()}_{threading.get_ident()}"
+		shutil.copytree(output_dir, tmp_dir)
+		try:
+			os.rename(tmp_dir, entry_dir)
+		except OSError:
+			# stored by someone else in the meantime
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+			return
+		# the copy has the time of the output directory
+		os.utime(entry_dir)
+		with self.lock:
+			if prebuilt:
+				self.prebuilt.add(key)
+		self._evict()
+
+	def _evict(self):
+		entries = list(filter(lambda d: not ".tmp_" in d, glob.glob(os.path.join(self.cache_dir, "*", "*"))))
+		if len(entries) <= self.max_entries:
+			return
+		def get_mtime(d):
+			try:
+				return os.path.getmtime(d)
+			except OSError:
+				return 0
+		entries.sort(key=get_mtime)
+		for d in entries[:len(entries) - self.max_entries]:
+			logging.debug(f"evicting build output {d}")
+			shutil.rmtree(d, ignore_errors=True)
+			with self.lock:
+				self.prebuilt.discard(os.path.basename(d))
+				self.n_evicted += 1
+
+	def get_stats_str(self):
+		n = self.n_hits + self.n_misses
+		hit_rate = 0 if n == 0 else (100 * self.n_hits / n)
+		return f"{self.n_hits} hits, {self.n_misses} misses ({hit_rate:.1f}% hit rate), {self.n_prebuilt} built ahead, {self.n_evicted} evicted"
+
 class ProgPlatform:
+	# directory of the build products (binaries), relative to the progplatform path
+	output_dirname = "output"
+
 	def __init__(self, progplat_path):
 		self.progplat_path = os.path.abspath(progplat_path)
 		assert os.path.isdir(self.progplat_path)
@@ -58,7 +266,78 @@ class ProgPlatform:
 		self._writable = False
 		self.board_type = None
 
-	def get_commit_hash(self):
+		# batch session, see start_session
+		self.session = None
+
+	# session mode for running many experiments on the same branch
+	# - the branch and cleanliness are verified once in the beginning, the commit hash is cached
+	# - the cleanup after an experiment only restores the files written by configure_experiment (Makefile.config, all/inc/experiment/*.h)
+	#   and removes the directories of the build (temp/ and the output directory), no git processes
+	# - every verify_every cleanups, there is a full cleanup and verification with git instead
+	def start_session(self, branchname, verify_every = 50, force_cleanup = None):
+		assert verify_every > 0
+		self.session = None
+		self.check_clean(force_cleanup)
+		self.change_branch(branchname)
+		self.session = {
+		  "branchname"   : branchname,
+		  "commit_hash"  : self.get_commit_hash(),
+		  "verify_every" : verify_every,
+		  "n_cleanups"   : 0,
+		  "n_full"       : 1,
+		  "files"        : {}}
+		# original contents of the files that experiments write, None if they do not exist
+		for filename in ["Makefile.config"] + self._get_experiment_files():
+			path = os.path.join(self.progplat_path, filename)
+			if not os.path.isfile(path):
+				self.session["files"][filename] = None
+				continue
+			with open(path, "rb") as f:
+				self.session["files"][filename] = f.read()
+
+	def stop_session(self):
+		self.session = None
+
+	def _get_experiment_files(self):
+		exp_dir = os.path.join(self.progplat_path, "all/inc/experiment")
+		return list(map(lambda x: os.path.relpath(x, self.progplat_path), sorted(glob.glob(os.path.join(exp_dir, "*.h")))))
+
+	def _reset_session(self):
+		for filename in set(self._get_experiment_files() + ["Makefile.config"]):
+			path = os.path.join(self.progplat_path, filename)
+			contents = self.session["files"].get(filename, None)
+			if contents == None:
+				if os.path.exists(path):
+					os.remove(path)
+			else:
+				with open(path, "wb") as f:
+					f.write(contents)
+		for dirname in ["temp", ProgPlatform.output_dirname]:
+			shutil.rmtree(os.path.join(self.progplat_path, dirname), ignore_errors=True)
+
+	# incremental cleanup after an experiment without session: the files written by configure_experiment are reset to the commit
+	# and the directories of the build are removed (git only looks at these paths, not at the whole repository)
+	def reset_experiment(self):
+		paths = list(map(lambda p: os.path.join(self.progplat_path, p), ["Makefile.config", "all/inc/experiment"]))
+		changed = self._call_git_cmd_get_output(["ls-files", "--full-name", "--modified", "--deleted", "--"] + paths, "couldn't list the experiment files").decode("utf-8").splitlines()
+		if len(changed) > 0:
+			changed_paths = sorted(set(map(lambda p: os.path.join(self.progplat_path, p), changed)))
+			self._call_git_cmd(["checkout", "--"] + changed_paths, "couldn't reset the experiment files")
+		self._call_git_cmd(["clean", "-fdx", "--"] + paths, "couldn't clean the experiment files")
+		for dirname in ["temp", ProgPlatform.output_dirname]:
+			shutil.rmtree(os.path.join(self.progplat_path, dirname), ignore_errors=True)
+		self._writable = True
+
+	def _verify_session(self):
+		self._check_clean_full("all")
+		commit_hash = self.get_commit_hash(False)
+		if commit_hash != self.session["commit_hash"]:
+			raise Exception(f"progplatform changed during the session: {commit_hash} instead of {self.session['commit_hash']}")
+		self.session["n_full"] += 1
+
+	def get_commit_hash(self, use_session = True):
+		if use_session and self.session != None:
+			return self.session["commit_hash"]
 		progplat_hash = self._call_git_cmd_get_output(["rev-parse", "HEAD"], "coudln't get commit hash")
 		return progplat_hash.decode("ascii").strip()
 
@@ -88,6 +367,23 @@ class ProgPlatform:
 		call_cmd(["make", "-C", self.progplat_path] + makecmdl, error_msg, self.show_outputs, self.show_outputs)
 
 	def check_clean(self, force_cleanup = None):
+		if self.session == None or force_cleanup == "ignored":
+			self._check_clean_full(force_cleanup)
+			return
+		if force_cleanup == "all":
+			self.session["n_cleanups"] += 1
+			if self.session["n_cleanups"] % self.session["verify_every"] == 0:
+				logging.debug("full verification of the session")
+				self._verify_session()
+			else:
+				logging.debug("resetting the files of the last experiment")
+				self._reset_session()
+		elif force_cleanup != None:
+			raise Exception(f"unknown option for force_cleanup: {force_cleanup}")
+		# clean since the last reset or verification
+		self._writable = True
+
+	def _check_clean_full(self, force_cleanup):
 		if force_cleanup == "ignored":
 			logging.debug("cleaning only ignored files/directories in the repository")
 			self._call_git_cmd(["clean", "-fdX", self.progplat_path],  "couldn't clean progplatform")
@@ -115,6 +411,10 @@ class ProgPlatform:
 
 	def change_branch(self, branchname):
 		assert self._writable
+		if self.session != None:
+			if branchname != self.session["branchname"]:
+				raise Exception(f"cannot change to branch {branchname} in a session for branch {self.session['branchname']}")
+			return
 		self._call_git_cmd(["checkout", branchname], f"couldn't checkout branch {branchname}")
 		self._call_git_cmd(["clean", "-fd",  self.progplat_path], "couldn't clean progplatform")
 		# this is redundant I guess
@@ -173,6 +473,10 @@ class ProgPlatform:
 			self.write_experiment_file("asm_setup_2.h", gen_input_code(input2))
 
 
+	def build(self):
+		# default make target, builds the configured experiment without running it
+		self._call_make_cmd([], "couldn't build experiment")
+
 	def run_experiment(self, conn_mode = None, embexp_inst_idx = None):
 		error_msg = "experiment didn't run successful"
 		maketarget = "targetdoesnotexist"
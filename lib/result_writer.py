@@ -0,0 +1,115 @@
+import logging
+import threading
+import queue
+import concurrent.futures
+
+import logsdb as ldb
+import experiment
+
+class ResultWriter:
+	# writes experiment runs (Experiment.write_new_run) in a dedicated thread with its own database connection
+	# - submit queues a run and returns a future for the comparison with the previous run (nomismatches)
+	# - the queue is bounded, submit blocks when the writer falls behind
+	# - queued runs are written in groups, one transaction per group with a savepoint per run (a failing run does not affect the others)
+	def __init__(self, db_file = None, max_queue = 256, max_group = 64, on_mismatch = None, profile = "batch-writer"):
+		assert(max_queue > 0 and max_group > 0)
+		self.db_file = db_file
+		self.profile = profile
+		self.max_group = max_group
+		# on_mismatch: called with the experiment and run_spec when a run differs from the previous one
+		self.on_mismatch = on_mismatch
+		self.q = queue.Queue(maxsize=max_queue)
+
+		self.n_runs = 0
+		self.n_groups = 0
+		self.n_mismatches = 0
+		self.n_failures = 0
+
+		# open the connection in the writer thread, but report errors here
+		# not a daemon thread, the interpreter waits for the pending runs (close must be called)
+		started = concurrent.futures.Future()
+		self.thread = threading.Thread(target=self._loop, args=(started,), name="result-writer")
+		self.thread.start()
+		started.result()
+
+	def submit(self, exp, exprun, run_spec, run_data):
+		if not self.thread.is_alive():
+			raise Exception("result writer is closed")
+		future = concurrent.futures.Future()
+		self.q.put((exp, exprun, run_spec, run_data, future))
+		return future
+
+	def _loop(self, started):
+		try:
+			db = ldb.LogsDB(self.db_file, profile=self.profile)
+			db.connect()
+		except Exception as e:
+			started.set_exception(e)
+			return
+		started.set_result(True)
+
+		stop = False
+		while not stop:
+			items = [self.q.get()]
+			while len(items) < self.max_group:
+				try:
+					items.append(self.q.get_nowait())
+				except queue.Empty:
+					break
+			if None in items:
+				stop = True
+				items = list(filter(lambda x: x != None, items))
+			if len(items) == 0:
+				continue
+
+			try:
+				results = self._write_group(db, items)
+			except Exception as e:
+				logging.error(f"writing {len(items)} experiment runs failed: {e}")
+				self.n_failures += len(items)
+				for item in items:
+					item[4].set_exception(e)
+				continue
+			self.n_groups += 1
+
+			# report only after the commit
+			for ((exp, exprun, run_spec, run_data, future), (res, e)) in zip(items, results):
+				if e != None:
+					logging.error(f"writing run of {exp} failed: {e}")
+					self.n_failures += 1
+					future.set_exception(e)
+					continue
+				self.n_runs += 1
+				future.set_result(res)
+				if not res:
+					self.n_mismatches += 1
+					logging.warning(f"run of {exp} differs from the previous run ({run_spec})")
+					# the run is stored, a failing callback must not stop the writer
+					if self.on_mismatch != None:
+						try:
+							self.on_mismatch(exp, run_spec)
+						except Exception as e:
+							logging.error(f"mismatch callback for run of {exp} failed: {e}")
+		db.close()
+
+	def _write_group(self, db, items):
+		# fresh metadata through the connection of the writer
+		def write_op(exp, exprun, run_spec, run_data):
+			return lambda: experiment.Experiment(db, exp.exp).write_new_run(exprun, run_spec, run_data)
+		return db.transaction_group(map(lambda item: write_op(*item[:4]), items))
+
+	# waits until all submitted runs are written
+	def close(self):
+		if self.thread.is_alive():
+			self.q.put(None)
+			self.thread.join()
+
+	def get_stats_str(self):
+		avg_group = 0 if self.n_groups == 0 else self.n_runs / self.n_groups
+		return f"{self.n_runs} runs written in {self.n_groups} transactions ({avg_group:.1f} per transaction), {self.n_mismatches} mismatches, {self.n_failures} failures"
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -1,5 +1,6 @@
 BEGIN TRANSACTION;
 
+-- layout of the current db version, older databases are upgraded by the steps in migrations.py
 -- mostly uses generic integer id as primary key
 -- uniform metadata structure: key [reference_id, kind, name (not null)], value
 -- no structured link between holba runs and their generated programs and experiments
@@ -122,6 +123,43 @@ CREATE TABLE exp_exps_lists_entries (
   CONSTRAINT FK_exp_exps       FOREIGN KEY (exp_exps_id)       REFERENCES exp_exps(id)
 );
 
+-- ===================================================
+-- work queue of experiment runs: one entry per experiment and run_spec, workers claim entries with a lease until lease_expiry (unix time)
+CREATE TABLE exp_exps_queue (
+  id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+  exp_exps_id INTEGER NOT NULL,
+  run_spec TEXT NOT NULL,
+  lease_owner TEXT,
+  lease_expiry REAL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  completed INTEGER NOT NULL DEFAULT 0,
+  CONSTRAINT UC_exp_exps_queue UNIQUE (exp_exps_id, run_spec),
+  CONSTRAINT FK_exp_exps FOREIGN KEY (exp_exps_id) REFERENCES exp_exps(id)
+);
+CREATE INDEX IX_exp_exps_queue_claim ON exp_exps_queue (run_spec, completed, lease_expiry);
+
+-- ===================================================
+-- latest run per experiment and run_spec (derived from the run metadata in exp_exps_meta, maintained by Experiment.write_new_run)
+-- any writer adding run metadata directly must maintain this table as well (LogsDB.set_latest_run or LogsDB.rebuild_latest)
+-- result_class: example, counterexample, inconclusive, exception or other (NULL for incomplete runs)
+CREATE TABLE exp_exps_latest (
+  exp_exps_id INTEGER NOT NULL,
+  run_spec TEXT NOT NULL,
+  run_id TEXT NOT NULL,
+  is_complete INTEGER NOT NULL,
+  result_class TEXT,
+  CONSTRAINT PK_exp_exps_latest PRIMARY KEY (exp_exps_id, run_spec),
+  CONSTRAINT FK_exp_exps FOREIGN KEY (exp_exps_id) REFERENCES exp_exps(id)
+);
+CREATE INDEX IX_exp_exps_latest_run_spec ON exp_exps_latest (run_spec, is_complete, result_class);
+
+-- ===================================================
+-- secondary indexes for lookups of runs and list memberships
+CREATE INDEX IX_exp_exps_meta_kind_name ON exp_exps_meta (kind, name);
+CREATE INDEX IX_exp_exps_meta_name ON exp_exps_meta (name);
+CREATE INDEX IX_exp_exps_lists_entries_exp_exps ON exp_exps_lists_entries (exp_exps_id);
+CREATE INDEX IX_exp_progs_lists_entries_exp_progs ON exp_progs_lists_entries (exp_progs_id);
+
 -- ===================================================
 -- db metadata
 CREATE TABLE db_meta (
@@ -132,7 +170,7 @@ CREATE TABLE db_meta (
   CONSTRAINT UC_db_meta UNIQUE (kind,name)
 );
 INSERT INTO db_meta (id, kind, name, value)
-VALUES (0, "logsdb", "version", "1");
+VALUES (0, "logsdb", "version", "4");
 
 COMMIT;
 
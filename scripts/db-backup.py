@@ -14,6 +14,10 @@ parser = argparse.ArgumentParser()
 
 parser.add_argument("-t", "--testing", help="uses testing database (i.e. for testing only)", action="store_true")
 
+parser.add_argument("-m", "--migrate", help="migrate the database to the current version after the backup", action="store_true")
+parser.add_argument("-rl", "--rebuild_latest", help="rebuild the table of the latest runs (exp_exps_latest) from the run metadata after the backup", action="store_true")
+parser.add_argument("-n", "--dry_run", help="only report the pending migration steps with estimated time and size change (no backup)", action="store_true")
+
 parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
 
 args = parser.parse_args()
@@ -28,9 +32,25 @@ is_testing = args.testing
 
 # create db access object and run backup
 alt_db_file = None if not is_testing else "data/testing.db"
-with ldb.LogsDB(alt_db_file) as db:
+with ldb.LogsDB(alt_db_file, read_only=args.dry_run, auto_migrate=False) as db:
+	print(f"db version {db.version} (current is {ldb.db_version})")
+	if args.dry_run:
+		print("pending migration steps:")
+		db.migrate(dry_run=True)
+		sys.exit(0)
+
+	# migration takes a backup on its own
+	if args.migrate and db.version != ldb.db_version:
+		db.migrate()
+		print(f"Backup and migration to version {db.version} finished.")
+		sys.exit(0)
+
 	db.backup()
 
+	if args.rebuild_latest:
+		n_latest = db.rebuild_latest()
+		print(f"Rebuilt the latest runs ({n_latest} entries).")
+
 
 print("Backup finished.")
 
@@ -43,17 +43,17 @@ where r_m.holba_runs_id = "{holba_run_id}" and r_m.kind = "log"
 
 
 def print_experimentdata(db, exps_list_id):
-  # assumes that experiments have only been run with one commit in this database and no retry if a result other than exception has been recorded!
+  # uses the latest run of each experiment (table exp_exps_latest), per run_spec if experiments have been run with several commits or boards
+  result_classes_executed = "('example', 'counterexample', 'inconclusive')"
 
   res = db.get_tablerecords_sql(
 f"""
-select distinct e_m.name
-from exp_exps as e
-inner join exp_exps_lists_entries as e_l_e on e_l_e.exp_exps_id = e.id
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e.id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result"
+select distinct l.run_spec
+from exp_exps_lists_entries as e_l_e
+inner join exp_exps_latest as l on l.exp_exps_id = e_l_e.exp_exps_id
+where e_l_e.exp_exps_lists_id = {exps_list_id}
 """)
-  runspecs = list(map(lambda x: ".".join(x[0].split(".")[0:2]), res[1]))
+  runspecs = list(map(lambda x: x[0], res[1]))
 
   res = db.get_tablerecords_sql(
 f"""
@@ -75,17 +75,12 @@ where e_l_e.exp_exps_lists_id = {exps_list_id}
 f"""
 -- find number of programs with result
 -- ================================================
-select count(*) from
-(
--- program_ids of all experiments of a certain experiment list
-select distinct p.id
+select count(distinct e.exp_progs_id)
 from exp_exps as e
 inner join exp_exps_lists_entries as e_l_e on e_l_e.exp_exps_id = e.id
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e.id
-inner join exp_progs as p on p.id = e.exp_progs_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.value = "true" or e_m.value = "false" or e_m.value like "%INCONCLUSIVE%")
+inner join exp_exps_latest as l on l.exp_exps_id = e.id
+where e_l_e.exp_exps_lists_id = {exps_list_id} and l.result_class in {result_classes_executed}
 -- the ones that have a result from execution
-)
 """)
   numprogswithresult = res[1][0][0]
 
@@ -93,17 +88,12 @@ where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.
 f"""
 -- find number of programs with counterexamples
 -- ================================================
-select count(*) from
-(
--- program_ids of all experiments of a certain experiment list
-select distinct p.id
+select count(distinct e.exp_progs_id)
 from exp_exps as e
 inner join exp_exps_lists_entries as e_l_e on e_l_e.exp_exps_id = e.id
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e.id
-inner join exp_progs as p on p.id = e.exp_progs_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.value = "true" or e_m.value = "false" or e_m.value like "%INCONCLUSIVE%") and e_m.value = "false"
+inner join exp_exps_latest as l on l.exp_exps_id = e.id
+where e_l_e.exp_exps_lists_id = {exps_list_id} and l.result_class = 'counterexample'
 -- the ones that have a result from execution, and the result is false / counterexample
-)
 """)
   numprogswithcounterexample = res[1][0][0]
 
@@ -119,61 +109,28 @@ where e_l_e.exp_exps_lists_id = {exps_list_id}
 
   res = db.get_tablerecords_sql(
 f"""
--- find number of experiments with run result
--- ================================================
-select count(*)
-from exp_exps_lists_entries as e_l_e
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e_l_e.exp_exps_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.value = "true" or e_m.value = "false" or e_m.value like "%INCONCLUSIVE%")
-""")
-  numexpswithresult = res[1][0][0]
-
-  res = db.get_tablerecords_sql(
-f"""
--- find number of experiments where running them results in counterexamples
--- ================================================
-select count(*)
-from exp_exps_lists_entries as e_l_e
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e_l_e.exp_exps_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.value = "true" or e_m.value = "false" or e_m.value like "%INCONCLUSIVE%") and e_m.value = "false"
-""")
-  numexpsascounterexamples = res[1][0][0]
-
-  res = db.get_tablerecords_sql(
-f"""
--- find number of experiments where running them results in examples
--- ================================================
-select count(*)
-from exp_exps_lists_entries as e_l_e
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e_l_e.exp_exps_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and (e_m.value = "true" or e_m.value = "false" or e_m.value like "%INCONCLUSIVE%") and e_m.value = "true"
-""")
-  numexpsasexamples = res[1][0][0]
-
-  res = db.get_tablerecords_sql(
-f"""
--- find number of experiments where running them results in inclcusive
+-- find number of experiments with run result, and for each result class
 -- ================================================
-select count(*)
+select l.result_class, count(distinct l.exp_exps_id)
 from exp_exps_lists_entries as e_l_e
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e_l_e.exp_exps_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and e_m.value like "%INCONCLUSIVE%"
+inner join exp_exps_latest as l on l.exp_exps_id = e_l_e.exp_exps_id
+where e_l_e.exp_exps_lists_id = {exps_list_id} and l.is_complete = 1
+group by l.result_class
 """)
-  numexpsasinconclusive = res[1][0][0]
+  numexpsbyclass = dict(res[1])
+  numexpsasexamples        = numexpsbyclass.get("example", 0)
+  numexpsascounterexamples = numexpsbyclass.get("counterexample", 0)
+  numexpsasinconclusive    = numexpsbyclass.get("inconclusive", 0)
+  numexpsasexception       = numexpsbyclass.get("exception", 0)
 
   res = db.get_tablerecords_sql(
 f"""
--- find number of experiments where running them results in inclcusive
--- ================================================
-select count(*) from
-(
-select distinct e_l_e.exp_exps_id as exp_id
+select count(distinct l.exp_exps_id)
 from exp_exps_lists_entries as e_l_e
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e_l_e.exp_exps_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and e_m.value like "%embexp.board.exception%"
-)
+inner join exp_exps_latest as l on l.exp_exps_id = e_l_e.exp_exps_id
+where e_l_e.exp_exps_lists_id = {exps_list_id} and l.result_class in {result_classes_executed}
 """)
-  numexpsasexception = res[1][0][0]
+  numexpswithresult = res[1][0][0]
 
   res = db.get_tablerecords_sql(
 f"""
@@ -182,9 +139,9 @@ f"""
 select e_l_e.list_index, p.code, e.input_data
 from exp_exps as e
 inner join exp_exps_lists_entries as e_l_e on e_l_e.exp_exps_id = e.id
-inner join exp_exps_meta as e_m on e_m.exp_exps_id = e.id
+inner join exp_exps_latest as l on l.exp_exps_id = e.id
 inner join exp_progs as p on p.id = e.exp_progs_id
-where e_l_e.exp_exps_lists_id = {exps_list_id} and e_m.kind = "result" and e_m.value = "false"
+where e_l_e.exp_exps_lists_id = {exps_list_id} and l.result_class = 'counterexample'
 order by e_l_e.list_index asc
 """)
   firstcounterexample_id = None if res[1] == [] else res[1][0][0]
@@ -240,6 +197,6 @@ where r_m.kind = "args"
 
 
 
-with ldb.LogsDB(dbfile_src, read_only=True) as db:
+with ldb.LogsDB(dbfile_src, read_only=True, profile="reader") as db:
   iterate_holba_runs(db)
 
@@ -32,7 +32,7 @@ is_testing = args.testing
 dbfilename = os.path.join("data/export", args.dbfile)
 
 def create_exportdb(dbfilename):
-	db_export = ldb.LogsDB(dbfilename)
+	db_export = ldb.LogsDB(dbfilename, profile="bulk-import")
 	db_export_file = os.path.abspath(db_export.database_file)
 	logging.info("using db file: " + db_export_file)
 	# make sure export db is new
@@ -44,7 +44,7 @@ def create_exportdb(dbfilename):
 
 # create db access object
 alt_db_file = None if not is_testing else "data/testing.db"
-with ldb.LogsDB(alt_db_file) as db:
+with ldb.LogsDB(alt_db_file, profile="reader") as db:
 	# find and collect list, experiments and their metadata
 	# 1. list
 	list_recs_ = db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_lists"))
@@ -59,58 +59,61 @@ with ldb.LogsDB(alt_db_file) as db:
 	list_entr_recs = db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_lists_entries")._replace(exp_exps_lists_id=list_rec.id))
 	print(f"found {len(list_entr_recs)} list entries")
 
-	# 3. exps
+	# fetch full records by chunks of key values, the joins and DISTINCT only run on narrow rows
+	def get_recs_by_keys(table, field, keys, chunk_size = 500):
+		recs = []
+		for i in range(0, len(keys), chunk_size):
+			expr = ldb.QE_Bin(op=ldb.QE_Bop.IN, arg1=ldb.QE_Ref(index=0, field=field), arg2=ldb.QE_Const(value=keys[i:i+chunk_size]))
+			recs += db.get_tablerecords(table, [], expr, order_by=[(0, field, True)])
+		return recs
+
+	# 3. exps (ids and program ids only)
 	expr_ref  = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="id"), arg2=ldb.QE_Ref(index=1, field="exp_exps_id"))
 	expr_id   = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=1, field="exp_exps_lists_id"), arg2=ldb.QE_Const(value=list_rec.id))
 	expr      = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=expr_ref, arg2=expr_id)
-	exps_recs = db.get_tablerecords("exp_exps", [("exp_exps_lists_entries", 0)], expr)
-	print(f"found {len(exps_recs)} experiments")
+	exps_keys = db.get_tablerecords("exp_exps", [("exp_exps_lists_entries", 0)], expr, fields=["id", "exp_progs_id"])
+	exps_ids  = sorted(map(lambda x: x.id, exps_keys))
+	print(f"found {len(exps_ids)} experiments")
 
-	# 4. progs
-	expr_ref1 = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="id"), arg2=ldb.QE_Ref(index=1, field="exp_progs_id"))
-	expr_ref2 = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=1, field="id"), arg2=ldb.QE_Ref(index=2, field="exp_exps_id"))
-	expr_id   = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=2, field="exp_exps_lists_id"), arg2=ldb.QE_Const(value=list_rec.id))
-	expr      = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=expr_ref1, arg2=expr_ref2), arg2=expr_id)
-	progs_recs = db.get_tablerecords("exp_progs", [("exp_exps", 0), ("exp_exps_lists_entries", 1)], expr)
-	print(f"found {len(progs_recs)} programs")
+	# 4. progs (ids only, taken from the experiments)
+	progs_ids = sorted(set(map(lambda x: x.exp_progs_id, exps_keys)))
+	print(f"found {len(progs_ids)} programs")
 
-	# 5. exps metadata
+	# 5. exps metadata (counted on the key columns)
 	expr_ref1 = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="exp_exps_id"), arg2=ldb.QE_Ref(index=1, field="id"))
 	expr_ref2 = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=1, field="id"), arg2=ldb.QE_Ref(index=2, field="exp_exps_id"))
 	expr_id   = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=2, field="exp_exps_lists_id"), arg2=ldb.QE_Const(value=list_rec.id))
 	expr      = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=expr_ref1, arg2=expr_ref2), arg2=expr_id)
-	meta_recs = db.get_tablerecords("exp_exps_meta", [("exp_exps", 0), ("exp_exps_lists_entries", 1)], expr)
-	print(f"found {len(meta_recs)} items of experiment metadata")
+	n_meta    = db.get_tablerecords("exp_exps_meta", [("exp_exps", 0), ("exp_exps_lists_entries", 1)], expr, count_only=True, fields=["exp_exps_id", "kind", "name"])
+	print(f"found {n_meta} items of experiment metadata")
 
-	num_dot = 100
 	print()
-	print(f"opening the database for exporting ({num_dot} rows are one dot)")
+	print("opening the database for exporting")
 	with create_exportdb(dbfilename) as db_export:
 		# store all successively and keep ids exactly
 		def add_rec_list(n, recs):
 			print(f'exporting {n}: ', end='', flush=True)
-			i = 0
-			for rec in recs:
-				i = (i + 1) % num_dot
-				if i == 0:
-					print('.', end='', flush=True)
-				db_export.add_tablerecord(rec, allow_id = True)
+			def progress(n_done, n_total, batch_time):
+				print(f'{n_done}/{n_total} ({(n_done - progress.n_prev)/max(batch_time, 1e-6):.0f} rows/s) ', end='', flush=True)
+				progress.n_prev = n_done
+			progress.n_prev = 0
+			db_export.add_tablerecords(recs, allow_id = True, progress = progress)
 			print()
 
 		# 1. list
 		add_rec_list("list", [list_rec])
 
 		# 2. progs
-		add_rec_list("programs", progs_recs)
+		add_rec_list("programs", get_recs_by_keys("exp_progs", "id", progs_ids))
 
 		# 3. exps
-		add_rec_list("experiments", exps_recs)
+		add_rec_list("experiments", get_recs_by_keys("exp_exps", "id", exps_ids))
 
 		# 4. list entries
 		add_rec_list("list entries", list_entr_recs)
 
 		# 5. exps metadata
-		add_rec_list("experiment metadata", meta_recs)
+		add_rec_list("experiment metadata", get_recs_by_keys("exp_exps_meta", "exp_exps_id", exps_ids))
 
 
 print()
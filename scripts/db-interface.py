@@ -6,8 +6,18 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
 
 import argparse
 import logging
+import time
+import threading
+import queue
+import socket
+import socketserver
+import signal
+import io
+import concurrent.futures
 
 import json
+import collections
+import sqlite3
 import logsdb as ldb
 
 from cProfile import Profile
@@ -19,7 +29,11 @@ parser = argparse.ArgumentParser(description='Database interface with operation
 
 parser.add_argument("-ts", "--term_string", help="if cio is taken as operation, defines the termination string; then input is continuously taken from stdin and outputs are sent to stdout")
 
-parser.add_argument("operation",       help="operation to execute on database", choices=["create", "append", "query", "cio"])
+parser.add_argument("operation",       help="operation to execute on database (server: serve clients on a unix socket, client: cio via a server)", choices=["create", "append", "query", "batch", "cio", "server", "client"])
+
+parser.add_argument("-s", "--socket", help="unix socket path for server and client")
+parser.add_argument("--pool_size", help="number of read connections per database in server mode", type=int, default=4)
+parser.add_argument("--group_size", help="maximum number of write requests committed together in server mode", type=int, default=256)
 
 parser.add_argument("-i", "--input", help="take input as command line argument instead of stdin")
 
@@ -101,6 +115,32 @@ def op_append(db, json_args):
 
 
 """ op:query """
+# query expressions in json:
+#   {"bin": "AND"|"OR"|"EQ"|"LIKE"|"IN", "arg1": exp, "arg2": exp}
+#   {"not": exp}
+#   {"ref": [table_index, field]}
+#   {"const": value}
+def query_exp_from_json(j):
+	if not (type(j) is dict and len(j) in [1, 3]):
+		raise Exception(f"wrong input, invalid query expression: {j}")
+	if "bin" in j:
+		if set(j.keys()) != set(["bin", "arg1", "arg2"]):
+			raise Exception(f"wrong input, binary query expression needs 'arg1' and 'arg2': {j}")
+		if not j["bin"] in ldb.QE_Bop.__members__:
+			raise Exception(f"wrong input, unknown binary operator: {j['bin']}")
+		return ldb.QE_Bin(op=ldb.QE_Bop[j["bin"]], arg1=query_exp_from_json(j["arg1"]), arg2=query_exp_from_json(j["arg2"]))
+	elif "not" in j and len(j) == 1:
+		return ldb.QE_Not(arg=query_exp_from_json(j["not"]))
+	elif "ref" in j and len(j) == 1:
+		ref = j["ref"]
+		if not (type(ref) is list and len(ref) == 2 and type(ref[0]) is int and type(ref[1]) is str):
+			raise Exception(f"wrong input, reference must be a pair [index, field]: {ref}")
+		return ldb.QE_Ref(index=ref[0], field=ref[1])
+	elif "const" in j and len(j) == 1:
+		return ldb.QE_Const(value=j["const"])
+	else:
+		raise Exception(f"wrong input, invalid query expression: {j}")
+
 def op_query(db, json_args):
 	# input check
 	if not type(json_args) is dict:
@@ -118,7 +158,7 @@ def op_query(db, json_args):
 		# input check
 		if not type(q) is dict:
 			raise Exception("wrong input, must be a dictionary")
-		if any(map(lambda x: not x in ["table", "values", "id_only"], q.keys())):
+		if any(map(lambda x: not x in ["table", "values", "id_only", "fields"], q.keys())):
 			raise Exception("unknown parameter in input ('query')")
 		# fetching arguments
 		table = q["table"]
@@ -128,17 +168,27 @@ def op_query(db, json_args):
 			id_only = q["id_only"]
 		except KeyError:
 			pass
+		sel_fields = None
+		try:
+			sel_fields = q["fields"]
+		except KeyError:
+			pass
 		if not type(values) is dict:
 			raise Exception("wrong input, 'values' of 'query' must be a dictionary")
+		if not (sel_fields == None or (type(sel_fields) is list and all(map(lambda x: type(x) is str, sel_fields)))):
+			raise Exception("wrong input, 'fields' of 'query' must be a list of strings")
 		# processing of arguments
 		tr = ldb.get_empty_TableRecord(table)
 		data = tr._replace(**values)
 		# search for matches and return the results as a pair of field name list and individual lists with the same length
-		if not id_only:
-			fields = list(tr._fields)
-		else:
+		# (with fields, only the selected columns are returned)
+		if id_only:
 			fields = list(ldb.TR_id_only._fields)
-		matches = db.get_tablerecord_matches(data, id_only=id_only)
+		elif sel_fields != None:
+			fields = sel_fields
+		else:
+			fields = list(tr._fields)
+		matches = db.get_tablerecord_matches(data, id_only=id_only, fields=sel_fields)
 		rows = list(map(lambda m: list(map(lambda x: getattr(m, x), fields)), matches))
 		res = {"fields": fields, "rows": rows}
 		return res
@@ -148,7 +198,7 @@ def op_query(db, json_args):
 		# input check
 		if not type(q) is dict:
 			raise Exception("wrong input, must be a dictionary")
-		if any(map(lambda x: not x in ["table", "joins", "query_exp", "order_by", "id_only"], q.keys())):
+		if any(map(lambda x: not x in ["table", "joins", "query_exp", "order_by", "id_only", "count_only", "fields", "limit", "offset"], q.keys())):
 			raise Exception("unknown parameter in input ('query')")
 		# fetching arguments
 		table = q["table"]
@@ -164,13 +214,51 @@ def op_query(db, json_args):
 			id_only = q["id_only"]
 		except KeyError:
 			pass
+		count_only = False
+		try:
+			count_only = q["count_only"]
+		except KeyError:
+			pass
+		sel_fields = None
+		try:
+			sel_fields = q["fields"]
+		except KeyError:
+			pass
+		limit = None
+		try:
+			limit = q["limit"]
+		except KeyError:
+			pass
+		offset = None
+		try:
+			offset = q["offset"]
+		except KeyError:
+			pass
 
-		if not type(values) is dict:
-			raise Exception("wrong input, 'values' of 'query' must be a dictionary")
+		if not (type(joins) is list and all(map(lambda x: type(x) is list and len(x) == 2, joins))):
+			raise Exception("wrong input, 'joins' of 'query' must be a list of pairs [table, index]")
+		if not (type(order_by) is list and all(map(lambda x: type(x) is list and len(x) == 3, order_by))):
+			raise Exception("wrong input, 'order_by' of 'query' must be a list of triples [index, field, ascending]")
+		if not (type(id_only) is bool and type(count_only) is bool):
+			raise Exception("wrong input, 'id_only' and 'count_only' of 'query' must be bools")
+		if not (sel_fields == None or (type(sel_fields) is list and all(map(lambda x: type(x) is str, sel_fields)))):
+			raise Exception("wrong input, 'fields' of 'query' must be a list of strings")
 		# processing of arguments
-		raise Exception("not implemented")
-		# execute query and return results
-		raise Exception("not implemented")
+		joins = list(map(tuple, joins))
+		order_by = list(map(tuple, order_by))
+		query_exp = query_exp_from_json(query_exp)
+		# execute query and return results, like for the simple match
+		res = db.get_tablerecords(table, joins, query_exp, order_by, count_only=count_only, id_only=id_only, fields=sel_fields, limit=limit, offset=offset)
+		if count_only:
+			return res
+		if id_only:
+			fields = list(ldb.TR_id_only._fields)
+		elif sel_fields != None:
+			fields = sel_fields
+		else:
+			fields = list(ldb.TR_by_table[table]._fields)
+		rows = list(map(lambda m: list(map(lambda x: getattr(m, x), fields)), res))
+		return {"fields": fields, "rows": rows}
 
 	# c) raw sql query
 	elif q_type == "sql":
@@ -190,22 +278,136 @@ def op_query(db, json_args):
 		raise Exception("unknown query type: " + q_type)
 
 
+""" op:batch """
+# references to results of earlier steps: {"$ref": [step_index, field]}, can appear anywhere in the arguments of a step
+def resolve_batch_refs(j, results):
+	if type(j) is dict:
+		if "$ref" in j:
+			ref = j["$ref"]
+			if not (len(j) == 1 and type(ref) is list and len(ref) == 2 and type(ref[0]) is int and type(ref[1]) is str):
+				raise Exception(f"wrong input, reference must be {{\"$ref\": [step_index, field]}}: {j}")
+			(step_idx, field) = ref
+			if not (0 <= step_idx < len(results)):
+				raise Exception(f"wrong input, reference to step {step_idx} which is not executed before")
+			res = results[step_idx]
+			if not (type(res) is dict and field in res):
+				raise Exception(f"wrong input, result of step {step_idx} has no field '{field}'")
+			return res[field]
+		return {k: resolve_batch_refs(v, results) for (k, v) in j.items()}
+	elif type(j) is list:
+		return list(map(lambda x: resolve_batch_refs(x, results), j))
+	return j
+
+def op_batch(db, json_args):
+	# input check
+	if not type(json_args) is dict:
+		raise Exception("wrong input, must be a dictionary")
+	if any(map(lambda x: not x in ["ops"], json_args.keys())):
+		raise Exception("unknown parameter in input")
+	# fetching of arguments
+	ops = json_args["ops"]
+	if not type(ops) is list:
+		raise Exception("wrong input, 'ops' must be a list")
+	for op in ops:
+		if not (type(op) is dict and set(op.keys()) == set(["op", "args"])):
+			raise Exception("wrong input, each step must be a dictionary with 'op' and 'args'")
+		if not op["op"] in ["create", "append", "query"]:
+			raise Exception(f"wrong input, unknown operation in batch: {op['op']}")
+	# execute all steps in one transaction, all or nothing
+	results = []
+	with db.transaction():
+		for (i, op) in enumerate(ops):
+			try:
+				op_args = resolve_batch_refs(op["args"], results)
+				results.append(opdict[op["op"]](db, op_args))
+			except Exception as e:
+				raise Exception(f"batch step {i} ({op['op']}) failed: {e}")
+	return results
+
+
 opdict = {"create"  : op_create,
           "append"  : op_append,
-          "query"   : op_query}
+          "query"   : op_query,
+          "batch"   : op_batch}
 
-def run_one_interaction(operation, json_arguments, is_read_only, is_testing = False):
+def open_db(is_read_only, is_testing):
+	alt_db_file = None if not is_testing else "data/testing.db"
+	return ldb.LogsDB(alt_db_file, read_only=is_read_only, profile=("reader" if is_read_only else "batch-writer"))
+
+# open connections for cio mode, one per (is_testing, is_read_only), kept for the lifetime of the process
+db_cache = {}
+
+def get_cached_db(is_read_only, is_testing):
+	key = (is_testing, is_read_only)
+	if not key in db_cache:
+		logging.info(f"opening db connection for {key}")
+		db = open_db(is_read_only, is_testing)
+		db.connect()
+		db_cache[key] = db
+	return db_cache[key]
+
+def drop_cached_db(is_read_only, is_testing):
+	# reconnect with the next request, e.g., after an error
+	db = db_cache.pop((is_testing, is_read_only), None)
+	if db != None:
+		try:
+			db.close()
+		except Exception as e:
+			logging.warning(f"closing db connection failed: {e}")
+
+def is_connection_error(e):
+	# errors of the database or connection, not of the operation or its arguments
+	# (LogsDB raises plain exceptions for the errors of sqlite3, the original one is the context)
+	while e != None:
+		if isinstance(e, sqlite3.DatabaseError) and not isinstance(e, sqlite3.IntegrityError):
+			return True
+		e = e.__context__
+	return False
+
+def close_cached_dbs():
+	for (is_testing, is_read_only) in list(db_cache.keys()):
+		drop_cached_db(is_read_only, is_testing)
+
+def run_one_interaction(operation, json_arguments, is_read_only, is_testing = False, use_cache = False):
 	# select operation accordingly
 	logging.info(f"executing operation {operation}")
 	opfun = opdict[operation]
 
+	if use_cache:
+		# reuse the db access object, drop it on database errors to reconnect cleanly with the next request
+		db = get_cached_db(is_read_only, is_testing)
+		try:
+			return opfun(db, json_arguments)
+		except Exception as e:
+			if is_connection_error(e):
+				drop_cached_db(is_read_only, is_testing)
+			raise
+
 	# create db access object
-	alt_db_file = None if not is_testing else "data/testing.db"
-	with ldb.LogsDB(alt_db_file, read_only=is_read_only) as db:
+	with open_db(is_read_only, is_testing) as db:
 		# execute operation
 		ret_val = opfun(db, json_arguments)
 	return ret_val
 
+# request statistics for cio and server mode, per operation: [number of requests, number of errors, total time, max time]
+req_stats = {}
+req_stats_lock = threading.Lock()
+
+def add_req_stat(operation, is_error, duration):
+	with req_stats_lock:
+		st = req_stats.setdefault(operation, [0, 0, 0.0, 0.0])
+		st[0] += 1
+		st[1] += 1 if is_error else 0
+		st[2] += duration
+		st[3] = max(st[3], duration)
+
+def print_req_summary():
+	if len(req_stats) == 0:
+		return
+	print("request summary:", file=sys.stderr)
+	for (operation, (n, n_err, t_total, t_max)) in req_stats.items():
+		print(f"  {operation}: {n} requests, {n_err} errors, avg {1000 * t_total / n:.2f}ms, max {1000 * t_max:.2f}ms, total {t_total:.2f}s", file=sys.stderr)
+
 def send_terminated_string(f, termination_line, s):
 	print(s, file=f)
 	print(termination_line, file=f)
@@ -213,27 +415,184 @@ def send_terminated_string(f, termination_line, s):
 	f.flush()
 
 def readline(f):
-	line = ""
-	while True:
-		c = f.read(1)
-		line += c
-		if c == "\n":
-			break
-		if c == "":
-			logging.info("EOF, exiting")
-			print_stats()
-			exit(0)
+	# buffered, returns None at the end of the input (an incomplete last line is dropped)
+	line = f.readline()
+	if not line.endswith("\n"):
+		return None
 	return line
 
 def receive_terminated_string(f, termination_line):
+	# returns None at the end of the input
+	termination_line = termination_line + "\n"
 	lines = []
 	while True:
 		line = readline(f)
-		if line == (termination_line + "\n"):
+		if line == None:
+			return None
+		if line == termination_line:
 			break
 		lines.append(line)
 	return "".join(lines)
 
+def exit_at_eof():
+	logging.info("EOF, exiting")
+	close_cached_dbs()
+	print_req_summary()
+	print_stats()
+	exit(0)
+
+# process one request of the cio protocol, runfun executes the operation, returns the response string
+def process_request(json_query_raw, runfun):
+	json_query = json.loads(json_query_raw)
+	operation = json_query["op"] #string
+	json_arguments = json_query["args"] #structured data (also json)
+	is_testing = json_query["is_testing"] #boolean
+	is_read_only = json_query["is_read_only"] #boolean
+	start_time = time.time()
+	try:
+		# process
+		ret_val = {"result": runfun(operation, json_arguments, is_read_only, is_testing)}
+	except Exception as e:
+		import traceback
+		tb_str = traceback.format_exc()
+		#print(tb_str)
+		#print(e)
+		ret_val = {"error": str(e), "traceback": tb_str}
+	add_req_stat(operation, "error" in ret_val, time.time() - start_time)
+	return json.dumps(ret_val)
+
+
+""" server mode """
+# - clients connect to a unix socket, send the termination string as first line and then continue with the cio protocol
+# - writes of all clients are executed by one writer thread, which commits groups of requests together (savepoint per request)
+# - read-only requests use a pool of read connections per database
+WriteRequest = (
+  collections.namedtuple("WriteRequest",
+  ["operation", "json_arguments", "is_testing", "future"]))
+
+class DBServer:
+	def __init__(self, pool_size, group_size):
+		assert(pool_size > 0 and group_size > 0)
+		self.pool_size = pool_size
+		self.group_size = group_size
+		self.write_q = queue.Queue()
+		# read pools per is_testing, slots are None until a connection is opened
+		self.read_pools = {}
+		self.read_pools_lock = threading.Lock()
+		self.n_groups = 0
+		self.n_writes = 0
+		self.writer = threading.Thread(target=self._writer_loop, name="writer")
+		self.writer.start()
+
+	def run(self, operation, json_arguments, is_read_only, is_testing):
+		if not operation in opdict:
+			raise Exception(f"unknown operation: {operation}")
+		if is_read_only:
+			return self._run_read(operation, json_arguments, is_testing)
+		future = concurrent.futures.Future()
+		self.write_q.put(WriteRequest(operation, json_arguments, is_testing, future))
+		return future.result()
+
+	def _run_read(self, operation, json_arguments, is_testing):
+		with self.read_pools_lock:
+			if not is_testing in self.read_pools:
+				pool = queue.Queue()
+				for i in range(self.pool_size):
+					pool.put(None)
+				self.read_pools[is_testing] = pool
+			pool = self.read_pools[is_testing]
+		db = pool.get()
+		try:
+			if db == None:
+				alt_db_file = None if not is_testing else "data/testing.db"
+				db = ldb.LogsDB(alt_db_file, read_only=True, profile="reader", shared_threads=True)
+				db.connect()
+			return opdict[operation](db, json_arguments)
+		except:
+			# reconnect with the next request
+			if db != None:
+				db.close()
+				db = None
+			raise
+		finally:
+			pool.put(db)
+
+	def _writer_loop(self):
+		dbs = {}
+		stop = False
+		while not stop:
+			# take what is queued up to the group size
+			reqs = [self.write_q.get()]
+			while len(reqs) < self.group_size:
+				try:
+					reqs.append(self.write_q.get_nowait())
+				except queue.Empty:
+					break
+			if None in reqs:
+				stop = True
+				reqs = list(filter(lambda r: r != None, reqs))
+
+			for is_testing in set(map(lambda r: r.is_testing, reqs)):
+				group = list(filter(lambda r: r.is_testing == is_testing, reqs))
+				try:
+					if not is_testing in dbs:
+						dbs[is_testing] = open_db(False, is_testing)
+						dbs[is_testing].connect()
+					results = self._write_group(dbs[is_testing], group)
+				except Exception as e:
+					# the commit failed, all requests of the group fail, reconnect with the next group
+					logging.warning(f"group commit failed: {e}")
+					db = dbs.pop(is_testing, None)
+					if db != None:
+						db.close()
+					for r in group:
+						r.future.set_exception(e)
+					continue
+				self.n_groups += 1
+				self.n_writes += len(group)
+				# answer only after the commit
+				for (r, (res, e)) in zip(group, results):
+					if e == None:
+						r.future.set_result(res)
+					else:
+						r.future.set_exception(e)
+
+		for db in dbs.values():
+			db.close()
+
+	def _write_group(self, db, group):
+		return db.transaction_group(map(lambda r: (lambda: opdict[r.operation](db, r.json_arguments)), group))
+
+	def close(self):
+		self.write_q.put(None)
+		self.writer.join()
+		for pool in self.read_pools.values():
+			while not pool.empty():
+				db = pool.get()
+				if db != None:
+					db.close()
+		if self.n_groups > 0:
+			print(f"group commits: {self.n_groups}, {self.n_writes / self.n_groups:.1f} write requests per commit", file=sys.stderr)
+
+class DBServerHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		rfile = io.TextIOWrapper(self.rfile, encoding="utf-8")
+		wfile = io.TextIOWrapper(self.wfile, encoding="utf-8")
+		# the first line defines the termination string of this connection
+		line = readline(rfile)
+		if line == None:
+			return
+		termination_line = line[:-1]
+		while True:
+			json_query_raw = receive_terminated_string(rfile, termination_line)
+			if json_query_raw == None:
+				break
+			r = process_request(json_query_raw, self.server.db_server.run)
+			send_terminated_string(wfile, termination_line, r)
+
+class DBSocketServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+
 # parse operation arguments from stdin
 logging.info(f"parsing json arguments.")
 
@@ -243,6 +602,9 @@ is_testing = args.testing
 is_read_only = True if args.read_only else False
 is_cont_in_out = operation == "cio"
 
+def run_cached_interaction(operation, json_arguments, is_read_only, is_testing):
+	return run_one_interaction(operation, json_arguments, is_read_only, is_testing, use_cache=True)
+
 if is_cont_in_out:
 	magic_termination_line = args.term_string
 	if magic_termination_line == None:
@@ -252,23 +614,54 @@ if is_cont_in_out:
 	while True: # check if this needs to be done differently
 		# receive query
 		json_query_raw = receive_terminated_string(sys.stdin, magic_termination_line)
-		json_query = json.loads(json_query_raw)
-		operation = json_query["op"] #string
-		json_arguments = json_query["args"] #structured data (also json)
-		is_testing = json_query["is_testing"] #boolean
-		is_read_only = json_query["is_read_only"] #boolean
-		try:
-			# process
-			ret_val = {"result": run_one_interaction(operation, json_arguments, is_read_only, is_testing)}
-		except Exception as e:
-			import traceback
-			tb_str = traceback.format_exc()
-			#print(tb_str)
-			#print(e)
-			ret_val = {"error": str(e), "traceback": tb_str}
-		# send response
-		r = json.dumps(ret_val)
+		if json_query_raw == None:
+			exit_at_eof()
+		# process and send response
+		r = process_request(json_query_raw, run_cached_interaction)
 		send_terminated_string(sys.stdout, magic_termination_line, r)
+elif operation == "server":
+	socket_path = args.socket
+	if socket_path == None:
+		raise Exception("need a socket path")
+	if os.path.exists(socket_path):
+		raise Exception(f"socket path exists already: {socket_path}")
+	# terminate cleanly with SIGTERM and SIGINT
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	db_server = DBServer(args.pool_size, args.group_size)
+	try:
+		with DBSocketServer(socket_path, DBServerHandler) as server:
+			server.db_server = db_server
+			logging.info(f"serving on {socket_path}")
+			try:
+				server.serve_forever()
+			except KeyboardInterrupt:
+				pass
+	finally:
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+		db_server.close()
+		print_req_summary()
+		print_stats()
+elif operation == "client":
+	# forward the cio protocol on stdin and stdout to a server
+	socket_path = args.socket
+	magic_termination_line = args.term_string
+	if socket_path == None or magic_termination_line == None:
+		raise Exception("need a socket path and a termination string")
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.connect(socket_path)
+		sock_r = sock.makefile("r", encoding="utf-8")
+		sock_w = sock.makefile("w", encoding="utf-8")
+		print(magic_termination_line, file=sock_w)
+		while True:
+			json_query_raw = receive_terminated_string(sys.stdin, magic_termination_line)
+			if json_query_raw == None:
+				break
+			send_terminated_string(sock_w, magic_termination_line, json_query_raw.removesuffix("\n"))
+			r = receive_terminated_string(sock_r, magic_termination_line)
+			if r == None:
+				raise Exception("server closed the connection")
+			send_terminated_string(sys.stdout, magic_termination_line, r.removesuffix("\n"))
 else:
 	# traditional mode, one db-interface command transaction per run of the process
 	if input_data != None:
@@ -39,7 +39,7 @@ else:
 
 # create db access object
 alt_db_file = None if not is_testing else "data/testing.db"
-with ldb.LogsDB(alt_db_file, read_only=True) as db:
+with ldb.LogsDB(alt_db_file, read_only=True, profile="reader") as db:
 	# execute query
 	(fields, rows) = db.get_tablerecords_sql(sql_str)
 
@@ -94,6 +94,7 @@ print()
 
 # iterate progs
 n_progs = 0
+new_entries = []
 for (lidx, prog) in progs:
 	keep = filter_fun(prog.get_code())
 	print_them = False
@@ -105,6 +106,7 @@ for (lidx, prog) in progs:
 			print()
 		continue
 	n_progs += 1
-	db.add_tablerecord(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=new_list.id, exp_progs_id=prog.get_prog_id(), list_index=lidx))
+	new_entries.append(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=new_list.id, exp_progs_id=prog.get_prog_id(), list_index=lidx))
+db.add_tablerecords(new_entries)
 
 print(f"added {n_progs} progs to new list")
@@ -105,7 +105,7 @@ print()
 # db connection
 print("opening db...")
 print()
-db = ldb.LogsDB()
+db = ldb.LogsDB(profile="bulk-import")
 db.connect()
 print("starting backup of db...")
 print()
@@ -113,6 +113,16 @@ db.backup()
 print("done.")
 print()
 
+# collect simple records (metadata and list entries) and add them in bulk
+pending_recs = []
+def add_rec_deferred(tr):
+	pending_recs.append(tr)
+	if len(pending_recs) >= 10000:
+		flush_recs()
+def flush_recs():
+	db.add_tablerecords(pending_recs)
+	pending_recs.clear()
+
 
 # import holba runs
 # ===============================================
@@ -151,7 +161,7 @@ def store_holba_run(meta):
 	# add the metadata
 	for k in meta.keys():
 		tr_meta = ldb.TR_holba_runs_meta(holba_runs_id=holbarun.id, kind=k, name="", value=meta[k])
-		db.add_tablerecord(tr_meta)
+		add_rec_deferred(tr_meta)
 	return (holbarun.id, progs_list.id, exps_list.id)
 
 holbarun_ids_map = {}
@@ -167,6 +177,7 @@ for holbarun_id in holbaruns:
 	db_ids = store_holba_run(meta)
 	holbarun_ids_map[holbarun_id] = db_ids
 	holbarun_l_idx_map[holbarun_id] = {"prog_l": 1, "exp_l": 1}
+flush_recs()
 
 
 # import progs
@@ -202,19 +213,19 @@ def store_prog(prog_id, code, meta):
 	assert(arch_id == "arm8")
 	# add program and also add it to common import list
 	prog_db = db.add_tablerecord(ldb.get_empty_TableRecord("exp_progs")._replace(arch=arch_id, code=code), match_existing=True)
-	db.add_tablerecord(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=progs_all_list.id, exp_progs_id=prog_db.id, list_index=progs_all_list_idx[0]))
+	add_rec_deferred(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=progs_all_list.id, exp_progs_id=prog_db.id, list_index=progs_all_list_idx[0]))
 	progs_all_list_idx[0] += 1
 	# add metadata
 	for (k,n,v) in meta:
 		tr_meta = ldb.TR_exp_progs_meta(exp_progs_id=prog_db.id, kind=k, name=n, value=v)
-		db.add_tablerecord(tr_meta)
+		add_rec_deferred(tr_meta)
 		# try to match holba runs
 		if n.startswith("gen."):
 			horun_id = n.split(".")[1]
 			if horun_id in holbarun_ids_map.keys():
 				prog_l_id = holbarun_ids_map[horun_id][1]
 				prog_l_list_idx = holbarun_l_idx_map[holbarun_id]["prog_l"]
-				db.add_tablerecord(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=prog_l_id, exp_progs_id=prog_db.id, list_index=prog_l_list_idx))
+				add_rec_deferred(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=prog_l_id, exp_progs_id=prog_db.id, list_index=prog_l_list_idx))
 				holbarun_l_idx_map[holbarun_id]["prog_l"] = prog_l_list_idx + 1
 	return prog_db.id
 
@@ -231,6 +242,7 @@ for prog_id in progs:
 	code,meta = res
 	db_id = store_prog(prog_id, code, meta)
 	prog_ids_map[prog_id] = db_id
+flush_recs()
 
 
 # import exps
@@ -311,19 +323,19 @@ def store_exp(exp_data):
 			input_data=input_data
 		)
 	exp_db = db.add_tablerecord(exp_tr, match_existing=True)
-	db.add_tablerecord(ldb.TR_exp_exps_lists_entries(exp_exps_lists_id=exps_all_list.id, exp_exps_id=exp_db.id, list_index=exps_all_list_idx[0]))
+	add_rec_deferred(ldb.TR_exp_exps_lists_entries(exp_exps_lists_id=exps_all_list.id, exp_exps_id=exp_db.id, list_index=exps_all_list_idx[0]))
 	exps_all_list_idx[0] += 1
 	# add metadata
 	for (k,n,v) in meta:
 		tr_meta = ldb.TR_exp_exps_meta(exp_exps_id=exp_db.id, kind=k, name=n, value=v)
-		db.add_tablerecord(tr_meta)
+		add_rec_deferred(tr_meta)
 		# try to match holba runs
 		if n.startswith("gen."):
 			horun_id = n.split(".")[1]
 			if horun_id in holbarun_ids_map.keys():
 				exp_l_id = holbarun_ids_map[horun_id][2]
 				exp_l_list_idx = holbarun_l_idx_map[holbarun_id]["exp_l"]
-				db.add_tablerecord(ldb.TR_exp_exps_lists_entries(exp_exps_lists_id=exp_l_id, exp_exps_id=exp_db.id, list_index=exp_l_list_idx))
+				add_rec_deferred(ldb.TR_exp_exps_lists_entries(exp_exps_lists_id=exp_l_id, exp_exps_id=exp_db.id, list_index=exp_l_list_idx))
 				holbarun_l_idx_map[holbarun_id]["exp_l"] = exp_l_list_idx + 1
 	# add runs (and just use a collective exprun for all runs)
 	for run in runs:
@@ -331,7 +343,7 @@ def store_exp(exp_data):
 		run_name += "." + exprun_import.get_name()
 		for k in run_data.keys():
 			tr_meta = ldb.TR_exp_exps_meta(exp_exps_id=exp_db.id, kind=k, name=run_name, value=run_data[k])
-			db.add_tablerecord(tr_meta)
+			add_rec_deferred(tr_meta)
 
 	return exp_db.id
 
@@ -345,6 +357,13 @@ for exp_id in exps:
 		logging.warning("skipping exp: " + exp_id)
 		continue
 	db_id = store_exp(res)
+flush_recs()
+
+# the run metadata was added directly, derive the latest runs from it
+print()
+print("rebuilding the latest runs...")
+n_latest = db.rebuild_latest()
+print(f"done ({n_latest} entries).")
 
 print()
 print("=" * 60)
@@ -6,8 +6,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
 
 import argparse
 import logging
+import functools
 import time
 import threading
+import queue
+import socket
 import multiprocessing.pool
 
 import logsdb as ldb
@@ -17,6 +20,11 @@ import logslist
 import exp_finder
 import progplatform
 import exp_runner
+import exp_pipeline
+import board_conn
+import exp_backend
+import result_writer
+import board_health
 
 # parse arguments
 parser = argparse.ArgumentParser()
@@ -25,10 +33,32 @@ parser.add_argument("-bt", "--board_type",  help="broad_type", choices=["rpi3",
 
 parser.add_argument(       "--run_once",    help="collect experiments in the beginning and run each experiment just once", action="store_true")
 
+parser.add_argument(       "--worker",      help="queue the incomplete experiments in the database and run experiments claimed from the queue (several workers can share the database)", action="store_true")
+parser.add_argument(       "--lease_time",  help="lease time in seconds for experiments claimed from the queue", type=int, default=600)
+parser.add_argument(       "--max_attempts", help="maximum number of attempts per experiment in the queue", type=int, default=3)
+
+parser.add_argument("-be", "--backend",     help="execution backend: board (default), or sim for simulated boards (no progplatform and hardware, the runs are stored with run_spec sim.<board_type>)", choices=exp_backend.backends, default="board")
+parser.add_argument("-sc", "--sim_config",  help="json object with the simulation settings (latency, rates, timeout, num_sets, num_lines, seed), see SimBackend")
+
 parser.add_argument("-ep", "--embexp_path", help="see run_experiment.py.")
 parser.add_argument("-cm", "--conn_mode",   help="see run_experiment.py.", choices=["try", "run", "reset"])
+parser.add_argument(       "--connect",     help="open and supervise one board connection per index (EmbExp-Box/interface/remote.py), the experiments use these connections", action="store_true")
+parser.add_argument(       "--connect_time", help="seconds until a (re)started board connection is considered established", type=int, default=30)
+
+parser.add_argument(       "--build_cache", help="reuse the experiment binaries of earlier builds with the same inputs (data/build_cache)", action="store_true")
+parser.add_argument(       "--build_cache_size", help="maximum number of builds in the build cache, the least recently used ones are removed", type=int, default=1000)
+
+parser.add_argument(       "--lookahead",   help="number of upcoming experiments that are built ahead while the boards run (0 disables the build pipeline, needs --build_cache)", type=int, default=0)
+parser.add_argument(       "--build_workers", help="number of parallel builds for the look-ahead", type=int, default=1)
+
+parser.add_argument(       "--workspace",   help="progplatform directories for the indexes: a fresh copy per experiment, or a persistent clone per index that is reset between experiments", choices=["copy", "persistent"], default="copy")
+
+parser.add_argument(       "--session",     help="verify the progplatform branch and cleanliness once and afterwards only reset the files written for each experiment (direct runs and persistent workspaces)", action="store_true")
+parser.add_argument(       "--session_verify_every", help="full cleanup and verification with git after this many experiments in session mode (and for persistent workspaces)", type=int, default=50)
 
 parser.add_argument("-idxs", "--indexes",   help="comma separated list of embexp remote indexes (no spaces).")
+parser.add_argument(       "--quarantine_time", help="seconds without experiments for a board index after repeated failures, then it gets a probe run", type=int, default=300)
+parser.add_argument(       "--timeout_time", help="failed runs that took at least this many seconds count as timeouts in the board health statistics", type=float, default=55)
 
 parser.add_argument("-v",  "--verbose",     help="increase output verbosity", action="store_true")
 args = parser.parse_args()
@@ -42,6 +72,10 @@ else:
 listname   = args.listname
 board_type = args.board_type
 run_once   = args.run_once
+is_worker  = args.worker
+
+if is_worker and run_once:
+	raise Exception("worker mode cannot be combined with run_once")
 
 indexes = args.indexes
 if indexes != None:
@@ -49,39 +83,88 @@ if indexes != None:
 else:
 	indexes = [None]
 
+# the copies of the progplatform are fresh for each experiment, there is no session to keep
+if args.session and indexes != [None] and args.workspace == "copy":
+	parser.error("--session with embexp remote indexes needs --workspace persistent")
+
+if args.lookahead > 0:
+	if not args.build_cache:
+		raise Exception("the build pipeline (lookahead) needs the build cache")
+	# the cleanup of the progplatform for direct runs would remove the build copies in its temp directory
+	if indexes == [None]:
+		raise Exception("the build pipeline (lookahead) needs embexp remote indexes")
+
+backend = exp_backend.get_backend(args.backend, args.sim_config)
+if not backend.uses_progplat:
+	if args.lookahead > 0 or args.session or args.connect or args.workspace != "copy":
+		raise Exception(f"the {backend.name} backend does not use the progplatform and boards, no lookahead, session, connect or workspace")
+
 # create prog platform object
-progplat = progplatform.get_embexp_ProgPlatform(args.embexp_path)
+progplat = progplatform.get_embexp_ProgPlatform(args.embexp_path) if backend.uses_progplat else None
 
 # db connection
 print("opening db...")
 print()
-db = ldb.LogsDB()
+# workers can run on several hosts with the database on a network filesystem, where WAL does not work
+db_profile = "shared-writer" if is_worker else "batch-writer"
+db = ldb.LogsDB(profile=db_profile)
 db.connect()
 
 # define experiment finding
 branchname = None
 branchname = progplatform.decide_branchname(branchname, board_type)
-progplat_hash = progplat.get_branch_commit_hash(branchname)
-run_spec = experiment._mk_run_spec(progplat_hash, board_type)
-
-def is_latest_exp_run_not_complete(exp):
-	run_id = exp.get_latest_run_id(run_spec)
-	if run_id == None:
-		return True # no run
-	run_data = exp.get_run_data(run_id)
-	return not experiment.Experiment.is_complete_run(run_data)
-
-def is_all_true(x):
-	return True
-
-def genfun_fromexplist(filterfun, listname):
-	exps = logslist.LogsList._get_by_name(db, "exp", listname).get_entries()
-	exps = map(lambda x: x[1], exps)
-	return list(filter(filterfun, exps))
-
-def genfun_allexps(filterfun):
-	exps = experiment.Experiment._get_all(db)
-	return list(filter(filterfun, exps))
+if backend.uses_progplat:
+	progplat_hash = progplat.get_branch_commit_hash(branchname)
+	run_spec = experiment._mk_run_spec(progplat_hash, board_type)
+else:
+	run_spec = backend.get_run_spec(progplat, board_type)
+
+# experiments returned by the filter and not finished yet (running, waiting in the look-ahead or in the result writer),
+# a rescan of the polling iterator must not return them again (the work queue of the workers takes care of this itself)
+dispatched_ids = set()
+dispatched_lock = threading.Lock()
+def finish_dispatched(exp_id):
+	with dispatched_lock:
+		dispatched_ids.discard(exp_id)
+
+# filters return the experiments to run, in the order of exps
+# (the filters and generator functions take the connection, the build pipeline iterates with its own one)
+def filter_latest_run_not_complete(db, exps):
+	# the latest runs are looked up in exp_exps_latest, one query per chunk of experiments
+	latest = experiment.Experiment.get_latest_runs(db, run_spec, map(lambda x: x.get_exp_id(), exps))
+	with dispatched_lock:
+		exps = list(filter(lambda x: not (x.get_exp_id() in dispatched_ids or (x.get_exp_id() in latest and latest[x.get_exp_id()].is_complete)), exps))
+		if not is_worker:
+			dispatched_ids.update(map(lambda x: x.get_exp_id(), exps))
+	return exps
+
+def filter_all(db, exps):
+	return list(exps)
+
+# generator functions return a pair of the greatest key seen (high-water mark) and the filtered experiments,
+# with min_key, only experiments with a greater key are considered (list index for lists, experiment id otherwise)
+def genfun_fromexplist(db, filterfun, listname, min_key = None):
+	explist = logslist.LogsList._get_by_name(db, "exp", listname)
+	if min_key == None:
+		entries = explist.get_entries()
+	else:
+		entries = explist.get_entries_after(min_key)
+	hwm = max(map(lambda x: x[0], entries), default=min_key)
+	return (hwm, filterfun(db, list(map(lambda x: x[1], entries))))
+
+def genfun_allexps(db, filterfun, min_key = None, chunk_size = 500):
+	# experiments are reloaded before running, skip the input data while filtering
+	hwm = min_key
+	exps = []
+	chunk = []
+	for exp in experiment.Experiment._iter_all(db, fields=["id", "exp_progs_id", "type", "params"], min_id=min_key):
+		hwm = exp.get_exp_id() if hwm == None else max(hwm, exp.get_exp_id())
+		chunk.append(exp)
+		if len(chunk) >= chunk_size:
+			exps += filterfun(db, chunk)
+			chunk = []
+	exps += filterfun(db, chunk)
+	return (hwm, exps)
 
 # select input experiment source
 if listname == None:
@@ -92,25 +175,69 @@ else:
 	genargs = {"listname": listname}
 
 # filter for incomplete experiments by default
-genargs["filterfun"] = is_latest_exp_run_not_complete
+genargs["filterfun"] = filter_latest_run_not_complete
 
 # poll by default
 do_poll = True
 
 # if "run_once", we take each experiment from the source into account (exactly once, no polling)
 if run_once:
-	genargs["filterfun"] = is_all_true
+	genargs["filterfun"] = filter_all
 	do_poll = False
 
-# create iterator
-if do_poll:
-	exp_iter = exp_finder.PollingIterator(genfun, genargs)
-else:
-	exp_iter = exp_finder.NonPollingListIterator(genfun(**genargs))
+if is_worker:
+	# add incomplete experiments of the source to the queue, the workers claim from there
+	n_queued = db.queue_add(map(lambda x: x.get_exp_id(), genfun(db, **genargs)[1]), run_spec)
+	print(f"added {n_queued} experiments to the queue")
+	worker_owner = f"{socket.gethostname()}:{os.getpid()}"
+
+# create iterator for the connection it_db
+def make_exp_iter(it_db):
+	it_genfun = functools.partial(genfun, it_db)
+	if is_worker:
+		return exp_finder.QueueIterator(it_db, run_spec, worker_owner, lease_time=args.lease_time, max_attempts=args.max_attempts)
+	elif do_poll:
+		# only new experiments are fetched between full rescans
+		return exp_finder.PollingIterator(it_genfun, genargs, incremental=True)
+	else:
+		return exp_finder.NonPollingListIterator(it_genfun(**genargs)[1])
+
+# with the build pipeline, the iterator is created there
+if args.lookahead == 0:
+	exp_iter = make_exp_iter(db)
 
 # create exp run in db
 exprun = exprun.ExpRun._create(db)
 
+# results are written by a separate thread and connection, the board threads do not wait for the database
+# experiments with the same inputs (repeated runs, several boards) are built once
+build_cache = None if (not args.build_cache or not backend.uses_progplat) else progplatform.BuildCache(max_entries=args.build_cache_size)
+
+# directories of the progplatform for the indexes
+session_branch = branchname if args.session else None
+workspaces = progplatform.Workspaces(progplat, args.workspace, session_branch, args.session_verify_every)
+if args.session and indexes == [None]:
+	progplat.start_session(branchname, args.session_verify_every)
+
+# long-lived board connections, instead of connecting for each experiment or in separate terminals
+conns = None
+if args.connect:
+	if args.conn_mode != None and args.conn_mode != "run":
+		raise Exception("managed board connections are used with conn_mode run")
+	remote_cmd = board_conn.get_remote_cmd(progplatform.get_embexp_box_path(args.embexp_path), board_type)
+	conns = board_conn.BoardConnections(remote_cmd, indexes, connect_time=args.connect_time)
+	conns.start()
+
+# build the next experiments while the boards are busy
+pipeline = None
+if args.lookahead > 0:
+	pipeline = exp_pipeline.BuildPipeline(make_exp_iter, db.database_file, progplat, board_type, build_cache, branchname, n_workers=args.build_workers, lookahead=args.lookahead, db_profile=db_profile)
+	exp_iter = pipeline
+if is_worker:
+	queue_iter = exp_iter if pipeline == None else pipeline.exp_iter
+
+res_writer = result_writer.ResultWriter(profile=db_profile, on_mismatch=lambda exp, run_spec: print(f"         - mismatch with the previous run: {exp}"))
+
 # launch the runner script for each experiment in the list
 # ======================================
 logging.info(f"running all selected experiments")
@@ -121,24 +248,49 @@ statistics = {
 }
 all_start_time = time.time()
 
+# board health, starts from the statistics of previous batches
+health = board_health.BoardHealth(quarantine_time=args.quarantine_time)
+health_idxs = list(filter(lambda x: x != None, indexes))
+for idx in health.load(db, health_idxs):
+	print(f"board (conn idx={idx}) from previous batches: {health.to_string(idx)}")
+
 indexes_lock = threading.Lock()
 def check_idx():
+	# a free index that is not quarantined (or is due for a probe run)
 	with indexes_lock:
-		return len(indexes) != 0
+		return any(map(health.is_available, indexes))
 def acquire_idx():
+	# weighted by health, healthy and fast boards get more experiments
 	with indexes_lock:
-		idx = indexes.pop(0)
+		idx = health.choose(indexes)
+		assert(idx != None or None in indexes)
+		indexes.remove(idx)
 	return idx
+def wait_time_idx():
+	# time until a free index leaves quarantine
+	with indexes_lock:
+		return health.time_to_available(indexes) if len(indexes) != 0 else None
 def release_idx(idx):
 	with indexes_lock:
 		indexes.append(idx)
 
+# per board index: [number of experiment runs, busy time]
+board_stats = {}
+def add_board_stat(idx, busy_time):
+	with indexes_lock:
+		st = board_stats.setdefault(idx, [0, 0.0])
+		st[0] += 1
+		st[1] += busy_time
+
 def exec_exp(exp, idx):
 	success = False
+	written = []
+	# only failures of the board run count for the board health
+	board_failure = False
 	result_val = None
+	start_time = time.time()
 	#idx = acquire_idx()
 	try:
-		start_time = time.time()
 		connidxstr = "" if idx == None else f"(conn idx={idx})"
 		def print_runtime():
 			print(f"         - took {time.time()-start_time:.2f}s {connidxstr}")
@@ -147,13 +299,25 @@ def exec_exp(exp, idx):
 
 		(iter_round, iter_idx, iter_size) = exp_iter.get_iterinfo()
 		print(f"===>>> [r:{iter_round}, {(iter_idx/iter_size * 100):.2f}% of {iter_size}] {exp} {connidxstr}")
+		if pipeline != None:
+			pipeline.wait_build(exp)
+		# in worker mode, the queue entry is completed only after the run is committed by the result writer
+		# (likewise, the experiment can be returned by the filter again only after that)
+		def on_written(future):
+			written.append(future)
+			future.add_done_callback(lambda f: finish_dispatched(exp.get_exp_id()))
+			if is_worker:
+				future.add_done_callback(lambda f: queue_iter.report(exp, f.exception() == None))
 		try:
 			conn_mode = args.conn_mode
 			copy_to_temp = False
 			if idx != None:
 				conn_mode = "run"
 				copy_to_temp = True
-			result_val = exp_runner.run_experiment(exp, progplat, board_type, conn_mode=conn_mode, exprun=exprun, branchname=branchname, embexp_inst_idx = idx, copy_to_temp = copy_to_temp)
+			if conns != None:
+				conn_mode = "run"
+				conns.wait_ready(idx)
+			result_val = exp_runner.run_experiment(exp, progplat, board_type, conn_mode=conn_mode, exprun=exprun, branchname=branchname, embexp_inst_idx = idx, copy_to_temp = copy_to_temp, result_writer = res_writer, on_written = on_written, build_cache = build_cache, workspaces = workspaces, backend = backend)
 			print_runtime()
 			success = True
 			if result_val != True:
@@ -161,6 +325,10 @@ def exec_exp(exp, idx):
 		except KeyboardInterrupt:
 			print("keyboard interrupt raised during execution {connidxstr}")
 			raise
+		except exp_backend.BoardRunError as ex:
+			print_runtime()
+			logging.warning(f"- unsuccessful run on board {connidxstr}: {ex}")
+			board_failure = True
 		except Exception as ex:
 			#import traceback
 			#print(traceback.format_exc())
@@ -168,7 +336,18 @@ def exec_exp(exp, idx):
 			print_runtime()
 			logging.warning(f"- unsuccessful {connidxstr}")
 			#time.sleep(5000)
+		if conns != None and (success or board_failure):
+			conns.report(idx, success)
+		if is_worker and len(written) == 0:
+			queue_iter.report(exp, False)
 	finally:
+		if len(written) == 0:
+			finish_dispatched(exp.get_exp_id())
+		run_time = time.time() - start_time
+		add_board_stat(idx, run_time)
+		if success or board_failure:
+			with indexes_lock:
+				health.record(idx, success, run_time, timed_out=(run_time >= args.timeout_time))
 		release_idx(idx)
 	return (idx, success, result_val)
 
@@ -187,33 +366,73 @@ def eval_result(res, statistics):
 try:
 	numtasks = len(indexes)
 	if numtasks == 1:
-		idx = indexes[0]
 		for exp in exp_iter:
+			while not check_idx():
+				time.sleep(wait_time_idx())
+			idx = acquire_idx()
 			res_ = exec_exp(exp, idx)
 			eval_result(res_, statistics)
 	else:
+		# continuous scheduling: an index gets the next experiment as soon as it is free again
+		done_q = queue.Queue()
 		with multiprocessing.pool.ThreadPool(processes=numtasks) as pool:
-			#for  in pool.imap_unordered(exec_exp, ):
+			n_running = 0
+			exp_iter_done = False
 			while True:
-				result_list = []
-				for exp in exp_iter:
-					if not check_idx():
+				while (not exp_iter_done) and check_idx():
+					try:
+						exp = next(exp_iter)
+					except StopIteration:
+						exp_iter_done = True
 						break
 					idx = acquire_idx()
-					res = pool.apply_async(exec_exp, (exp, idx))
-					result_list.append(res)
-					if not check_idx():
-						break
-				if result_list == []:
+					pool.apply_async(exec_exp, (exp, idx), callback=done_q.put, error_callback=done_q.put)
+					n_running += 1
+				if n_running == 0 and exp_iter_done:
 					break
 
-				while result_list != []:
-					res_ = result_list.pop(0).get()
-					eval_result(res_, statistics)
+				# wait for the next completion, in any order, or until a quarantined index is due for a probe
+				wait_time = None if exp_iter_done else wait_time_idx()
+				if n_running == 0:
+					time.sleep(wait_time)
+					continue
+				try:
+					res_ = done_q.get(timeout=wait_time)
+				except queue.Empty:
+					continue
+				n_running -= 1
+				if isinstance(res_, BaseException):
+					raise res_
+				eval_result(res_, statistics)
 
 except KeyboardInterrupt:
 	print("-> script was cancelled by keyboard interrupt")
 
+finally:
+	# shut down also after other errors, each step runs even if a previous one fails
+	def shutdown_step(name, f):
+		try:
+			f()
+		except Exception as e:
+			logging.error(f"shutdown of {name} failed: {e}")
+
+	if pipeline != None:
+		shutdown_step("build pipeline", pipeline.close)
+
+	if conns != None:
+		shutdown_step("board connections", conns.close)
+
+	# wait for the pending results
+	shutdown_step("result writer", res_writer.close)
+
+	if is_worker:
+		# leases of unfinished experiments are given back to the queue
+		shutdown_step("queue", queue_iter.close)
+
+	# keep the board health for the next batches
+	if len(health_idxs) != 0:
+		shutdown_step("board health", lambda: health.save(db, exprun.get_exprun_id()))
+
 n_exp_runs = statistics["n_exp_runs"]
 n_exp_runs_success = statistics["n_exp_runs_success"]
 
@@ -230,9 +449,23 @@ if (n_exp_runs > 0):
 	print(f"average execution time {all_time/n_exp_runs:.2f}s (this computation is not taking parallelization into account)")
 if (n_exp_runs_success > 0):
 	print(f"run_spec = {run_spec}")
+print(f"result writer: {res_writer.get_stats_str()}")
+if build_cache != None:
+	print(f"build cache: {build_cache.get_stats_str()}")
+if pipeline != None:
+	print(f"build pipeline: {pipeline.get_stats_str()}")
+if indexes != [None] and backend.uses_progplat:
+	print(f"workspaces: {workspaces.get_stats_str()}")
+print(f"backend: {backend.get_stats_str()}")
+for (idx, (n_runs, busy_time)) in sorted(board_stats.items(), key=lambda x: str(x[0])):
+	print(f"board (conn idx={idx}): {n_runs} experiment runs, busy for {busy_time:.2f}s ({100 * busy_time / max(all_time, 1e-6):.1f}% utilization)")
+	print(f"  health: {health.to_string(idx)}")
+	if conns != None:
+		print(f"  connection: {conns.get_stats_str(idx)}")
 print("="*40)
 assert(n_exp_runs_success <= n_exp_runs)
-successful = n_exp_runs_success == n_exp_runs
+# mismatches with previous runs count as failed runs, like when writing synchronously
+successful = n_exp_runs_success == n_exp_runs and res_writer.n_mismatches == 0 and res_writer.n_failures == 0
 if successful:
 	print("ALL STARTED EXPERIMENT RUNS COMPLETED")
 else:
@@ -11,6 +11,7 @@ import logsdb as ldb
 import experiment
 import progplatform
 import exp_runner
+import exp_backend
 
 # parse arguments
 parser = argparse.ArgumentParser()
@@ -24,6 +25,9 @@ parser.add_argument("-is", "--input_state", help="run as single experiment with
 parser.add_argument("-ep", "--embexp_path", help="path to embexp repositories")
 parser.add_argument("-cm", "--conn_mode", help="connection mode: try (default), run, reset. 'try' for trying an active connection, otherwise do ad-hoc connect (runlog_try, default). 'reset' for connect with reset (runlog_reset). 'run' for simply using an active connection (runlog).", choices=["try", "run", "reset"])
 
+parser.add_argument("-be", "--backend", help="execution backend: board (default), or sim for a simulated board", choices=exp_backend.backends, default="board")
+parser.add_argument("-sc", "--sim_config", help="json object with the simulation settings (latency, rates, timeout, num_sets, num_lines, seed), see SimBackend")
+
 # pre-cleanup of progplatform
 parser.add_argument("-fca", "--force_cleanup_all",     help="force full cleanup before running", action="store_true")
 parser.add_argument("-fci", "--force_cleanup_ignored", help="force cleanup of all gitignored files before running", action="store_true")
@@ -49,15 +53,17 @@ elif args.force_cleanup_ignored:
 else:
 	force_cleanup = None
 
+backend = exp_backend.get_backend(args.backend, args.sim_config)
+
 # create prog platform object
-progplat = progplatform.get_embexp_ProgPlatform(args.embexp_path)
+progplat = progplatform.get_embexp_ProgPlatform(args.embexp_path) if backend.uses_progplat else None
 
 # db connection
 print("opening db...")
 print()
 with ldb.LogsDB() as db:
 	exp = experiment.Experiment(db, int(args.exp_id))
-	exp_runner.run_experiment(exp, progplat, args.board_type, args.branchname, args.conn_mode, force_cleanup, args.no_post_clean, True, run_input_state=args.input_state)
+	exp_runner.run_experiment(exp, progplat, args.board_type, args.branchname, args.conn_mode, force_cleanup, args.no_post_clean, True, run_input_state=args.input_state, backend=backend)
 
 
 
@@ -76,9 +76,8 @@ for i in range(len(containers)):
 	container = containers[i]
 	print(f"container {i} has length {len(container)}")
 
-	for (lidx, prog) in container:
-		db.add_tablerecord(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=new_list.id, exp_progs_id=prog.get_prog_id(), list_index=lidx))
-		pass
+	entries = map(lambda x: ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=new_list.id, exp_progs_id=x[1].get_prog_id(), list_index=x[0]), container)
+	db.add_tablerecords(entries)
 
 	print()
 
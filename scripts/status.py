@@ -65,7 +65,7 @@ print()
 
 print("opening db...")
 print()
-db = ldb.LogsDB(read_only=True)
+db = ldb.LogsDB(read_only=True, profile="reader")
 db.connect()
 
 if args.print_structures:
@@ -74,70 +74,71 @@ if args.print_structures:
 		print(f"- '{hbar.get_name()}'")
 	print("experiment lists: ")
 	for el in logslist.LogsList._get_all(db, "exp"):
-		print(f"- '{el.get_name()}' (cnt={len(el.get_entry_ids())}, '{el.get_description()}')")
+		print(f"- '{el.get_name()}' (cnt={el.count()}, '{el.get_description()}')")
 	print("program lists: ")
 	for el in logslist.LogsList._get_all(db, "prog"):
-		print(f"- '{el.get_name()}' (cnt={len(el.get_entry_ids())}, '{el.get_description()}')")
+		print(f"- '{el.get_name()}' (cnt={el.count()}, '{el.get_description()}')")
 	print("exp runs: ")
 	for expr in exprun.ExpRun._get_all(db):
 		print(f"- '{expr.get_name()}'")
 	print()
 
 listname = args.listname
-exps = None
+exp_ids = None
 if listname != None:
-	exps = logslist.LogsList._get_by_name(db, "exp", listname).get_entries()
-	exps = list(map(lambda exp: exp[1], exps))
-	print(f"found {len(exps)} experiments in list {listname}")
+	explist = logslist.LogsList._get_by_name(db, "exp", listname)
+	exp_ids = list(map(lambda x: x[1], explist.get_entry_ids()))
+	print(f"found {len(exp_ids)} experiments in list {listname}")
+	# the latest runs of the experiments in the list, with one query
+	latest = explist.get_latest_runs(run_spec)
+	joins_arch = [("exp_exps", 0), ("exp_exps_lists_entries", 1)]
+	exp_arch_scope = explist._get_entries_exp(2)
 else:
-	exps = experiment.Experiment._get_all(db)
-	print(f"found {len(exps)} experiments in the database")
+	# go through the experiment ids lazily
+	exp_ids = map(lambda x: x.id, db.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps"), fields=["id"]))
+	latest = experiment.Experiment.get_latest_runs(db, run_spec)
+	joins_arch = [("exp_exps", 0)]
+	exp_arch_scope = None
 	logging.warning("the output is for all experiments in the database!")
 
-# filter out the valid experiments
-exps = list(filter(lambda exp: exp.is_valid_experiment(), exps))
+# all programs of the experiments have the architecture
+exp_arch = ldb.QE_Not(arg=ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=0, field="arch"), arg2=ldb.QE_Const(value=arch_id)))
+if exp_arch_scope != None:
+	exp_arch = ldb.QE_Bin(op=ldb.QE_Bop.AND, arg1=exp_arch, arg2=exp_arch_scope)
+assert db.get_tablerecords("exp_progs", joins_arch, exp_arch, count_only=True) == 0
 
-# collect all programs and experiments
-print()
-logging.info("collecting all programs and experiments")
-print(f"n_exps  = {len(exps)}")
-print()
-print()
-
-# collect statistics
+# collect statistics (from exp_exps_latest, the latest run of each experiment)
+logging.info("collecting all experiments")
+n_exps         = 0
 e_notrun       = []
 e_incomplete   = []
-e_examples     = []
-e_cexamples    = []
-e_inconclusive = []
-e_others       = []
-for exp in exps:
-	assert exp.get_prog().get_arch() == arch_id
-	exp_id = exp.get_exp_id()
+e_by_class     = dict(map(lambda x: (x, []), experiment.result_classes))
+for exp_id in exp_ids:
+	n_exps += 1
 
 	# did it run?
-	run_id = exp.get_latest_run_id(run_spec)
-	if run_id == None:
+	run = latest.get(exp_id)
+	if run == None:
 		e_notrun.append(exp_id)
 		continue
 
-	run_data = exp.get_run_data(run_id)
-
 	# is it complete?
-	if not experiment.Experiment.is_complete_run(run_data):
+	if not run.is_complete:
 		e_incomplete.append(exp_id)
 		continue
 
 	# what's the result?
-	result = run_data["result"]
-	if result == True:
-		e_examples.append(exp_id)
-	elif result == False:
-		e_cexamples.append(exp_id)
-	elif result.startswith("special :::: INCONCLUSIVE: "):
-		e_inconclusive.append(exp_id)
-	else:
-		e_others.append(exp_id)
+	e_by_class[run.result_class].append(exp_id)
+e_examples     = e_by_class["example"]
+e_cexamples    = e_by_class["counterexample"]
+e_inconclusive = e_by_class["inconclusive"]
+# board exceptions are unclear results as well
+e_others       = e_by_class["exception"] + e_by_class["other"]
+
+print()
+print(f"n_exps  = {n_exps}")
+print()
+print()
 
 print(f"n_notrun     = {len(e_notrun)}")
 print(f"n_incomplete = {len(e_incomplete)}")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+
+import argparse
+import json
+import time
+
+from subprocess import Popen, PIPE
+
+# benchmark for the continuous i/o mode of db-interface.py with large payloads (uses the testing database)
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-s", "--size_mb", help="payload size in MB per request", type=float, default=4)
+parser.add_argument("-n", "--num_requests", help="number of append requests", type=int, default=10)
+parser.add_argument("-ts", "--term_string", help="termination string of the protocol", default="__BENCH_END__")
+
+args = parser.parse_args()
+
+term_string = args.term_string
+payload_len = int(args.size_mb * 1024 * 1024)
+# line breaks every 100 characters, like uart logs
+payload = "".join(map(lambda i: ("x" * 99) + "\n", range(payload_len // 100)))
+meta_name = f"payload_{time.time()}"
+
+interface_py = os.path.join(os.path.dirname(__file__), "../scripts/db-interface.py")
+p = Popen([interface_py, "-ts", term_string, "cio"], stdin=PIPE, stdout=PIPE, text=True)
+
+def request(op, op_args, is_read_only = False):
+	q = {"op": op, "args": op_args, "is_testing": True, "is_read_only": is_read_only}
+	p.stdin.write(json.dumps(q) + "\n" + term_string + "\n")
+	p.stdin.flush()
+	lines = []
+	while True:
+		line = p.stdout.readline()
+		if line == "":
+			raise Exception("db-interface.py terminated")
+		if line == term_string + "\n":
+			break
+		lines.append(line)
+	res = json.loads("".join(lines))
+	if "error" in res:
+		raise Exception(res["traceback"])
+	return res["result"]
+
+def bench(name, n, n_bytes, f):
+	start_time = time.time()
+	for i in range(n):
+		f(i)
+	duration = time.time() - start_time
+	print(f"{name}: {n} requests, {duration:.2f}s, {n / duration:.1f} requests/s, {n * n_bytes / duration / (1024 * 1024):.1f} MB/s")
+
+# one fresh row per request, appending to a growing value would measure the database instead
+def append_one(i):
+	res = request("create", {"table": "db_meta", "values": {"kind": "bench", "name": f"{meta_name}_{i}", "value": ""}, "id_only": True})
+	request("append", {"table": "db_meta", "values": {"id": res["id"], "kind": "bench", "name": f"{meta_name}_{i}", "value": payload}})
+
+def query_one(i):
+	res = request("query", {"type": "match_simple", "query": {"table": "db_meta", "values": {"kind": "bench", "name": f"{meta_name}_{i}"}, "fields": ["value"]}}, True)
+	assert(res["rows"] == [[payload]])
+
+print(f"payload size: {len(payload) / (1024 * 1024):.2f} MB")
+bench("append (stdin)", args.num_requests, len(payload), append_one)
+bench("query (stdout)", args.num_requests, len(payload), query_one)
+
+p.stdin.close()
+p.wait()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+
+import logging
+import time
+
+import board_conn
+
+# raise the logging level
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+
+# helper function to check failing cases
+def ensure_failing(f, *a):
+	try_fin = False
+	try:
+		f(*a)
+		try_fin = True
+	except Exception as e:
+		print(e)
+	assert(not try_fin)
+
+
+# start with testing procedure
+# ======================================================================================================================
+
+# stand-in for remote.py, the connection of index 1 terminates after a short time
+remote_cmd = [sys.executable, "-c", "import os, sys, time; time.sleep(0.3 if os.environ['EMBEXP_INSTANCE_IDX'] == '1' else 100)"]
+
+
+# test supervised board connections
+# ======================================================================================================================
+with board_conn.BoardConnections(remote_cmd, [0, 1], connect_time=0.2, restart_after=2, poll_time=0.05, restart_delay=0.05) as conns:
+	start_time = time.time()
+	conns.wait_ready(0)
+	assert(time.time() - start_time >= 0.15)
+	assert(conns.is_alive(0))
+	assert(conns.is_alive(1))
+
+	# terminated connections are restarted
+	time.sleep(0.5)
+	assert(conns.conns[1]["n_starts"] >= 2)
+	assert(conns.conns[0]["n_starts"] == 1)
+
+	# and connections with failing experiments in a row
+	proc = conns.conns[0]["proc"]
+	conns.report(0, False)
+	conns.report(0, True)
+	conns.report(0, False)
+	assert(conns.conns[0]["proc"] is proc)
+	conns.report(0, False)
+	assert(conns.conns[0]["proc"] is not proc)
+	assert(proc.poll() != None)
+	assert(conns.get_stats_str(0) == "2 connects (1 restarts)")
+
+# all connections are closed
+assert(not conns.is_alive(0))
+assert(not conns.is_alive(1))
+
+
+# test restart backoff and giving up on connections
+# ======================================================================================================================
+# terminates immediately, before the connection is established
+remote_cmd_fail = [sys.executable, "-c", "import sys; sys.exit(1)"]
+with board_conn.BoardConnections(remote_cmd_fail, [0], connect_time=10, poll_time=0.02, restart_delay=0.1, max_restarts=3) as conns:
+	restart_times = []
+	n_starts = 1
+	start_time = time.time()
+	while time.time() - start_time < 3 and conns.conns[0]["n_terminations"] <= 3:
+		if conns.conns[0]["n_starts"] != n_starts:
+			n_starts = conns.conns[0]["n_starts"]
+			restart_times.append(time.time() - start_time)
+		time.sleep(0.01)
+	# restarted with the delays 0.1, 0.2 and 0.4, then given up
+	assert(len(restart_times) == 3)
+	assert(restart_times[1] - restart_times[0] >= 0.15)
+	assert(restart_times[2] - restart_times[1] >= 0.35)
+	time.sleep(0.2)
+	assert(conns.conns[0]["n_starts"] == 4)
+	assert(conns.conns[0]["proc"] == None and conns.conns[0]["restart_at"] == None)
+	assert(conns.supervisor.is_alive())
+	# an explicit restart starts over
+	conns.restart(0)
+	assert(conns.conns[0]["n_starts"] == 5)
+
+# connections that cannot be started are retried by the supervisor
+with board_conn.BoardConnections(remote_cmd, [0], connect_time=0.1, poll_time=0.02, restart_delay=0.05, max_restarts=2) as conns:
+	conns.remote_cmd = ["/nonexistent/remote.py"]
+	conns.restart(0)
+	assert(not conns.is_alive(0))
+	assert(conns.conns[0]["restart_at"] != None)
+	time.sleep(0.5)
+	assert(conns.conns[0]["n_terminations"] == 3)
+	assert(conns.conns[0]["restart_at"] == None)
+	assert(conns.supervisor.is_alive())
+	conns.remote_cmd = remote_cmd
+	conns.restart(0)
+	assert(conns.is_alive(0))
+
+# closing does not hold the lock while waiting for the processes
+remote_cmd_slow = [sys.executable, "-c", "import signal, time; signal.signal(signal.SIGTERM, lambda *a: None); time.sleep(100)"]
+conns = board_conn.BoardConnections(remote_cmd_slow, [0], connect_time=0.1, poll_time=0.02)
+conns.start()
+time.sleep(0.3)
+start_time = time.time()
+import threading
+close_thread = threading.Thread(target=conns.close)
+close_thread.start()
+time.sleep(0.2)
+assert(close_thread.is_alive())
+with conns.lock:
+	assert(time.time() - start_time < 1)
+close_thread.join()
+assert(not conns.is_alive(0))
+
+
+# all successful
+# ======================================================================================================================
+print()
+print("All tests finished successfully.")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+
+import logging
+import time
+import random
+
+import logsdb as ldb
+import exprun
+import board_health
+
+# raise the logging level
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+
+# helper function to check failing cases
+def ensure_failing(f, *a):
+	try_fin = False
+	try:
+		f(*a)
+		try_fin = True
+	except Exception as e:
+		print(e)
+	assert(not try_fin)
+
+
+# start with testing procedure
+# ======================================================================================================================
+
+# clear testing database
+db_file = "data/testing_health.db"
+if os.path.isfile(db_file):
+	os.remove(db_file)
+
+
+# test statistics and weighted dispatch
+# ======================================================================================================================
+bh = board_health.BoardHealth(window=4, quarantine_after=2, quarantine_time=0.05)
+for _ in range(4):
+	bh.record(0, True, 1.0)
+	bh.record(1, True, 4.0)
+bh.record(2, False, 60.0, timed_out=True)
+assert(bh.success_rate(0) == 5/6)
+assert(bh.latency(1) == 4.0)
+assert(bh.timeout_rate(2) == 1.0)
+assert(bh.weight(0) > bh.weight(1) > bh.weight(2))
+
+# faster boards get more experiments
+rng = random.Random(0)
+choices = list(map(lambda _: bh.choose([0, 1], rng), range(200)))
+assert(choices.count(0) > choices.count(1) > 0)
+
+
+# test quarantine after repeated failures, then a probe run
+# ======================================================================================================================
+bh.record(2, False, 1.0)
+assert(not bh.is_available(2))
+assert(0 < bh.time_to_available([2]) <= 0.05)
+assert(bh.choose([2]) == None)
+assert(bh.choose([2, 1]) == 1)
+
+# a failed probe extends the quarantine
+time.sleep(0.06)
+assert(bh.choose([2]) == 2)
+bh.record(2, False, 1.0)
+assert(not bh.is_available(2))
+
+# a successful probe ends it
+time.sleep(0.06)
+bh.record(2, True, 1.0)
+assert(bh.is_available(2))
+
+
+# test persistence, the latest stored statistics are loaded
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	erun_1 = exprun.ExpRun._create(db, "health1")
+	bh.save(db, erun_1.get_exprun_id())
+	bh.record(0, False, 2.0)
+	erun_2 = exprun.ExpRun._create(db, "health2")
+	bh.save(db, erun_2.get_exprun_id())
+
+	bh_loaded = board_health.BoardHealth(window=4)
+	assert(bh_loaded.load(db, [0, 1, 3]) == [0, 1])
+	assert(bh_loaded.to_json(0) == bh.to_json(0))
+	assert(bh_loaded.to_json(1) == bh.to_json(1))
+	assert(bh_loaded.weight(0) == bh.weight(0))
+	# quarantines are not carried over to another batch
+	assert(not "quarantined_until" in bh.to_json(0))
+	assert(all(map(bh_loaded.is_available, [0, 1])))
+
+
+# all successful
+# ======================================================================================================================
+print()
+print("All tests finished successfully.")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+
+import logging
+import random
+
+import logsdb as ldb
+import exprun
+import experiment
+import exp_runner
+import exp_backend
+import result_writer
+
+# raise the logging level
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+
+# helper function to check failing cases
+def ensure_failing(f, *a):
+	try_fin = False
+	try:
+		f(*a)
+		try_fin = True
+	except Exception as e:
+		print(e)
+	assert(not try_fin)
+
+
+# start with testing procedure
+# ======================================================================================================================
+
+# clear testing database
+db_file = "data/testing_backend.db"
+if os.path.isfile(db_file):
+	os.remove(db_file)
+
+
+# test the simulated board backend, the outputs go through the usual parsers
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	prog = db.add_tablerecord(ldb.get_empty_TableRecord("exp_progs")._replace(arch = "arm8", code = "nop"))
+	exps = []
+	for exp_type in ["exps2", "exps1"]:
+		exp = db.add_tablerecord(ldb.TR_exp_exps(id=None, exp_progs_id=prog.id, type=exp_type, params="sim_model", input_data="{}"))
+		exps.append(experiment.Experiment(db, exp.id))
+	erun = exprun.ExpRun._create(db, "sim")
+	sim = exp_backend.get_backend("sim", '{"latency": {"dist": "uniform", "min": 0, "max": 0.01}, "seed": 1}')
+	assert(sim.get_run_spec(None, "rpi3") == "sim.rpi3")
+
+	# complete runs are stored with the simulation run_spec, the same cache dump for each run of an exps1 experiment
+	for i in range(2):
+		# reloaded for the latest runs, like in run_batch.py
+		exps = list(map(lambda e: experiment.Experiment(db, e.get_exp_id()), exps))
+		assert(exp_runner.run_experiment(exps[0], None, "rpi3", exprun=erun, backend=sim) == True)
+		sets = exp_runner.run_experiment(exps[1], None, "rpi3", exprun=erun, backend=sim)
+		assert(len(sets) > 0)
+		assert(all(map(lambda x: len(x["lines"]) > 0, sets)))
+	assert(list(map(lambda e: len(e.get_run_ids("sim.rpi3")), exps)) == [1, 1])
+	assert(sim.counts == {"ok": 4})
+
+	# the stored runs are reported after the commit, also through the result writer
+	written = []
+	exp_runner.run_experiment(exps[0], None, "rpi3", exprun=erun, on_written=written.append, backend=sim)
+	with result_writer.ResultWriter(db_file) as w:
+		exp_runner.run_experiment(exps[0], None, "rpi3", exprun=erun, result_writer=w, on_written=written.append, backend=sim)
+	assert(len(written) == 2)
+	assert(all(map(lambda f: f.done() and f.result() == True, written)))
+
+
+	# test the simulated outcomes
+	# ======================================================================================================================
+	for (outcome, expected) in [("unequal", False), ("inconclusive", "special :::: INCONCLUSIVE: 77"), ("exception", "embexp.board.exception :::: simulated")]:
+		sim_o = exp_backend.SimBackend(rates={outcome: 1})
+		assert(exp_runner.run_experiment(exps[0], None, "rpi3", backend=sim_o) == expected)
+	sim_o = exp_backend.SimBackend(rates={"unequal": 1})
+	assert(exp_runner.run_experiment(exps[1], None, "rpi3", backend=sim_o) != sets)
+	# failures of the run are board failures, other errors are not
+	def ensure_board_failure(exp, backend, expected):
+		board_failure = None
+		try:
+			exp_runner.run_experiment(exp, None, "rpi3", backend=backend)
+		except exp_backend.BoardRunError as e:
+			print(e)
+			board_failure = True
+		except Exception as e:
+			print(e)
+			board_failure = False
+		assert(board_failure == expected)
+	for outcome in ["failure", "incomplete", "timeout"]:
+		sim_o = exp_backend.SimBackend(rates={outcome: 1}, timeout=0.01)
+		ensure_board_failure(exps[0], sim_o, True)
+	assert(sim_o.get_stats_str() == "1 simulated runs, 0 ok, 0 failure, 1 timeout, 0 exception, 0 inconclusive, 0 unequal, 0 incomplete")
+	exp_unknown = db.add_tablerecord(ldb.TR_exp_exps(id=None, exp_progs_id=prog.id, type="exps3", params="sim_model", input_data="{}"))
+	ensure_board_failure(experiment.Experiment(db, exp_unknown.id), exp_backend.SimBackend(), False)
+
+
+# test latency distributions and configuration errors
+# ======================================================================================================================
+rng = random.Random(0)
+for latency in [{"dist": "fixed", "value": 2}, {"dist": "normal", "mean": 2, "sd": 0.1}, {"dist": "lognormal", "mean": 2, "sd": 0.1}]:
+	sim_l = exp_backend.SimBackend(latency=latency)
+	mean = sum(map(lambda _: sim_l.sample_latency(rng), range(100))) / 100
+	assert(1.5 < mean < 2.5)
+ensure_failing(exp_backend.SimBackend, {"dist": "exponential"})
+for latency in [{"dist": "lognormal", "mean": 0, "sd": 0.1}, {"dist": "normal", "mean": 1, "sd": -1}, {"dist": "uniform", "min": 2, "max": 1},
+                {"dist": "fixed", "value": -1}, {"dist": "fixed", "value": "1"}, {"dist": "normal", "mean": 1}]:
+	ensure_failing(exp_backend.SimBackend, latency)
+ensure_failing(exp_backend.get_backend, "sim", '{"latency": {"dist": "lognormal", "mean": 0, "sd": 0}}')
+ensure_failing(exp_backend.SimBackend, None, {"failure": -0.5})
+ensure_failing(exp_backend.SimBackend, None, {"failure": 0.6, "timeout": 0.6})
+ensure_failing(exp_backend.SimBackend, None, {"crash": 0.1})
+ensure_failing(exp_backend.get_backend, "board", "{}")
+
+
+# all successful
+# ======================================================================================================================
+print()
+print("All tests finished successfully.")
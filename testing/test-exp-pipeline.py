@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+
+import logging
+import time
+import threading
+
+import logsdb as ldb
+import progplatform
+import exp_runner
+import exp_pipeline
+import exp_finder
+
+# raise the logging level
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+
+# helper function to check failing cases
+def ensure_failing(f, *a):
+	try_fin = False
+	try:
+		f(*a)
+		try_fin = True
+	except Exception as e:
+		print(e)
+	assert(not try_fin)
+
+
+# start with testing procedure
+# ======================================================================================================================
+
+# stand-ins for the builds and progplatform copies, no make
+# experiment 3 fails to build and experiment 4 is in the build cache already
+started = []
+release = threading.Event()
+def build_experiment(exp, progplat, board_type, build_cache, branchname = None):
+	started.append(exp)
+	release.wait()
+	if exp == 3:
+		raise Exception("build failed")
+	return exp != 4
+
+class TestExp(int):
+	def get_exp_id(self):
+		return int(self)
+	def get_inputs(self):
+		return {}
+	def get_prog(self):
+		return None
+
+db_file = "data/testing_pipeline.db"
+if os.path.isfile(db_file):
+	os.remove(db_file)
+
+# the experiment iterator is created for the connection of the feeder
+iter_dbs = []
+def exp_iter_fun(db):
+	iter_dbs.append(db)
+	return exp_finder.NonPollingListIterator(list(map(TestExp, range(1, 11))))
+
+orig = (exp_runner.build_experiment, progplatform.copy_to_temp_dir)
+exp_runner.build_experiment = build_experiment
+progplatform.copy_to_temp_dir = lambda progplat, name: name
+
+
+# test the build pipeline (order, bounded look-ahead, failing builds)
+# ======================================================================================================================
+try:
+	pipeline = exp_pipeline.BuildPipeline(exp_iter_fun, db_file, None, "rpi3", None, n_workers=2, lookahead=3)
+	time.sleep(0.1)
+	# two builds running, three waiting in the look-ahead, one in the feeder
+	assert(sorted(started) == [1, 2])
+	assert(pipeline.q.qsize() == 3)
+	assert(iter_dbs[0].shared_threads)
+	# the progress counts the experiments taken from the pipeline
+	assert(pipeline.exp_iter.get_iterinfo() == (0, 4, 10))
+	assert(pipeline.get_iterinfo() == (0, 0, 10))
+
+	release.set()
+	exps = []
+	for exp in pipeline:
+		pipeline.wait_build(exp)
+		exps.append(exp)
+		assert(pipeline.get_iterinfo() == (0, len(exps), 10))
+	pipeline.close()
+	assert(not pipeline.feeder.is_alive())
+
+	# all experiments in order, each built once
+	assert(exps == list(range(1, 11)))
+	assert(sorted(started) == exps)
+	assert((pipeline.n_built, pipeline.n_cached, pipeline.n_failed) == (8, 1, 1))
+	ensure_failing(next, pipeline)
+
+	# closing stops a feeder that waits for free places in the look-ahead
+	started.clear()
+	pipeline = exp_pipeline.BuildPipeline(exp_iter_fun, db_file, None, "rpi3", None, n_workers=1, lookahead=1)
+	next(pipeline)
+	time.sleep(0.1)
+	pipeline.close()
+	assert(not pipeline.feeder.is_alive())
+finally:
+	(exp_runner.build_experiment, progplatform.copy_to_temp_dir) = orig
+
+
+# all successful
+# ======================================================================================================================
+print()
+print("All tests finished successfully.")
@@ -206,7 +206,7 @@ def initial_readonly_db_tests(db):
 	ensure_failing(db.add_tablerecord, ldb.TR_db_meta(id=None, kind="arbitraryfreshvalue", name='anotherfresh123', value='111'))
 	# but it allows standard query functions
 	_db_meta_ver_1 = db.get_tablerecord_matches(ldb.get_empty_TableRecord("db_meta")._replace(id=0))
-	assert(_db_meta_ver_1 == [ldb.TR_db_meta(id=0, kind='logsdb', name='version', value='1')])
+	assert(_db_meta_ver_1 == [ldb.TR_db_meta(id=0, kind='logsdb', name='version', value=ldb.db_version)])
 
 	print("=" * 40)
 	print(db.to_string(True))
@@ -282,14 +282,53 @@ input_ro_q_p  = {"type": "match_simple",
                  "query": {"table": "db_meta",
                            "values": {"id": 0}}}
 input_ro_q_p_ret = run_db_interface_py("query", input_ro_q_p, read_only=True)
-input_ro_q_p_expect = (True, {'fields': ['id', 'kind', 'name', 'value'], 'rows': [[0, 'logsdb', 'version', '1']]})
+input_ro_q_p_expect = (True, {'fields': ['id', 'kind', 'name', 'value'], 'rows': [[0, 'logsdb', 'version', ldb.db_version]]})
 assert(input_ro_q_p_ret == input_ro_q_p_expect)
 
+# and projections to selected columns
+input_ro_q_p2 = {"type": "match_simple",
+                 "query": {"table": "db_meta",
+                           "values": {"id": 0},
+                           "fields": ["name", "value"]}}
+input_ro_q_p2_ret = run_db_interface_py("query", input_ro_q_p2, read_only=True)
+input_ro_q_p2_expect = (True, {'fields': ['name', 'value'], 'rows': [['version', ldb.db_version]]})
+assert(input_ro_q_p2_ret == input_ro_q_p2_expect)
+input_ro_q_p2["query"]["fields"] = ["nonexisting"]
+assert(run_db_interface_py("query", input_ro_q_p2, "field 'nonexisting' is not in", read_only=True) == ret_failure)
+
+# join-based queries with json encoded query expressions
+input_ro_q_j  = {"type": "join_based",
+                 "query": {"table": "exp_progs",
+                           "joins": [["exp_progs_lists_entries", 0], ["exp_progs_lists", 1]],
+                           "query_exp": {"bin": "EQ", "arg1": {"ref": [2, "name"]}, "arg2": {"const": "holbarun_1"}},
+                           "order_by": [[0, "id", False]]}}
+with ldb.LogsDB(db_file, read_only=True) as db:
+	exp_j = ldb.QE_Bin(op=ldb.QE_Bop.EQ, arg1=ldb.QE_Ref(index=2, field="name"), arg2=ldb.QE_Const(value="holbarun_1"))
+	progs_j = db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, order_by = [(0, "id", False)])
+	assert(len(progs_j) == 3)
+input_ro_q_j_ret = run_db_interface_py("query", input_ro_q_j, read_only=True)
+input_ro_q_j_expect = (True, {'fields': ['id', 'arch', 'code'], 'rows': list(map(list, progs_j))})
+assert(input_ro_q_j_ret == input_ro_q_j_expect)
+input_ro_q_j["query"]["query_exp"] = {"not": {"bin": "IN", "arg1": {"ref": [2, "name"]}, "arg2": {"const": ["holbarun_2", "holbarun_3"]}}}
+input_ro_q_j["query"]["fields"] = ["id"]
+input_ro_q_j["query"]["limit"] = 2
+input_ro_q_j["query"]["offset"] = 1
+input_ro_q_j_ret = run_db_interface_py("query", input_ro_q_j, read_only=True)
+input_ro_q_j_expect = (True, {'fields': ['id'], 'rows': list(map(lambda x: [x.id], progs_j[1:3]))})
+assert(input_ro_q_j_ret == input_ro_q_j_expect)
+input_ro_q_j["query"]["count_only"] = True
+input_ro_q_j_ret = run_db_interface_py("query", input_ro_q_j, read_only=True)
+assert(input_ro_q_j_ret == (True, 2))
+input_ro_q_j["query"]["query_exp"] = {"bin": "XOR", "arg1": {"const": 1}, "arg2": {"const": 1}}
+assert(run_db_interface_py("query", input_ro_q_j, "unknown binary operator: XOR", read_only=True) == ret_failure)
+input_ro_q_j["query"]["query_exp"] = {"ref": [0]}
+assert(run_db_interface_py("query", input_ro_q_j, "reference must be a pair", read_only=True) == ret_failure)
+
 # query something with all columns
 input_ro_q_1  = {"type": "sql",
                  "query": {"sql": "select * from db_meta where id = 0"}}
 input_ro_q_1_ret = run_db_interface_py("query", input_ro_q_1, read_only=True)
-input_ro_q_1_expect = (True, {'fields': ['id', 'kind', 'name', 'value'], 'rows': [[0, 'logsdb', 'version', '1']]})
+input_ro_q_1_expect = (True, {'fields': ['id', 'kind', 'name', 'value'], 'rows': [[0, 'logsdb', 'version', ldb.db_version]]})
 assert(input_ro_q_1_ret == input_ro_q_1_expect)
 # query something with one column only
 input_ro_q_2  = {"type": "sql",
@@ -456,6 +495,9 @@ print(prog_l_progs)
 (_, prog_l_progs_0) = prog_l_progs[0]
 assert(prog_l_progs_0 == program.Program(db, prog_l_progs_0.get_prog_id()))
 
+assert(prog_list.count() == len(prog_list.get_entry_ids()))
+assert(logslist.LogsList(db, "prog", prog_list.get_logslist_id()).count() == len(prog_list.get_entry_ids()))
+
 print("\nexps")
 exp_lists = logslist.LogsList._get_all(db, "exp")
 assert(logslist.LogsList(db, "exp", 1) == exp_lists[0])
@@ -467,6 +509,10 @@ exp_l_exps = exp_list.get_entries()
 print(exp_l_exps)
 (_, exp_l_exps_0) = exp_l_exps[0]
 assert(exp_l_exps_0 == experiment.Experiment(db, exp_l_exps_0.get_exp_id()))
+# incremental access by list index
+exp_l_exps_sorted = sorted(exp_l_exps, key=lambda x: x[0])
+assert(exp_list.get_entries_after(exp_l_exps_sorted[0][0]) == exp_l_exps_sorted[1:])
+assert(exp_list.get_entries_after(exp_l_exps_sorted[-1][0]) == [])
 
 print("\nexp")
 (_, exp) = exp_l_exps[3]
@@ -500,9 +546,534 @@ run_data = exp.get_run_data(run_id)
 print(run_data)
 
 
+# test bulk insertion
+# ======================================================================================================================
+bulk_list = db.add_tablerecord(ldb.get_empty_TableRecord("exp_progs_lists")._replace(name="bulk_list"))
+bulk_progs = db.add_tablerecords([ldb.get_empty_TableRecord("exp_progs")._replace(arch="bulkarch", code=f"bulk code {i}") for i in range(25)], read_back=True, batch_size=10)
+assert(len(bulk_progs) == 25)
+assert(bulk_progs == list(map(lambda x: db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs")._replace(id=x.id))[0], bulk_progs)))
+bulk_recs = []
+for (i, p) in enumerate(bulk_progs):
+	bulk_recs.append(ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=bulk_list.id, exp_progs_id=p.id, list_index=i))
+	bulk_recs.append(ldb.TR_exp_progs_meta(exp_progs_id=p.id, kind="bulk", name="", value=None if i % 2 == 0 else str(i)))
+bulk_progress = []
+assert(db.add_tablerecords(bulk_recs, batch_size=20, progress=lambda n, t, _: bulk_progress.append((n, t))) == 50)
+assert(bulk_progress == [(20, 50), (40, 50), (50, 50)])
+assert(logslist.LogsList(db, "prog", bulk_list.id).get_entry_ids() == list(map(lambda x: (x[0], x[1].id), enumerate(bulk_progs))))
+# the id cannot be forced without allow_id
+ensure_failing(db.add_tablerecords, [bulk_progs[0]._replace(code="other bulk code")])
+# a failing batch is not added at all
+ensure_failing(db.add_tablerecords, [ldb.TR_exp_progs_lists_entries(exp_progs_lists_id=bulk_list.id, exp_progs_id=bulk_progs[0].id, list_index=100), bulk_recs[0]])
+assert(len(logslist.LogsList(db, "prog", bulk_list.id).get_entry_ids()) == 25)
+
+
 # test backup
 # ======================================================================================================================
 db.backup()
+db.close()
+
+
+# test upgrade of a version 1 database
+# ======================================================================================================================
+def get_index_names(db_file):
+	import sqlite3
+	con = sqlite3.connect(db_file)
+	names = set(map(lambda x: x[0], con.execute("SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'IX_%'").fetchall()))
+	con.close()
+	return names
+db_file_upgr = "data/testing_upgrade.db"
+if os.path.isfile(db_file_upgr):
+	os.remove(db_file_upgr)
+if os.path.isdir(db_file_upgr + ".backups"):
+	import shutil
+	shutil.rmtree(db_file_upgr + ".backups")
+with ldb.LogsDB(db_file_upgr) as db:
+	pass
+indexes_cur = get_index_names(db_file_upgr)
+assert(len(indexes_cur) > 0)
+# downgrade by hand (tables added after version 1, then the remaining indexes)
+import sqlite3
+con = sqlite3.connect(db_file_upgr)
+with con:
+	for t in ["exp_exps_queue", "exp_exps_latest"]:
+		con.execute(f"DROP TABLE {t}")
+	for ix in indexes_cur:
+		con.execute(f"DROP INDEX IF EXISTS {ix}")
+	con.execute("UPDATE db_meta SET value = '1' WHERE id = 0")
+con.close()
+# read-only mode cannot upgrade, and cannot read without the table of the latest runs
+ensure_failing(lambda: ldb.LogsDB(db_file_upgr, read_only=True).connect())
+assert(get_index_names(db_file_upgr) == set())
+# no automatic migration if not desired, dry run does not change anything
+with ldb.LogsDB(db_file_upgr, auto_migrate=False) as db:
+	assert(db.version == "1")
+	db.migrate(dry_run=True)
+	assert(db.version == "1")
+assert(get_index_names(db_file_upgr) == set())
+assert(os.listdir(db_file_upgr + ".backups") == [])
+# write mode upgrades in place
+with ldb.LogsDB(db_file_upgr) as db:
+	assert(db.get_tablerecord_matches(ldb.get_empty_TableRecord("db_meta")._replace(id=0))[0].value == ldb.db_version)
+assert(get_index_names(db_file_upgr) == indexes_cur)
+# a backup was taken before migrating
+assert(len(os.listdir(db_file_upgr + ".backups")) == 2)
+# the migration steps are idempotent
+import migrations
+with ldb.LogsDB(db_file_upgr) as db:
+	assert(migrations.migrate(db, "1", backup=False) == ldb.db_version)
+assert(get_index_names(db_file_upgr) == indexes_cur)
+
+
+# test streaming queries and projections
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	progs_all = db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs"))
+	assert(list(db.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs"), arraysize=3)) == progs_all)
+	progs_proj = list(db.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs"), fields=["id", "arch"]))
+	assert(progs_proj == list(map(lambda x: x._replace(code=None), progs_all)))
+	ensure_failing(lambda: list(db.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs"), fields=["input_data"])))
+	# early termination
+	progs_iter = db.iter_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs"), arraysize=2)
+	assert(next(progs_iter) == progs_all[0])
+	progs_iter.close()
+	exp_q = ldb.QE_Bin(op=ldb.QE_Bop.LIKE, arg1=ldb.QE_Ref(index=0, field="code"), arg2=ldb.QE_Const(value="crazy%"))
+	progs_q = db.get_tablerecords("exp_progs", [], exp_q, order_by = [(0, "id", False)])
+	assert(list(db.iter_tablerecords("exp_progs", [], exp_q, order_by = [(0, "id", False)], arraysize=1)) == progs_q)
+	assert(list(db.iter_tablerecords("exp_progs", [], exp_q, order_by = [(0, "id", False)], fields=["code"])) == list(map(lambda x: x._replace(id=None, arch=None), progs_q)))
+	# projections on joins, distinct only operates on the selected columns
+	exp_j = ldb.QE_Bin(op=ldb.QE_Bop.LIKE, arg1=ldb.QE_Ref(index=2, field="name"), arg2=ldb.QE_Const(value="holbarun_%"))
+	progs_j = db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, order_by = [(0, "id", True)])
+	progs_j_proj = db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, order_by = [(0, "id", True)], fields=["id"])
+	assert(progs_j_proj == list(map(lambda x: x._replace(arch=None, code=None), progs_j)))
+	arch_j = db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, fields=["arch"])
+	assert(len(arch_j) == len(set(map(lambda x: x.arch, progs_j))))
+	assert(db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, count_only=True, fields=["arch"]) == len(arch_j))
+	ensure_failing(db.get_tablerecords, "exp_progs", [], exp_q, [], True, False, ["input_data"])
+	ensure_failing(db.get_tablerecords, "exp_progs", [], exp_q, [], True, False, [])
+	# paging
+	assert(db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, order_by = [(0, "id", True)], limit=2) == progs_j[:2])
+	assert(db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, order_by = [(0, "id", True)], offset=1) == progs_j[1:])
+	assert(db.get_tablerecords("exp_progs", [("exp_progs_lists_entries", 0), ("exp_progs_lists", 1)], exp_j, count_only=True, limit=2, offset=len(progs_j) - 1) == 1)
+	ensure_failing(db.get_tablerecords, "exp_progs", [], exp_q, [], False, False, None, -1)
+	# experiments load missing fields on demand
+	exps_proj = list(experiment.Experiment._iter_all(db, fields=["id"]))
+	exps_full = experiment.Experiment._get_all(db)
+	assert(list(map(lambda x: x.exp.type, exps_proj)) == [None] * len(exps_full))
+	assert(list(map(lambda x: x.get_inputs(), exps_proj)) == list(map(lambda x: x.get_inputs(), exps_full)))
+	assert(exps_proj == exps_full)
+with ldb.LogsDB(db_file, read_only=True) as db:
+	assert(list(db.iter_tablerecords_sql("select kind from db_meta where id = 0")) == [["logsdb"]])
+
+
+# test connection profiles
+# ======================================================================================================================
+ensure_failing(ldb.LogsDB, db_file, False, True, "nonexistingprofile")
+with ldb.LogsDB(db_file, profile="batch-writer") as db:
+	pragmas = db.get_pragmas()
+	assert(pragmas["journal_mode"] == "wal")
+	assert(pragmas["cache_size"] == ldb.connection_profiles["batch-writer"]["cache_size"])
+	assert(pragmas["foreign_keys"] == 1)
+	assert("Pragmas (profile: batch-writer): journal_mode=wal" in db.to_string())
+	# readers are not blocked by an open write transaction
+	db.con.execute("BEGIN IMMEDIATE")
+	db.con.execute("UPDATE db_meta SET value = value WHERE id = 0")
+	with ldb.LogsDB(db_file, read_only=True, profile="reader") as db_r:
+		assert(db_r.get_pragmas()["journal_mode"] == "wal")
+		assert(db_r.get_tablerecord_matches(ldb.get_empty_TableRecord("db_meta")._replace(id=0))[0].value == ldb.db_version)
+	db.con.rollback()
+
+
+# the journal mode of a shared database is changed back only without other open connections
+with ldb.LogsDB(db_file, profile="batch-writer") as db:
+	ensure_failing(ldb.LogsDB(db_file, profile="shared-writer").connect)
+with ldb.LogsDB(db_file, profile="shared-writer") as db:
+	assert(db.get_pragmas()["journal_mode"] == "delete")
+
+
+# test batched operations of db-interface.py (one transaction, references to results of earlier steps)
+# ======================================================================================================================
+input_b_prog = {"op": "create", "args": {"table": "exp_progs", "values": {"arch": "arm8", "code": "batch code 1"}, "id_only": True}}
+input_b      = {"ops": [
+                 input_b_prog,
+                 {"op": "create", "args": {"table": "exp_progs_lists_entries", "values": {"exp_progs_lists_id": 3, "exp_progs_id": {"$ref": [0, "id"]}, "list_index": 1000}}},
+                 {"op": "create", "args": {"table": "exp_progs_meta", "values": {"exp_progs_id": {"$ref": [0, "id"]}, "kind": "batch", "name": "note", "value": "a"}}},
+                 {"op": "append", "args": {"table": "exp_progs_meta", "values": {"exp_progs_id": {"$ref": [0, "id"]}, "kind": "batch", "name": "note", "value": "b"}}},
+                 {"op": "query",  "args": {"type": "match_simple", "query": {"table": "exp_progs_meta", "values": {"exp_progs_id": {"$ref": [0, "id"]}}, "fields": ["value"]}}}
+                 ]}
+input_b_ret  = run_db_interface_py("batch", input_b)
+assert(input_b_ret[0])
+b_prog_id    = input_b_ret[1][0]["id"]
+assert(input_b_ret[1][1] == {"exp_progs_lists_id": 3, "exp_progs_id": b_prog_id, "list_index": 1000})
+assert(input_b_ret[1][4] == {"fields": ["value"], "rows": [["ab"]]})
+# all or nothing, the program of the failing batch is not created
+input_b_f    = {"ops": [
+                 {"op": "create", "args": {"table": "exp_progs", "values": {"arch": "arm8", "code": "batch code 2"}, "id_only": True}},
+                 input_b_prog
+                 ]}
+assert(run_db_interface_py("batch", input_b_f, "batch step 1 (create) failed") == ret_failure)
+input_b_q    = {"type": "match_simple", "query": {"table": "exp_progs", "values": {"code": "batch code 2"}}}
+assert(run_db_interface_py("query", input_b_q, read_only=True) == (True, {"fields": ["id", "arch", "code"], "rows": []}))
+input_b_f    = {"ops": [{"op": "query", "args": input_b_q}, {"op": "query", "args": {"type": "match_simple", "query": {"table": "exp_progs", "values": {"id": {"$ref": [1, "id"]}}}}}]}
+assert(run_db_interface_py("batch", input_b_f, "reference to step 1 which is not executed before") == ret_failure)
+with ldb.LogsDB(db_file) as db:
+	# nested transactions only commit with the outermost one
+	def add_in_transactions(codes):
+		with db.transaction():
+			db.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code=codes[0]))
+			with db.transaction():
+				for code in codes[1:]:
+					db.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code=code))
+			assert(db.tr_depth == 1)
+	ensure_failing(add_in_transactions, ["nested code 1", "nested code 2", "batch code 1"])
+	assert(db.tr_depth == 0)
+	assert(db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs")._replace(code="nested code 1"), count_only=True) == 0)
+	add_in_transactions(["nested code 1", "nested code 2"])
+	assert(db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs")._replace(arch="arm8"), count_only=True) >= 3)
+	# transactions of threads sharing the connection do not mix
+	import threading
+	with ldb.LogsDB(db_file, shared_threads=True) as db_s:
+		def add_in_transactions_s(t):
+			for i in range(20):
+				with db_s.transaction():
+					with db_s.transaction():
+						db_s.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code=f"thread code {t} {i}"))
+					assert(db_s.tr_depth == 1)
+		tr_threads = list(map(lambda t: threading.Thread(target=add_in_transactions_s, args=(t,)), range(4)))
+		for t in tr_threads:
+			t.start()
+		for t in tr_threads:
+			t.join()
+		assert(db_s.tr_depth == 0)
+	assert(len(list(filter(lambda p: p.code.startswith("thread code"), db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs")._replace(arch="arm8"))))) == 80)
+	# group of operations in one transaction, the failing one is rolled back alone
+	group_results = db.transaction_group([lambda: db.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code="group code 1")).code,
+	                                      lambda: db.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code="nested code 1")),
+	                                      lambda: db.add_tablerecord(ldb.TR_exp_progs(id=None, arch="arm8", code="group code 2")).code])
+	assert(list(map(lambda x: x[0], group_results)) == ["group code 1", None, "group code 2"])
+	assert(group_results[1][1] != None)
+	assert(db.tr_depth == 0 and not db.con.in_transaction)
+	assert(db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_progs")._replace(code="nested code 1"), count_only=True) == 1)
+
+
+# test continuous i/o mode of db-interface.py (connections are kept open between requests)
+# ======================================================================================================================
+def run_db_interface_py_cio(reqs, term_string = "__END__", verbose = False):
+	from subprocess import Popen, PIPE
+	import json
+	p = Popen(["./scripts/db-interface.py", "-ts", term_string, "cio"] + (["-v"] if verbose else []), stdout=PIPE, stdin=PIPE, stderr=PIPE)
+	data_in = "".join(map(lambda r: json.dumps(r) + "\n" + term_string + "\n", reqs))
+	data_out, data_err = p.communicate(input=data_in.encode("utf-8"), timeout=30)
+	assert(p.returncode == 0)
+	resps = data_out.decode("utf-8").split("\n" + term_string + "\n")
+	assert(resps[-1] == "")
+	return (list(map(json.loads, resps[:-1])), data_err.decode("utf-8"))
+
+def mk_cio_req(op, args, is_read_only):
+	return {"op": op, "args": args, "is_testing": True, "is_read_only": is_read_only}
+
+cio_q_list = {"type": "match_simple", "query": {"table": "exp_progs_lists", "values": {"name": "cio_list"}, "fields": ["name"]}}
+cio_c_list = {"table": "exp_progs_lists", "values": {"name": "cio_list"}}
+(cio_resps, cio_err) = run_db_interface_py_cio([
+  mk_cio_req("query",  cio_q_list, True),
+  mk_cio_req("create", cio_c_list, False),
+  mk_cio_req("create", cio_c_list, False),
+  mk_cio_req("query",  cio_q_list, True),
+  mk_cio_req("create", {"table": "exp_progs_lists", "values": {"name": "cio_list_2"}, "id_only": True}, False)
+  ], verbose=True)
+assert(cio_resps[0] == {"result": {"fields": ["name"], "rows": []}})
+assert(cio_resps[1]["result"]["name"] == "cio_list")
+assert("UNIQUE constraint failed" in cio_resps[2]["traceback"])
+assert(cio_resps[3] == {"result": {"fields": ["name"], "rows": [["cio_list"]]}})
+# the connections are kept after errors of the operations
+assert(cio_resps[4]["result"]["id"] == cio_resps[1]["result"]["id"] + 1)
+assert(cio_err.count("opening db connection for (True, False)") == 1)
+assert("query: 2 requests, 0 errors" in cio_err)
+assert("create: 3 requests, 1 errors" in cio_err)
+
+
+# test server mode of db-interface.py (concurrent clients, one writer with group commits, pool of readers)
+# ======================================================================================================================
+def test_db_interface_server():
+	from subprocess import Popen, PIPE
+	import socket
+	import threading
+	import json
+	import time
+	socket_path = "data/testing-db-interface.sock"
+	p = Popen(["./scripts/db-interface.py", "-s", socket_path, "server"], stderr=PIPE)
+	for i in range(100):
+		if os.path.exists(socket_path):
+			break
+		time.sleep(0.1)
+	try:
+		# concurrent clients on the socket, each with its own termination string
+		def run_client(k, results):
+			term_string = f"__END_{k}__"
+			with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+				sock.connect(socket_path)
+				sock_r = sock.makefile("r", encoding="utf-8")
+				sock_w = sock.makefile("w", encoding="utf-8")
+				sock_w.write(term_string + "\n")
+				for i in range(10):
+					req = mk_cio_req("create", {"table": "exp_progs", "values": {"arch": "arm8", "code": f"server code {k} {i}"}, "id_only": True}, False)
+					sock_w.write(json.dumps(req) + "\n" + term_string + "\n")
+					sock_w.flush()
+					lines = []
+					while True:
+						line = sock_r.readline()
+						if line == term_string + "\n":
+							break
+						lines.append(line)
+					results.append(json.loads("".join(lines)))
+		srv_results = []
+		srv_threads = list(map(lambda k: threading.Thread(target=run_client, args=(k, srv_results)), range(8)))
+		for t in srv_threads:
+			t.start()
+		for t in srv_threads:
+			t.join()
+		assert(len(srv_results) == 80)
+		assert(len(set(map(lambda r: r["result"]["id"], srv_results))) == 80)
+
+		# the client shim speaks the cio protocol
+		srv_q = {"type": "match_simple", "query": {"table": "exp_progs", "values": {"code": "server code 3 7"}, "fields": ["code"]}}
+		p_c = Popen(["./scripts/db-interface.py", "-s", socket_path, "-ts", "__END__", "client"], stdin=PIPE, stdout=PIPE)
+		reqs = [mk_cio_req("query", srv_q, True),
+		        mk_cio_req("create", {"table": "exp_progs", "values": {"arch": "arm8", "code": "server code 3 7"}}, False),
+		        mk_cio_req("create", {"table": "exp_progs", "values": {"arch": "arm8", "code": "server code shim"}, "id_only": True}, False)]
+		data_in = "".join(map(lambda r: json.dumps(r) + "\n__END__\n", reqs))
+		(data_out, _) = p_c.communicate(input=data_in.encode("utf-8"), timeout=30)
+		assert(p_c.returncode == 0)
+		resps = list(map(json.loads, data_out.decode("utf-8").split("\n__END__\n")[:-1]))
+		assert(resps[0] == {"result": {"fields": ["code"], "rows": [["server code 3 7"]]}})
+		# a failing request does not affect the other requests in the same group commit
+		assert("UNIQUE constraint failed" in resps[1]["traceback"])
+		assert(resps[2]["result"]["id"] == max(map(lambda r: r["result"]["id"], srv_results)) + 1)
+	finally:
+		p.terminate()
+		(_, data_err) = p.communicate(timeout=30)
+	assert(p.returncode == 0)
+	assert(not os.path.exists(socket_path))
+	assert("create: 82 requests, 1 errors" in data_err.decode("utf-8"))
+	assert("group commits:" in data_err.decode("utf-8"))
+test_db_interface_server()
+
+
+# test the work queue with leases
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	import exp_finder
+	q_exp_ids = list(map(lambda x: x.get_exp_id(), experiment.Experiment._get_all(db)))[:3]
+	assert(len(q_exp_ids) == 3)
+	q_spec = "queue_test_spec"
+	assert(db.queue_add(q_exp_ids, q_spec) == 3)
+	assert(db.queue_add(q_exp_ids, q_spec) == 0)
+	# claims do not overlap
+	q_c1 = db.queue_claim(q_spec, "w1", 100, n=2)
+	q_c2 = db.queue_claim(q_spec, "w2", 100, n=2)
+	assert(list(map(lambda x: x.exp_exps_id, q_c1)) == q_exp_ids[:2])
+	assert(list(map(lambda x: x.exp_exps_id, q_c2)) == q_exp_ids[2:])
+	assert(db.queue_claim(q_spec, "w3", 100) == [])
+	assert(all(map(lambda x: x.attempts == 1 and x.completed == 0, q_c1 + q_c2)))
+	# only the owner can renew and complete
+	assert(db.queue_renew(q_c1, "w2", 100) == [])
+	assert(db.queue_renew(q_c1, "w1", 100) == q_c1)
+	assert(db.queue_complete(q_c1[:1], "w1") == q_c1[:1])
+	assert(db.queue_complete(q_c1[:1], "w1") == [])
+	# released and expired leases can be claimed again
+	assert(db.queue_release(q_c1[1:], "w1") == q_c1[1:])
+	assert(db.queue_renew(q_c2, "w2", -1) == q_c2)
+	q_c3 = db.queue_claim(q_spec, "w3", 100, n=5)
+	assert(sorted(map(lambda x: x.exp_exps_id, q_c3)) == q_exp_ids[1:])
+	assert(all(map(lambda x: x.attempts == 2, q_c3)))
+	assert(db.queue_complete(q_c2, "w2") == [])
+	assert(db.queue_release(q_c3, "w3") == q_c3)
+	assert(db.queue_claim(q_spec, "w3", 100, max_attempts=2) == [])
+	# the iterator claims one after the other and stops when nothing is left to run
+	q_iter = exp_finder.QueueIterator(db, q_spec, "w4", lease_time=100, max_attempts=3, poll_time=0)
+	q_iter_exps = []
+	for exp in q_iter:
+		q_iter_exps.append(exp.get_exp_id())
+		q_iter.report(exp, len(q_iter_exps) != 1)
+	q_iter.close()
+	# the first experiment failed in its last attempt
+	assert(q_iter_exps == q_exp_ids[1:])
+	q_entries = db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_queue")._replace(run_spec=q_spec))
+	assert(list(map(lambda x: (x.attempts, x.completed, x.lease_owner), sorted(q_entries))) == [(1, 1, None), (3, 0, None), (3, 1, None)])
+
+
+# test incremental polling with high-water mark
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	import exp_finder
+	exps_all = experiment.Experiment._get_all(db)
+	exp_ids_all = sorted(map(lambda x: x.get_exp_id(), exps_all))
+	assert(list(map(lambda x: x.get_exp_id(), experiment.Experiment._iter_all(db, min_id=exp_ids_all[1]))) == exp_ids_all[2:])
+	exp_lt = ldb.QE_Bin(op=ldb.QE_Bop.LT, arg1=ldb.QE_Ref(index=0, field="id"), arg2=ldb.QE_Const(value=exp_ids_all[2]))
+	assert(db.get_tablerecords("exp_exps", [], exp_lt, order_by=[(0, "id", True)], id_only=True) == list(map(lambda x: ldb.TR_id_only(id=x), exp_ids_all[:2])))
+
+	# keys appear over time, key 2 is returned but incomplete after its first run (found again by a full rescan only)
+	poll_calls = []
+	poll_runs = {}
+	def poll_genfun(min_key = None):
+		poll_calls.append(min_key)
+		keys = [1, 2, 3] + ([4] if len(poll_calls) >= 3 else [])
+		keys = list(filter(lambda k: min_key == None or k > min_key, keys))
+		todo = list(filter(lambda k: poll_runs.get(k, 0) < (2 if k == 2 else 1), keys))
+		for k in todo:
+			poll_runs[k] = poll_runs.get(k, 0) + 1
+		return (max(keys, default=min_key), todo)
+	poll_iter = exp_finder.PollingIterator(poll_genfun, {}, poll_max_rounds=2, poll_round_time=0.04, incremental=True, poll_min_time=0.01)
+	assert(list(poll_iter) == [1, 2, 3, 4, 2])
+	# full scan, increments with backoff 0.01, 0.02, 0.04 and a full rescan at the cap
+	assert(poll_calls[:7] == [None, 3, 3, 4, 4, 4, None])
+	assert(poll_calls[-1] == None)
+
+
+# test asynchronous result writer
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	import result_writer
+	import exprun as exprun_mod
+	exps_w = experiment.Experiment._get_all(db)[:2]
+	erun_w1 = exprun_mod.ExpRun._create(db, "writer1")
+	erun_w2 = exprun_mod.ExpRun._create(db, "writer2")
+	w_spec = "writerbranch.rpi3"
+	w_data = {"output_uart": "same", "result": [True]}
+	w_mismatches = []
+	with result_writer.ResultWriter(db_file, on_mismatch=lambda e, _: w_mismatches.append(e.get_exp_id())) as w:
+		w_f1 = list(map(lambda e: w.submit(e, erun_w1, w_spec, w_data), exps_w))
+		w_f2 = [w.submit(exps_w[0], erun_w2, w_spec, w_data),
+		        w.submit(exps_w[1], erun_w2, w_spec, {"output_uart": "different", "result": [True]}),
+		        w.submit(exps_w[0], erun_w2, "invalid_run_spec", w_data)]
+	assert(list(map(lambda f: f.result(), w_f1 + w_f2[:2])) == [True, True, True, False])
+	assert(w_f2[2].exception() != None)
+	assert(w_mismatches == [exps_w[1].get_exp_id()])
+	assert((w.n_runs, w.n_mismatches, w.n_failures) == (4, 1, 1))
+	# only new or differing runs are stored
+	assert(len(experiment.Experiment(db, exps_w[0].get_exp_id()).get_run_ids(w_spec)) == 1)
+	assert(len(experiment.Experiment(db, exps_w[1].get_exp_id()).get_run_ids(w_spec)) == 2)
+	ensure_failing(w.submit, exps_w[0], erun_w1, w_spec, w_data)
+	# a failing mismatch callback does not stop the writer
+	def w_failing_cb(e, spec):
+		raise Exception("failing callback")
+	erun_w3 = exprun_mod.ExpRun._create(db, "writer3")
+	with result_writer.ResultWriter(db_file, on_mismatch=w_failing_cb) as w:
+		w_f3 = [w.submit(exps_w[1], erun_w3, w_spec, w_data),
+		        w.submit(exps_w[0], erun_w3, w_spec, w_data)]
+		assert(list(map(lambda f: f.result(timeout=10), w_f3)) == [False, True])
+		assert(w.thread.is_alive())
+	assert((w.n_runs, w.n_mismatches, w.n_failures) == (2, 1, 0))
+
+
+# test bulk preloading of programs and metadata (constant number of queries instead of one per experiment)
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	import logslist
+	import exprun as exprun_mod
+	# runs of a second run_spec
+	pl_erun = exprun_mod.ExpRun._create(db, "preload")
+	experiment.Experiment._get_all(db)[-1].write_new_run(pl_erun, "preloadbranch.rpi3", {"output_uart": "p", "result": True})
+	pl_queries = []
+	db.con.set_trace_callback(pl_queries.append)
+	def pl_run_info(e, spec):
+		run_id = e.get_latest_run_id(spec)
+		return (sorted(e.get_all_run_ids()), e.get_run_specs(), run_id, None if run_id == None else e.get_run_data(run_id), e.get_prog())
+	pl_specs = ["writerbranch.rpi3", "preloadbranch.rpi3"]
+	pl_exps = experiment.Experiment._get_all(db)
+	pl_expected = list(map(lambda e: list(map(lambda spec: pl_run_info(experiment.Experiment(db, e.get_exp_id()), spec), pl_specs)), pl_exps))
+	assert(any(map(lambda x: x[0][2] != None, pl_expected)) and any(map(lambda x: x[1][2] != None, pl_expected)))
+	# all metadata
+	pl_queries.clear()
+	experiment.Experiment.preload_progs(db, experiment.Experiment.preload_metadata(db, pl_exps, chunk_size=3), chunk_size=3)
+	assert(len(pl_queries) == 2 * ((len(pl_exps) + 2) // 3))
+	pl_queries.clear()
+	assert(list(map(lambda e: list(map(lambda spec: pl_run_info(e, spec), pl_specs)), pl_exps)) == pl_expected)
+	assert(pl_queries == [])
+	# only the runs of one run_spec, other metadata is loaded on demand
+	pl_exps = list(experiment.Experiment.iter_preloaded(db, experiment.Experiment._iter_all(db), name_prefix=experiment._mk_run_meta_prefix("preloadbranch.rpi3"), chunk_size=4))
+	pl_queries.clear()
+	assert(list(map(lambda e: (e.get_latest_run_id("preloadbranch.rpi3"), e.get_prog()), pl_exps)) == list(map(lambda x: (x[1][2], x[1][4]), pl_expected)))
+	assert(pl_queries == [])
+	assert(list(map(lambda e: sorted(e.get_all_run_ids()), pl_exps)) == list(map(lambda x: x[0][0], pl_expected)))
+	assert(len(pl_queries) == len(pl_exps))
+	# lists hydrate experiments and programs with a constant number of queries
+	pl_list = logslist.LogsList._get_by_name(db, "exp", "holbarun_1")
+	pl_queries.clear()
+	pl_entries = pl_list.get_entries(experiment._mk_run_meta_prefix("writerbranch.rpi3"))
+	pl_entries_after = pl_list.get_entries_after(min(map(lambda x: x[0], pl_entries)), "run.")
+	assert(len(pl_queries) == 8)
+	pl_queries.clear()
+	assert(list(map(lambda x: (x[1].get_prog().get_arch(), x[1].get_latest_run_id("writerbranch.rpi3")), pl_entries + pl_entries_after)) == list(map(lambda x: (x[1].get_prog().get_arch(), experiment.Experiment(db, x[1].get_exp_id()).get_latest_run_id("writerbranch.rpi3")), pl_entries + pl_entries_after)))
+	assert(len(pl_queries) == 2 * len(pl_entries + pl_entries_after))
+	assert(list(map(lambda x: x[1].get_exp_id(), pl_entries)) == list(map(lambda x: x[1], pl_list.get_entry_ids())))
+	db.con.set_trace_callback(None)
+
+
+# test the table of the latest runs (maintained when writing runs, rebuilt from the run metadata)
+# ======================================================================================================================
+with ldb.LogsDB(db_file) as db:
+	import subprocess
+	import exprun as exprun_mod
+	def lt_expected(specs):
+		res = {}
+		for e in experiment.Experiment._get_all(db):
+			for spec in specs:
+				run_id = e.get_latest_run_id(spec)
+				if run_id == None:
+					continue
+				run_data = e.get_run_data(run_id)
+				is_complete = experiment.Experiment.is_complete_run(run_data)
+				result_class = experiment._get_result_class(run_data["result"]) if is_complete else None
+				res[(e.get_exp_id(), spec)] = ldb.TR_exp_exps_latest(e.get_exp_id(), spec, run_id, 1 if is_complete else 0, result_class)
+		return res
+	def lt_table():
+		return dict(map(lambda x: ((x.exp_exps_id, x.run_spec), x), db.get_tablerecord_matches(ldb.get_empty_TableRecord("exp_exps_latest"))))
+	lt_spec = "latestbranch.rpi3"
+	lt_exps = experiment.Experiment._get_all(db)[:4]
+	lt_erun1 = exprun_mod.ExpRun._create(db, "latest1")
+	lt_erun2 = exprun_mod.ExpRun._create(db, "latest2")
+	lt_results = [True, False, "special :::: INCONCLUSIVE: 77", "embexp.board.exception :::: x"]
+	for (e, r) in zip(lt_exps, lt_results):
+		assert(e.write_new_run(lt_erun1, lt_spec, {"output_uart": "a", "result": r}))
+	# a later run changes the latest run, an earlier run id does not
+	assert(not experiment.Experiment(db, lt_exps[1].get_exp_id()).write_new_run(lt_erun2, lt_spec, {"output_uart": "a", "result": True}))
+	db.set_latest_run(lt_exps[1].get_exp_id(), lt_spec, f"{lt_spec}.0_earlier", True, "counterexample")
+	lt_latest = experiment.Experiment.get_latest_runs(db, lt_spec)
+	assert(list(map(lambda e: lt_latest[e.get_exp_id()].result_class, lt_exps)) == ["example", "example", "inconclusive", "exception"])
+	assert(lt_latest[lt_exps[1].get_exp_id()].run_id == f"{lt_spec}.{lt_erun2.get_name()}")
+	# the metadata and the latest run are written together
+	lt_set_latest_run = db.set_latest_run
+	def lt_failing(*a):
+		raise Exception("failing on purpose")
+	db.set_latest_run = lt_failing
+	ensure_failing(experiment.Experiment(db, lt_exps[0].get_exp_id()).write_new_run, lt_erun2, lt_spec, {"output_uart": "b", "result": False})
+	db.set_latest_run = lt_set_latest_run
+	assert(experiment.Experiment(db, lt_exps[0].get_exp_id()).get_run_ids(lt_spec) == [f"{lt_spec}.{lt_erun1.get_name()}"])
+	# the table agrees with the run metadata, also after rebuilding it (including incomplete runs)
+	db.add_tablerecord(ldb.TR_exp_exps_meta(lt_exps[3].get_exp_id(), "output_uart", f"run.{lt_spec}.9_incomplete", "c"))
+	db.set_latest_run(lt_exps[3].get_exp_id(), lt_spec, f"{lt_spec}.9_incomplete", False, None)
+	lt_specs = list(set(map(lambda x: x.run_spec, lt_table().values())))
+	assert(set(lt_specs) >= set([lt_spec, "writerbranch.rpi3", "preloadbranch.rpi3"]))
+	assert(lt_table() == lt_expected(lt_specs))
+	with db.transaction():
+		db.con.execute("DELETE FROM exp_exps_latest")
+	assert(db.rebuild_latest() == len(lt_expected(lt_specs)))
+	assert(lt_table() == lt_expected(lt_specs))
+	# lookups for some experiments and for lists
+	lt_ids = list(map(lambda e: e.get_exp_id(), lt_exps)) + [-1]
+	assert(experiment.Experiment.get_latest_runs(db, lt_spec, lt_ids, chunk_size=3) == dict(filter(lambda x: x[0] in lt_ids, experiment.Experiment.get_latest_runs(db, lt_spec).items())))
+	lt_list = logslist.LogsList._get_by_name(db, "exp", "holbarun_1")
+	lt_list_ids = list(map(lambda x: x[1], lt_list.get_entry_ids()))
+	assert(lt_list.get_latest_runs("writerbranch.rpi3") == experiment.Experiment.get_latest_runs(db, "writerbranch.rpi3", lt_list_ids))
+	assert(len(lt_list.get_latest_runs("writerbranch.rpi3")) > 0)
+	assert(lt_list.get_latest_runs("writerbranch.rpi3", max(map(lambda x: x[0], lt_list.get_entry_ids()))) == {})
+	# for the evaluation script
+	lt_hbr = db.get_tablerecord_matches(ldb.get_empty_TableRecord("holba_runs")._replace(exp_exps_lists_id=lt_list.get_logslist_id()))[0]
+	db.add_tablerecord(ldb.TR_holba_runs_meta(lt_hbr.id, "args", "args", "lt_args"))
+	lt_executed = set(map(lambda x: x.exp_exps_id, filter(lambda x: x.exp_exps_id in lt_list_ids and x.result_class in ["example", "counterexample", "inconclusive"], lt_table().values())))
+	assert(len(lt_executed) > 0)
+lt_eval = subprocess.run(["./scripts/db-eval.py", "--dbfile", db_file], capture_output=True, text=True, check=True).stdout
+assert(f"numexps withresult           = {len(lt_executed)}\n" in lt_eval)
 
 
 # all successful
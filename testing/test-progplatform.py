@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../lib"))
+
+import logging
+import tempfile
+import subprocess
+
+import progplatform
+
+# raise the logging level
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+
+
+# helper function to check failing cases
+def ensure_failing(f, *a):
+	try_fin = False
+	try:
+		f(*a)
+		try_fin = True
+	except Exception as e:
+		print(e)
+	assert(not try_fin)
+
+
+def git(repo_dir, *cmd):
+	subprocess.check_call(["git", "-C", repo_dir, "-c", "user.name=t", "-c", "user.email=t@t"] + list(cmd))
+
+def write_file(path, text):
+	with open(path, "w") as f:
+		f.write(text)
+
+def read_file(path):
+	with open(path, "r") as f:
+		return f.read()
+
+
+# start with testing procedure
+# ======================================================================================================================
+with tempfile.TemporaryDirectory() as tmp_dir:
+	# minimal progplatform repository, without make
+	pp_dir = os.path.join(tmp_dir, "progplat")
+	os.makedirs(os.path.join(pp_dir, "all/inc/experiment"))
+	subprocess.check_call(["git", "init", "-q", pp_dir])
+	git(pp_dir, "commit", "-q", "--allow-empty", "-m", "init")
+	pp = progplatform.ProgPlatform(pp_dir)
+	pp.board_type = "rpi3"
+	write_file(os.path.join(pp_dir, "Makefile.config"), "PROGPLAT_BOARD =rpi3\n")
+	write_file(os.path.join(pp_dir, "all/inc/experiment/asm.h"), "nop\n")
+
+
+	# test build cache
+	# ======================================================================================================================
+	bc = progplatform.BuildCache(os.path.join(tmp_dir, "cache"))
+	key_1 = bc.get_key(pp)
+	assert(not bc.restore(pp, key_1))
+	# nothing built yet
+	ensure_failing(bc.store, pp, key_1)
+	os.makedirs(os.path.join(pp_dir, "output"))
+	write_file(os.path.join(pp_dir, "output/program.elf"), "binary 1")
+	bc.store(pp, key_1)
+
+	# any input changes the key
+	write_file(os.path.join(pp_dir, "all/inc/experiment/asm_setup_1.h"), "mov x0, #1\n")
+	key_2 = bc.get_key(pp)
+	pp.board_type = "rpi4"
+	key_3 = bc.get_key(pp)
+	assert(len(set([key_1, key_2, key_3])) == 3)
+
+	# restored files are newer than the inputs
+	write_file(os.path.join(pp_dir, "output/program.elf"), "binary 2")
+	assert(bc.restore(pp, key_1))
+	assert(read_file(os.path.join(pp_dir, "output/program.elf")) == "binary 1")
+	mtime_output = os.path.getmtime(os.path.join(pp_dir, "output/program.elf"))
+	mtime_input  = os.path.getmtime(os.path.join(pp_dir, "all/inc/experiment/asm_setup_1.h"))
+	assert(mtime_output >= mtime_input)
+	assert((bc.n_hits, bc.n_misses) == (1, 1))
+	assert(bc.get_stats_str() == "1 hits, 1 misses (50.0% hit rate), 0 built ahead, 0 evicted")
+
+	# outputs built ahead are no hits when restored the first time, the least recently used entries are evicted
+	bc_s = progplatform.BuildCache(os.path.join(tmp_dir, "cache_small"), max_entries=2)
+	bc_s.store(pp, "key_a", prebuilt=True)
+	assert(bc_s.restore(pp, "key_a") and bc_s.restore(pp, "key_a"))
+	assert((bc_s.n_hits, bc_s.n_prebuilt) == (1, 1))
+	bc_s.store(pp, "key_b")
+	os.utime(os.path.join(tmp_dir, "cache_small/ke/key_a"), (1, 1))
+	bc_s.store(pp, "key_c")
+	assert(list(map(bc_s.contains, ["key_a", "key_b", "key_c"])) == [False, True, True])
+	assert(not bc_s.restore(pp, "key_a"))
+	assert(bc_s.get_stats_str() == "1 hits, 1 misses (50.0% hit rate), 1 built ahead, 1 evicted")
+
+
+	# test persistent workspaces, cloned once and reset between experiments
+	# ======================================================================================================================
+	os.remove(os.path.join(pp_dir, "all/inc/experiment/asm_setup_1.h"))
+	git(pp_dir, "add", "all")
+	git(pp_dir, "commit", "-q", "-m", "asm")
+	ws = progplatform.Workspaces(pp, "persistent")
+	ws_pp = ws.get(7)
+	ws_exp_dir = os.path.join(ws_pp.progplat_path, "all/inc/experiment")
+	assert(ws_pp.progplat_path == os.path.join(pp_dir, "temp/ws_7"))
+	assert(ws_pp.get_commit_hash() == pp.get_commit_hash())
+	ws_pp.check_clean()
+	ws_pp.write_experiment_file("asm.h", "changed\n")
+	ws_pp.write_experiment_file("asm_setup_1.h", "new\n")
+	write_file(os.path.join(ws_pp.progplat_path, "Makefile.config"), "PROGPLAT_BOARD =rpi3\n")
+	os.makedirs(os.path.join(ws_pp.progplat_path, "output"))
+	ws.cleanup(ws_pp, "all")
+	assert(ws.get(7) is ws_pp)
+	assert(sorted(os.listdir(ws_pp.progplat_path)) == [".git", "all"])
+	assert(sorted(os.listdir(ws_exp_dir)) == ["asm.h"])
+	assert(read_file(os.path.join(ws_exp_dir, "asm.h")) == "nop\n")
+	assert(list(map(lambda k: ws.stats[k][0], ["create", "reuse", "cleanup"])) == [1, 1, 1])
+	# only the experiment files are reset, a full cleanup every session_verify_every cleanups
+	write_file(os.path.join(ws_pp.progplat_path, "notes.txt"), "not from an experiment\n")
+	ws.cleanup(ws_pp, "all")
+	assert(os.path.isfile(os.path.join(ws_pp.progplat_path, "notes.txt")))
+	ws_2 = progplatform.Workspaces(pp, "persistent", session_verify_every=1)
+	ws_2.cleanup(ws_pp, "all")
+	assert(not os.path.isfile(os.path.join(ws_pp.progplat_path, "notes.txt")))
+	ensure_failing(progplatform.Workspaces, pp, "worktree")
+
+
+	# test session mode, only the written files are reset, with a full verification every third cleanup
+	# ======================================================================================================================
+	branch = subprocess.check_output(["git", "-C", ws_pp.progplat_path, "rev-parse", "--abbrev-ref", "HEAD"]).decode("ascii").strip()
+	ws_pp.start_session(branch, verify_every=3)
+	session_hash = ws_pp.get_commit_hash()
+	for i in range(2):
+		ws_pp.change_branch(branch)
+		ws_pp.write_experiment_file("asm.h", f"changed {i}\n")
+		ws_pp.write_experiment_file("asm_setup_1.h", "new\n")
+		write_file(os.path.join(ws_pp.progplat_path, "Makefile.config"), "PROGPLAT_BOARD =rpi3\n")
+		os.makedirs(os.path.join(ws_pp.progplat_path, "temp"))
+		os.makedirs(os.path.join(ws_pp.progplat_path, "output"))
+		ws_pp.check_clean("all")
+		assert(sorted(os.listdir(ws_pp.progplat_path)) == [".git", "all"])
+		assert(read_file(os.path.join(ws_exp_dir, "asm.h")) == "nop\n")
+	assert(ws_pp.session["n_full"] == 1)
+	ensure_failing(ws_pp.change_branch, "other_branch")
+
+	# the verification notices changes of the repository
+	git(ws_pp.progplat_path, "commit", "-q", "--allow-empty", "-m", "other")
+	assert(ws_pp.get_commit_hash() == session_hash)
+	assert(ws_pp.get_commit_hash(False) != session_hash)
+	ensure_failing(ws_pp.check_clean, "all")
+	ws_pp.stop_session()
+	assert(ws_pp.get_commit_hash() != session_hash)
+
+
+# all successful
+# ======================================================================================================================
+print()
+print("All tests finished successfully.")